@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio interface for the blocking instrument drivers.
+Every driver call is bridged to a worker thread, one worker per VISA address,
+so a single instrument never sees overlapping transfers while independent
+instruments are read concurrently (step time ~ max() instead of sum()).
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_executors = {}    # visa address -> single-thread executor
+_lock = threading.Lock()
+
+def executor_for(driver):
+	'''
+	:param driver: any driver object, drivers opened from InstrumentPool are keyed by visa_name
+	:return: the single-worker executor serialising all I/O of that instrument
+	'''
+	key = getattr(driver, 'visa_name', None) or id(driver)
+	with _lock:
+		if key not in _executors:
+			_executors[key] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'visa-{key}')
+		return _executors[key]
+
+def shutdown():
+	'''
+	Stop every worker thread, pending calls are completed first.
+	'''
+	with _lock:
+		for executor in _executors.values():
+			executor.shutdown(wait=True)
+		_executors.clear()
+
+def run(coro):
+	'''
+	Run a coroutine from blocking code. Works inside an interpreter that already
+	runs an event loop (Spyder/IPython console) by using a helper thread.
+	'''
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return asyncio.run(coro)
+	result = {}
+	def target():
+		try:
+			result['value'] = asyncio.run(coro)
+		except BaseException as err:
+			result['error'] = err
+	thread = threading.Thread(target=target)
+	thread.start()
+	thread.join()
+	if 'error' in result:
+		raise result['error']
+	return result['value']
+
+
+class AsyncInstrument(object):
+	'''
+	Await-able wrapper of a driver: await inst.write(...), await inst.query(...)
+	and await inst.<any driver method>(...).
+	'''
+	def __init__(self, driver):
+		self.driver = driver
+		self.executor = executor_for(driver)
+
+	async def call(self, func, *args, **kwargs):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+	def __getattr__(self, name):
+		attr = getattr(self.driver, name)
+		if not callable(attr):
+			return attr
+		@functools.wraps(attr)
+		async def method(*args, **kwargs):
+			return await self.call(attr, *args, **kwargs)
+		return method
+
+	async def write(self, string):
+		return await self.call(self.driver.write, string)
+
+	async def query(self, string):
+		return await self.call(self.driver.query, string)
+
+	async def wait_until(self, check, poll:float = 0.02, timeout:float = None):
+		'''
+		:param check: name of a boolean driver method, e.g. 'check_count_finish'
+		:param poll: interval between checks, the event loop serves other instruments meanwhile
+		:param timeout: raise TimeoutError after timeout seconds, None for no limit
+		'''
+		func = getattr(self.driver, check)
+		start_time = time.monotonic()
+		while not await self.call(func):
+			if (timeout is not None) and (time.monotonic()-start_time > timeout):
+				raise TimeoutError(f'{check} still False after {timeout:g} s')
+			await asyncio.sleep(poll)
+
+	async def wait_count_finish(self, timeout:float = None, poll:float = 0.02, srq:bool = True) -> bool:
+		'''
+		SR400/sr400: wait for the end of the current count period, the driver's wait (service request
+		or polling) runs in the worker thread of the instrument while the event loop serves the others.
+		:return: True when the count period ended, False on timeout
+		'''
+		return await self.call(self.driver.wait_count_finish, timeout, poll, srq)
+
+	async def wait_scan_finish(self, timeout:float = None, poll:float = 0.1, srq:bool = True) -> bool:
+		'''
+		SR400/sr400: wait for the end of the N-period scan, as wait_count_finish().
+		:return: True when the scan ended, False on timeout
+		'''
+		return await self.call(self.driver.wait_scan_finish, timeout, poll, srq)
+
+	async def wait_settled(self):
+		'''
+		SR830: sleep out the rest of the settle time, the event loop serves the other instruments meanwhile.
+		'''
+		await asyncio.sleep(self.driver.settle_remaining())
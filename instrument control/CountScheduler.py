@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive counting time for SR400 sweeps.
+A CountScheduler picks the count preset of every point from a target relative
+Poisson error: N = 1/target^2 counts are needed, so the preset is N over the
+expected count rate, taken from the previous point. A point that turns out
+dimmer than expected is topped up with a second count sized from its own
+provisional rate. Presets stay within [min_time, max_time] and, with a total
+time budget, within the share of the budget left per remaining point, so
+bright points no longer waste integration time and dim points get as much as
+the budget allows.
+"""
+
+import math
+
+class CountScheduler(object):
+	def __init__(self, counter, target:float = 0.03, min_time:float = 0.05, max_time:float = 5.0,\
+				 budget:float = None, points:int = None, channel = 'ch1', timeout:float = 10.0):
+		'''
+		:param counter: SRS400.sr400 or StanfordResearch.SR400, counting with the T preset
+		:param target: relative error 1/sqrt(N) wanted for every point
+		:param min_time, max_time: bounds of the count preset in seconds
+		:param budget: total counting time of the sweep in seconds, None for no limit
+		:param points: number of points the budget is shared by
+		:param channel: counter read, 'ch1' or 'ch2'
+		:param timeout: extra seconds to wait for a count period to end
+		'''
+		if (budget is not None) and not points:
+			raise ValueError('A time budget needs the number of points')
+		self.counter = counter
+		self.target = target
+		self.min_time = min_time
+		self.max_time = max_time
+		self.budget = budget
+		self.points = points
+		self.channel = channel
+		self.timeout = timeout
+		self.rate = None         # count rate of the last point, counts/s
+		self.spent = 0.0         # counting time used so far
+		self.done = 0            # points counted
+		self.last_time = 0.0     # counting time of the last point
+		self.last_count = 0
+
+	@property
+	def needed(self) -> int:
+		'''
+		counts giving the target relative error
+		'''
+		return math.ceil(1.0/self.target**2)
+
+	def limit(self) -> float:
+		'''
+		:return: the longest preset allowed for the next point, max_time or the budget share left per point
+		'''
+		if self.budget is None:
+			return self.max_time
+		share = (self.budget-self.spent)/max(self.points-self.done, 1)
+		return max(self.min_time, min(self.max_time, share))
+
+	def preset(self, rate:float = None) -> float:
+		'''
+		:param rate: expected count rate, None before the first point (a provisional count of min_time)
+		:return: count preset in seconds reaching the target at that rate, within the bounds
+		'''
+		if rate is None:
+			return self.min_time
+		if rate <= 0:
+			return self.limit()
+		return min(max(self.needed/rate, self.min_time), self.limit())
+
+	def _count(self, preset:float) -> int:
+		self.counter.set_count_preset('T', preset)
+		self.counter.count_restart()    # a fresh count period with the new preset
+		if not self.counter.wait_count_finish(timeout = preset + self.timeout):
+			raise TimeoutError('SR400 count period of %g s did not end' %preset)
+		return self.counter.read_last_count(channel = self.channel)
+
+	def count(self) -> int:
+		'''
+		Count one point: a preset from the rate of the previous point, topped up when
+		the count falls short of the target and the bounds allow a longer count.
+		:return: counts of the point, over last_time seconds
+		'''
+		limit = self.limit()
+		elapsed = self.preset(self.rate)
+		counts = self._count(elapsed)
+		if counts < self.needed:
+			rest = min(self.preset(counts/elapsed), limit) - elapsed
+			if rest >= self.min_time:
+				counts += self._count(rest)
+				elapsed += rest
+		self.rate = counts/elapsed
+		self.spent += elapsed
+		self.done += 1
+		self.last_time, self.last_count = elapsed, counts
+		return counts
+
+	def error(self) -> float:
+		'''
+		:return: relative Poisson error of the last point, inf for no counts
+		'''
+		return 1.0/math.sqrt(self.last_count) if self.last_count else float('inf')
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Crash-safe, append-only storage of measurement rows.
+Rows are kept in a small fixed-size block and appended as raw float64 to
+<path>.bin every flush_every rows (or flush_seconds), followed by fsync, so a
+crash or Ctrl-C loses at most one block and memory stays bounded however long
+the log runs. Column names and metadata (DevName, Temperature, ...) are kept in
+<path>.json. load() maps the file back (also after a crash) and export_txt /
+export_mat produce .txt/.mat files. A sweep script stores its own file layout
+(layout()) with the log, export() then writes exactly the .txt/.mat files of the
+script, at the end of the run or from the log of an interrupted one.
+"""
+
+import os
+import json
+import time
+import numpy as np
+
+DTYPE = '<f8'
+
+class DataWriter(object):
+	def __init__(self, path, columns, metadata:dict = None, flush_every:int = 100, flush_seconds:float = 10.0):
+		'''
+		:param path: file path without extension, <path>.bin and <path>.json are written
+		:param columns: column names, every row appended has one value per column
+		:param metadata: JSON-serialisable attributes stored with the data, e.g. {'DevName': DevName, 'Temperature': 2}
+		:param flush_every: rows kept in memory before they are written and synced to disk
+		:param flush_seconds: also write out the pending rows when the last write is older than this
+		'''
+		self.path = path
+		self.columns = list(columns)
+		self.flush_every = flush_every
+		self.flush_seconds = flush_seconds
+		self.block = np.empty((flush_every, len(self.columns)), dtype=DTYPE)
+		self.pending = 0
+		self.rows = 0
+		rowbytes = self.block.itemsize*len(self.columns)
+		if os.path.isfile(path + '.bin'):    # resume an interrupted log
+			info = read_info(path)
+			if info['columns'] != self.columns:
+				raise ValueError(f'{path}.bin exists with columns {info["columns"]}')
+			size = os.path.getsize(path + '.bin')
+			self.rows = size//rowbytes
+			if size % rowbytes:    # drop a row cut in half by a crash
+				os.truncate(path + '.bin', self.rows*rowbytes)
+		info = {'columns': self.columns, 'dtype': DTYPE, 'metadata': metadata or {}, 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+		with open(path + '.json', 'w') as file:
+			json.dump(info, file, indent=1)
+		self.file = open(path + '.bin', 'ab')
+		self.last_flush = time.monotonic()
+
+	def append(self, row):
+		'''
+		:param row: one value per column
+		'''
+		self.block[self.pending] = row
+		self.pending += 1
+		if (self.pending == self.flush_every) or (time.monotonic()-self.last_flush > self.flush_seconds):
+			self.flush()
+
+	def extend(self, rows):
+		'''
+		:param rows: 2D array-like with one row per point, written through without extra copies
+		'''
+		rows = np.asarray(rows, dtype=DTYPE).reshape(-1, len(self.columns))
+		self.flush()
+		self.file.write(rows.tobytes())
+		self.rows += len(rows)
+		self.flush()
+
+	def flush(self):
+		'''
+		Write the pending rows and sync them to disk.
+		'''
+		if self.pending:
+			self.file.write(self.block[:self.pending].tobytes())
+			self.rows += self.pending
+			self.pending = 0
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.last_flush = time.monotonic()
+
+	def close(self):
+		if not self.file.closed:
+			self.flush()
+			self.file.close()
+
+	def __len__(self):
+		return self.rows + self.pending
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()    # also on Ctrl-C or an instrument error, the rows taken so far are kept
+
+
+def read_info(path):
+	'''
+	:return: {'columns', 'dtype', 'metadata', 'created'} stored with <path>.bin
+	'''
+	with open(path + '.json') as file:
+		return json.load(file)
+
+def load(path):
+	'''
+	:return: ({column: array}, metadata), the arrays are read-only memory maps of <path>.bin,
+		only complete rows are mapped so a log cut by a crash loads as well
+	'''
+	info = read_info(path)
+	ncol = len(info['columns'])
+	nrow = os.path.getsize(path + '.bin')//(np.dtype(info['dtype']).itemsize*ncol)
+	if nrow == 0:
+		return {name: np.empty(0) for name in info['columns']}, info['metadata']
+	table = np.memmap(path + '.bin', dtype=info['dtype'], mode='r', shape=(nrow, ncol))
+	return {name: table[:, k] for k, name in enumerate(info['columns'])}, info['metadata']
+
+def export_txt(path, columns = None, header:str = None, fmt:str = '%e', chunk:int = 100000):
+	'''
+	Write <path>.txt in the np.savetxt layout of the sweep scripts, chunk rows at a time.
+	:param columns: stored columns to export in this order, default all
+	:param header: header line, default the column names separated by tabs
+	'''
+	data, metadata = load(path)
+	columns = list(data) if columns is None else list(columns)
+	header = '\t'.join(columns) if header is None else header
+	num = len(data[columns[0]]) if columns else 0
+	with open(path + '.txt', 'w') as file:
+		file.write('# ' + header + '\n')
+		for start in range(0, num, chunk):
+			block = np.column_stack([data[name][start:start+chunk] for name in columns])
+			np.savetxt(file, block, fmt=fmt, delimiter='\t')
+
+def export_mat(path, names:dict = None):
+	'''
+	Write <path>.mat for MATLAB post-processing.
+	:param names: {stored column: MATLAB variable name}, e.g. {'Voltage': 'volt', 'Time': 't'}, default all columns
+	'''
+	import scipy.io
+	data, metadata = load(path)
+	names = {name: name for name in data} if names is None else names
+	scipy.io.savemat(path + '.mat', mdict = {var: np.asarray(data[name]) for name, var in names.items()})
+
+def layout(txt, header:str, mat:dict, resistance = None, order:str = None) -> dict:
+	'''
+	File layout of a sweep script, passed as metadata = {..., 'layout': layout(...)} to the DataWriter.
+	:param txt: columns of the .txt file in order, 'Resistance' for the derived column
+	:param header: header line of the .txt file
+	:param mat: {MATLAB variable: column}
+	:param resistance: (voltage column, current column, column whose zeros give inf) of Resistance = V/I
+	:param order: column the rows are sorted by (stable) before saving, e.g. the set values of an adaptive sweep, None for the logged order
+	'''
+	return {'txt': list(txt), 'header': header, 'mat': dict(mat), 'resistance': resistance, 'order': order}
+
+def table(path) -> dict:
+	'''
+	:return: {column: array} of the log with the derived Resistance column and the row order of its layout
+	'''
+	data, metadata = load(path)
+	spec = metadata['layout']
+	data = {name: np.array(column) for name, column in data.items()}
+	if spec['order'] is not None:
+		order = np.argsort(data[spec['order']], kind='stable')
+		data = {name: column[order] for name, column in data.items()}
+	if spec['resistance'] is not None:
+		volt, curr, zero = (data[name] for name in spec['resistance'])
+		with np.errstate(divide='ignore', invalid='ignore'):
+			data['Resistance'] = np.where(zero == 0.0, float("inf"), volt/curr)
+	return data
+
+def export(path, fmt:str = '%e'):
+	'''
+	Write <path>.txt and <path>.mat in the layout stored with the log, the files the sweep script
+	saves at the end of a run. Recovers them from the log after a crash or Ctrl-C.
+	'''
+	import scipy.io
+	spec = read_info(path)['metadata']['layout']
+	data = table(path)
+	np.savetxt(path + '.txt', np.array([data[name] for name in spec['txt']]).T, fmt=fmt, delimiter='\t', header=spec['header'])
+	scipy.io.savemat(path + '.mat', mdict = {var: data[name] for var, name in spec['mat'].items()})
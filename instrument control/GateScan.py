@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Time-resolved photon counting with the SR400 gate-delay scan.
+A DelayHistogram holds the counts of every gate delay as a NumPy array and
+accumulates scan after scan in place, together with the number of scans that
+covered every delay, so the mean count and its Poisson uncertainty are
+available per bin at any time. Histograms of partial runs (other sessions,
+other delay ranges with the same step) merge by delay, and save()/load() keep
+them between sessions. acquire() repeats the scan configured on the counter
+N times, waiting for the end of each scan on the service request and reading
+it back with one buffer dump.
+"""
+
+import time
+import datetime
+import numpy as np
+
+class DelayHistogram(object):
+	def __init__(self, start:float, step:float, bins:int, channels:int = 1):
+		'''
+		:param start: gate delay of the first bin in seconds, the delay of the first scan period
+		:param step: gate delay step between the bins in seconds
+		:param bins: number of delays, the periods of one scan
+		:param channels: 2 to accumulate counter A and B side by side ('both')
+		'''
+		self.start = start
+		self.step = step
+		self.delay = start + step*np.arange(bins)
+		self.counts = np.zeros((bins,) if channels == 1 else (bins, channels), dtype=np.int64)
+		self.exposures = np.zeros(bins, dtype=np.int64)    # scans that covered each delay
+
+	@classmethod
+	def from_counter(cls, counter, gate = 'A', channel = 'ch1'):
+		'''
+		:param counter: sr400/SR400 with the gate-delay scan configured
+		:return: an empty histogram on the delay axis of the scan (start delay, scan step, N periods)
+		'''
+		index = '0' if gate == 'A' else '1'
+		start = float(counter.query('GD ' + index))
+		step = float(counter.gate_scan_step(channel = gate, query = True))
+		return cls(start, step, counter.scan_periods(), 2 if channel == 'both' else 1)
+
+	def index(self, delays) -> np.ndarray:
+		'''
+		:return: bin index of every delay, -1 for delays off the axis
+		'''
+		index = np.rint((np.asarray(delays, dtype=float)-self.start)/self.step).astype(np.int64)
+		return np.where((index >= 0) & (index < len(self.delay)), index, -1)
+
+	def add(self, counts, delays = None):
+		'''
+		Accumulate one scan in place.
+		:param counts: counts of the scan periods, (n,) or (n, channels)
+		:param delays: gate delay of every count, None for the periods of a scan starting at the first bin
+		:return: self
+		'''
+		counts = np.asarray(counts, dtype=np.int64)
+		if delays is None:
+			n = min(len(counts), len(self.delay))
+			self.counts[:n] += counts[:n]
+			self.exposures[:n] += 1
+		else:
+			index = self.index(delays)
+			keep = index >= 0
+			np.add.at(self.counts, index[keep], counts[keep])
+			np.add.at(self.exposures, index[keep], 1)
+		return self
+
+	def merge(self, other):
+		'''
+		Add the counts of another histogram with the same delay step, e.g. a partial run, in place.
+		Delays of other outside this axis are dropped.
+		:return: self
+		'''
+		if not np.isclose(other.step, self.step):
+			raise ValueError('Histograms with delay steps %g and %g cannot be merged' %(self.step, other.step))
+		index = self.index(other.delay)
+		keep = index >= 0
+		np.add.at(self.counts, index[keep], other.counts[keep])
+		np.add.at(self.exposures, index[keep], other.exposures[keep])
+		return self
+
+	def mean(self) -> np.ndarray:
+		'''
+		:return: counts per scan of every delay, nan where no scan has been added
+		'''
+		exposures = self.exposures if self.counts.ndim == 1 else self.exposures[:, None]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return np.where(exposures > 0, self.counts/exposures, np.nan)
+
+	def sigma(self) -> np.ndarray:
+		'''
+		:return: Poisson standard error of mean(), sqrt(counts)/scans
+		'''
+		exposures = self.exposures if self.counts.ndim == 1 else self.exposures[:, None]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return np.where(exposures > 0, np.sqrt(self.counts)/exposures, np.nan)
+
+	def save(self, path):
+		'''
+		Write the histogram to path.npz, load() reads it back for merging with later runs.
+		'''
+		np.savez(path, start=self.start, step=self.step, counts=self.counts, exposures=self.exposures)
+
+	@classmethod
+	def load(cls, path):
+		data = np.load(path if path.endswith('.npz') else path + '.npz')
+		counts = data['counts']
+		hist = cls(float(data['start']), float(data['step']), len(counts), 1 if counts.ndim == 1 else counts.shape[1])
+		hist.counts[:] = counts
+		hist.exposures[:] = data['exposures']
+		return hist
+
+
+def acquire(counter, histogram:DelayHistogram, repeats:int = 1, channel = 'ch1', timeout:float = None, callback = None):
+	'''
+	Repeat the gate-delay scan configured on the counter (gate_mode SCAN, gate_scan_step,
+	scan_periods, scan_end_mode STOP) and accumulate every scan into histogram.
+	:param counter: sr400/SR400
+	:param repeats: number of scans
+	:param channel: 'ch1', 'ch2' or 'both', as the channels of the histogram
+	:param timeout: seconds to wait for one scan, None for no limit
+	:param callback: called as callback(repeat, histogram) after every scan, e.g. a progress print
+	:return: histogram
+	'''
+	num = len(histogram.delay)
+	nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+	print(f'[{nowtime}] Execute {repeats} Gate Delay Scans of {num} periods...')
+	start_time = time.time()
+	for repeat in range(repeats):
+		counter.count_restart()    # reset the scan to the start delay and count
+		if not counter.wait_scan_finish(timeout = timeout):
+			counter.count_stop()
+			raise TimeoutError('Gate delay scan %d still running after %g s' %(repeat+1, timeout))
+		histogram.add(counter.read_buffer_all(channel, num))
+		if callback is not None:
+			callback(repeat+1, histogram)
+	nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+	print(f'[{nowtime}] --> Gate Delay Scans Finished in {time.time()-start_time:.1f} s!')
+	return histogram
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide VISA session pool.
+One pyvisa ResourceManager per process and one open session per VISA address,
+shared by every driver that talks to the same instrument and kept open between
+script runs in the same interpreter.
+Installed PyVISA for GPIB communication. use_backend() (or INSTRUMENT_SIM=1)
+swaps the VISA library for the simulated instruments of InstrumentSim.
+"""
+
+import os
+import threading
+import pyvisa
+import StateCache
+
+_rm = None
+_backend = None    # resource manager used instead of the VISA library, e.g. InstrumentSim.SimResourceManager()
+_sessions = {}    # visa_name -> [session, number of drivers holding it]
+_idn = {}         # visa_name -> cached *IDN? reply
+_caches = {}      # visa_name -> StateCache shared by the drivers of that instrument
+_buses = {}       # GPIB board (or the address of a point-to-point interface) -> lock held by every transfer on it
+_lock = threading.RLock()
+
+def use_backend(manager = None):
+	'''
+	:param manager: object with the pyvisa ResourceManager interface used instead of the VISA
+		library, e.g. InstrumentSim.SimResourceManager(), None to go back to the VISA library.
+		Sessions opened so far are closed.
+	'''
+	global _backend
+	with _lock:
+		close_all()
+		_backend = manager
+
+def resource_manager():
+	'''
+	:return: the process-wide pyvisa ResourceManager, created on first use
+	'''
+	global _rm
+	with _lock:
+		if _rm is None:
+			if _backend is not None:
+				_rm = _backend
+			elif os.environ.get('INSTRUMENT_SIM'):
+				import InstrumentSim
+				_rm = InstrumentSim.SimResourceManager()
+			else:
+				_rm = pyvisa.ResourceManager()
+		return _rm
+
+def simulated():
+	'''
+	:return: True when the sessions are served by simulated instruments
+	'''
+	return getattr(resource_manager(), 'simulated', False)
+
+def _alive(session):
+	try:
+		session.session
+	except pyvisa.errors.InvalidSession:
+		return False
+	return True
+
+def open_session(visa_name, timeout:int = None):
+	'''
+	:param visa_name: VISA address, e.g. 'GPIB0::18::INSTR'
+	:param timeout: session timeout in ms, the current value is kept if None
+	:return: the shared session of visa_name, opened on first use (or when the cached one was closed)
+	'''
+	with _lock:
+		entry = _sessions.get(visa_name)
+		if (entry is None) or (not _alive(entry[0])):
+			entry = _sessions[visa_name] = [resource_manager().open_resource(visa_name), 0]
+			_idn.pop(visa_name, None)
+			state_cache(visa_name).invalidate()
+		entry[1] += 1
+		if timeout is not None:
+			entry[0].timeout = timeout
+		return entry[0]
+
+def release_session(visa_name):
+	'''
+	Drop one driver reference. The session itself stays open in the pool so the
+	next driver (or the next script run) reuses it, call close_all to close it.
+	'''
+	with _lock:
+		entry = _sessions.get(visa_name)
+		if entry is not None:
+			entry[1] = max(0, entry[1]-1)
+
+def identify(visa_name):
+	'''
+	:return: the *IDN? reply of visa_name, queried once and cached afterwards
+	'''
+	with _lock:
+		if visa_name not in _idn:
+			_idn[visa_name] = open_session(visa_name).query('*IDN?').strip()
+			release_session(visa_name)
+		return _idn[visa_name]
+
+def state_cache(visa_name):
+	'''
+	:return: the StateCache of visa_name, the settings last written by any driver of that instrument
+	'''
+	with _lock:
+		if visa_name not in _caches:
+			_caches[visa_name] = StateCache.StateCache()
+		return _caches[visa_name]
+
+def bus_lock(visa_name):
+	'''
+	:return: the lock of the bus visa_name is on, shared by every address of one GPIB board
+		('GPIB0::18::INSTR' -> 'GPIB0'), other interfaces get one lock per address
+	'''
+	bus = visa_name.split('::')[0] if visa_name.upper().startswith('GPIB') else visa_name
+	with _lock:
+		return _buses.setdefault(bus.upper(), threading.RLock())
+
+def share_bus(session, visa_name):
+	'''
+	Make every transfer of session hold bus_lock(visa_name), so threads driving
+	different instruments of one board never interleave on the bus. A query holds
+	the lock from its write to the end of its read. Calling it again does nothing.
+	:param session: pyvisa resource (or simulated session) of visa_name
+	:return: session
+	'''
+	lock = bus_lock(visa_name)
+	for name in ('write', 'write_raw', 'read', 'read_raw', 'read_bytes', 'query', 'query_binary_values', 'query_ascii_values'):
+		if not hasattr(type(session), name) or getattr(getattr(session, name), 'bus_lock', None) is lock:
+			continue
+		def locked(*args, _name = name, **kwargs):
+			with lock:
+				return getattr(type(session), _name)(session, *args, **kwargs)    # looked up per call, so profiling patches still apply
+		locked.bus_lock = lock
+		setattr(session, name, locked)
+	return session
+
+def adapter(visa_name):
+	'''
+	:return: pymeasure adapter over the pooled session of visa_name, to pass to a pymeasure instrument,
+		e.g. keithley2450.Keithley2450(adapter(visa_name)), so its transfers share the session, the
+		state cache and bus_lock with the other drivers, release_session(visa_name) when done
+	'''
+	if simulated():
+		return resource_manager().adapter(open_session(visa_name))
+	from pymeasure.adapters import Adapter, VISAAdapter
+
+	class PooledAdapter(VISAAdapter):
+		def __init__(self, session):
+			Adapter.__init__(self)    # VISAAdapter.__init__ would open a resource manager and session of its own
+			self.resource_name = visa_name
+			self.manager = resource_manager()
+			self.connection = session
+
+		def close(self):    # also called on garbage collection, the session stays open in the pool
+			pass
+
+	return PooledAdapter(open_session(visa_name))
+
+def open_serial(port, **kwargs):
+	'''
+	:param kwargs: serial.Serial settings (baudrate, bytesize, parity, stopbits, timeout)
+	:return: serial.Serial(port, **kwargs), or the simulated port with the simulated backend
+	'''
+	if simulated():
+		return resource_manager().open_serial(port, **kwargs)
+	import serial
+	return serial.Serial(port = port, **kwargs)
+
+def sessions():
+	'''
+	:return: {visa_name: number of drivers holding the session} for every open session
+	'''
+	with _lock:
+		return {name: entry[1] for name, entry in _sessions.items()}
+
+def close_all():
+	'''
+	Close every pooled session and the resource manager.
+	'''
+	global _rm
+	with _lock:
+		for session, refs in _sessions.values():
+			try:
+				session.close()
+			except Exception:
+				pass
+		_sessions.clear()
+		_idn.clear()
+		_caches.clear()
+		_buses.clear()
+		if _rm is not None:
+			try:
+				_rm.close()
+			except Exception:
+				pass
+			_rm = None
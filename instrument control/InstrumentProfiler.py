@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of instrument I/O.
+While a profile() context is active the I/O methods of pyvisa resources,
+pyserial ports and the simulated sessions, time.sleep and the pyplot drawing
+calls are wrapped, so every command is timed per instrument and per command
+header (call count, bytes, latency histogram), and the wall time of the block
+is split into instrument I/O, sleeps, plotting and the Python left over.
+Nothing is patched outside the context.
+"""
+
+import os
+import sys
+import time
+import threading
+import numpy as np
+
+BINS = np.logspace(-6, 2, 41)    # latency histogram edges, 1 us to 100 s, 5 bins per decade
+
+_state = threading.local()    # depth > 0 while inside a timed call, nested calls are not timed again
+_active = None
+
+class Stat(object):
+	'''
+	Accumulated timing of one command header, one sleep caller or one plotting call.
+	'''
+	__slots__ = ('calls', 'total', 'max', 'bytes_out', 'bytes_in', 'hist')
+
+	def __init__(self):
+		self.calls = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.bytes_out = 0
+		self.bytes_in = 0
+		self.hist = np.zeros(len(BINS)+1, dtype=np.int64)
+
+	def add(self, elapsed, bytes_out = 0, bytes_in = 0):
+		self.calls += 1
+		self.total += elapsed
+		self.max = max(self.max, elapsed)
+		self.bytes_out += bytes_out
+		self.bytes_in += bytes_in
+		self.hist[np.searchsorted(BINS, elapsed)] += 1
+
+	def percentile(self, q):
+		'''
+		:return: q-th percentile of the latency, from the histogram (upper bin edge)
+		'''
+		if not self.calls:
+			return 0.0
+		k = int(np.searchsorted(np.cumsum(self.hist), q/100*self.calls))
+		return min(BINS[min(k, len(BINS)-1)], self.max)
+
+
+def _header(message):
+	if isinstance(message, (bytes, bytearray)):
+		message = message.decode(errors='replace')
+	message = str(message).strip()
+	return message.split(None, 1)[0] if message else '(empty)'
+
+def _size(value):
+	if value is None:
+		return 0
+	if isinstance(value, str):
+		return len(value.encode(errors='replace'))
+	if isinstance(value, (bytes, bytearray)):
+		return len(value)
+	if isinstance(value, np.ndarray):
+		return value.nbytes
+	if isinstance(value, (list, tuple)):
+		return 4*len(value)
+	return 0
+
+def _resource(session):
+	return str(getattr(session, 'resource_name', None) or getattr(session, 'port', None) or type(session).__name__)
+
+
+class Profile(object):
+	def __init__(self):
+		self.io = {}        # instrument -> {header: Stat}
+		self.sleeps = {}    # 'file:function' -> Stat
+		self.plots = {}     # pyplot call -> Stat
+		self.last = {}      # instrument -> header of the last command written
+		self.wall = 0.0
+		self.lock = threading.Lock()
+		self._patches = []
+
+	#### RECORDING ####
+
+	def record_io(self, session, kind, args, result, elapsed):
+		name = _resource(session)
+		with self.lock:
+			if kind == 'read':
+				header = self.last.get(name, '(read)')
+				out, inp = 0, _size(result)
+			else:
+				header = _header(args[0]) if args else '(empty)'
+				self.last[name] = header
+				out = _size(args[0]) if args else 0
+				inp = _size(result) if kind == 'query' else 0
+			self.io.setdefault(name, {}).setdefault(header, Stat()).add(elapsed, out, inp)
+
+	def record(self, table, key, elapsed):
+		with self.lock:
+			table.setdefault(key, Stat()).add(elapsed)
+
+	#### PATCHING ####
+
+	def _timed(self, original, on_done):
+		def wrapper(*args, **kwargs):
+			if getattr(_state, 'depth', 0):
+				return original(*args, **kwargs)
+			_state.depth = 1
+			result = None
+			start = time.perf_counter()
+			try:
+				result = original(*args, **kwargs)
+				return result
+			finally:
+				elapsed = time.perf_counter()-start
+				_state.depth = 0
+				on_done(args, result, elapsed)
+		wrapper.__wrapped__ = original
+		return wrapper
+
+	def _patch(self, owner, name, wrapper):
+		self._patches.append((owner, name, owner.__dict__.get(name, None), name in owner.__dict__))
+		setattr(owner, name, wrapper)
+
+	def _patch_io(self, cls, methods):
+		for name, kind in methods.items():
+			original = getattr(cls, name, None)
+			if original is None:
+				continue
+			done = lambda args, result, elapsed, kind=kind: self.record_io(args[0], kind, args[1:], result, elapsed)
+			self._patch(cls, name, self._timed(original, done))
+
+	def install(self):
+		io_methods = {'write': 'write', 'write_raw': 'write', 'read': 'read', 'read_raw': 'read', 'read_bytes': 'read',\
+					  'query': 'query', 'query_binary_values': 'query', 'query_ascii_values': 'query',\
+					  'readline': 'read', 'read_until': 'read', 'read_all': 'read'}
+		classes = []
+		try:
+			from pyvisa.resources import MessageBasedResource
+			classes.append(MessageBasedResource)
+		except ImportError:
+			pass
+		try:
+			import serial
+			classes.append(serial.Serial)
+		except ImportError:
+			pass
+		if 'InstrumentSim' in sys.modules:
+			classes += [sys.modules['InstrumentSim'].SimSession, sys.modules['InstrumentSim'].SimSerial]
+		for cls in classes:
+			self._patch_io(cls, {name: kind for name, kind in io_methods.items() if name in dir(cls)})
+
+		sleep = time.sleep
+		def timed_sleep(seconds):
+			if getattr(_state, 'depth', 0):    # sleeping inside an I/O or plotting call counts for that call
+				return sleep(seconds)
+			if threading.current_thread().daemon:    # background threads (LivePlot sender) do not hold up the sweep
+				return sleep(seconds)
+			frame = sys._getframe(1)
+			caller = f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}'
+			start = time.perf_counter()
+			try:
+				sleep(seconds)
+			finally:
+				self.record(self.sleeps, caller, time.perf_counter()-start)
+		self._patch(time, 'sleep', timed_sleep)
+
+		if 'matplotlib.pyplot' in sys.modules:
+			plt = sys.modules['matplotlib.pyplot']
+			for name in ('pause', 'draw', 'clf', 'plot', 'scatter'):
+				done = lambda args, result, elapsed, name=name: self.record(self.plots, 'plt.' + name, elapsed)
+				self._patch(plt, name, self._timed(getattr(plt, name), done))
+		if 'LivePlot' in sys.modules:
+			cls = sys.modules['LivePlot'].LivePlot
+			self._patch(cls, 'add', self._timed(cls.add, lambda args, result, elapsed: self.record(self.plots, 'LivePlot.add', elapsed)))
+
+	def uninstall(self):
+		for owner, name, original, owned in reversed(self._patches):
+			if owned:
+				setattr(owner, name, original)
+			else:
+				delattr(owner, name)
+		self._patches = []
+
+	#### REPORT ####
+
+	def totals(self):
+		'''
+		:return: {'wall', 'io', 'sleep', 'plot', 'python'} in seconds. I/O of several threads
+			(AsyncInstrument) is summed, so the parts can add up to more than the wall time
+		'''
+		io = sum(s.total for table in self.io.values() for s in table.values())
+		sleep = sum(s.total for s in self.sleeps.values())
+		plot = sum(s.total for s in self.plots.values())
+		return {'wall': self.wall, 'io': io, 'sleep': sleep, 'plot': plot, 'python': max(self.wall-io-sleep-plot, 0.0)}
+
+	def report(self):
+		'''
+		:return: text report, the wall time split into parts, then every instrument command, sleep caller and plotting call
+		'''
+		t = self.totals()
+		wall = t['wall'] or 1.0
+		calls = sum(s.calls for table in self.io.values() for s in table.values())
+		out = sum(s.bytes_out for table in self.io.values() for s in table.values())
+		inp = sum(s.bytes_in for table in self.io.values() for s in table.values())
+		lines = [f'Profile of {t["wall"]:.3f} s wall time',
+				 f'  instrument I/O {t["io"]:10.3f} s {100*t["io"]/wall:6.1f} %   {calls} calls, {out/1e3:.1f} kB out, {inp/1e3:.1f} kB in',
+				 f'  sleep          {t["sleep"]:10.3f} s {100*t["sleep"]/wall:6.1f} %',
+				 f'  plotting       {t["plot"]:10.3f} s {100*t["plot"]/wall:6.1f} %',
+				 f'  Python/other   {t["python"]:10.3f} s {100*t["python"]/wall:6.1f} %']
+		row = '    {:<28}{:>8}{:>11}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'
+		stat_row = lambda key, s: row.format(key[:28], s.calls, f'{s.total:.3f}', f'{1e3*s.total/s.calls:.2f}',\
+											  f'{1e3*s.percentile(50):.2f}', f'{1e3*s.percentile(95):.2f}', f'{1e3*s.max:.2f}',\
+											  s.bytes_out, s.bytes_in)
+		header = row.format('', 'calls', 'total(s)', 'mean(ms)', 'p50(ms)', 'p95(ms)', 'max(ms)', 'B out', 'B in')
+		for name, table in sorted(self.io.items()):
+			lines += ['', f'  {name}', header]
+			lines += [stat_row(key, s) for key, s in sorted(table.items(), key=lambda item: -item[1].total)]
+		for title, table in (('sleep by caller', self.sleeps), ('plotting', self.plots)):
+			if table:
+				lines += ['', f'  {title}', header]
+				lines += [stat_row(key, s) for key, s in sorted(table.items(), key=lambda item: -item[1].total)]
+		return '\n'.join(lines)
+
+
+class profile(object):
+	'''
+	Context manager profiling the instrument I/O of a block:
+		with InstrumentProfiler.profile() as prof:
+			data = sweep.run(plan)
+		print(prof.report())
+	'''
+	def __init__(self, enabled:bool = True):
+		'''
+		:param enabled: False gives an empty Profile without patching anything, so scripts can keep the with block
+		'''
+		self.enabled = enabled
+		self.profile = Profile()
+
+	def __enter__(self):
+		global _active
+		if self.enabled:
+			if _active is not None:
+				raise RuntimeError('a profile is already active')
+			_active = self.profile
+			self.profile.install()
+		self.start = time.perf_counter()
+		return self.profile
+
+	def __exit__(self, *exc):
+		global _active
+		self.profile.wall = time.perf_counter()-self.start
+		if self.enabled:
+			self.profile.uninstall()
+			_active = None
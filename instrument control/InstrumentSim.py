@@ -0,0 +1,1169 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated instruments for running the drivers without a GPIB bus.
+Python device models answer the exact command strings the drivers send
+(Keithley 2450/2400, LakeShore 335, SR400, SR830, SR542, SR900, Keysight
+34461A/33500B) with a simple physical model behind them (resistor DUT,
+thermal relaxation, Poisson photon counts, lock-in buffer filling in real
+time) and a configurable latency per command, so throughput changes can be
+measured offline.
+Install with InstrumentPool.use_backend(InstrumentSim.SimResourceManager()) or
+set the environment variable INSTRUMENT_SIM=1 before the first driver opens.
+"""
+
+import re
+import math
+import time
+import threading
+import numpy as np
+
+try:
+	from pyvisa.errors import InvalidSession, VisaIOError
+	from pyvisa.constants import StatusCode
+	def _timeout_error():
+		return VisaIOError(StatusCode.error_timeout)
+except ImportError:
+	class InvalidSession(Exception):
+		pass
+	def _timeout_error():
+		return TimeoutError('VI_ERROR_TMO (-1073807339): Timeout expired before operation completed.')
+
+def scpi_short(header:str) -> str:
+	'''
+	:return: the SCPI short form of a command header, e.g. ':SOURce:CURRent:LEVel?' -> 'SOUR:CURR:LEV?'
+	'''
+	query = header.endswith('?')
+	nodes = []
+	for node in header.strip().strip(':').rstrip('?').upper().split(':'):
+		if len(node) > 4 and node[0] != '*':
+			node = node[:3] if node[3] in 'AEIOU' else node[:4]
+		nodes.append(node)
+	return ':'.join(nodes) + ('?' if query else '')
+
+
+class SimDevice(object):
+	'''
+	Base device model. handle(command) returns the reply (str or bytes) or None.
+	Settings written as "<header> <value>" are kept and returned by "<header>?"
+	unless the model handles the header itself.
+	'''
+	idn = 'Simulated Instrument,SIM0,0,0'
+	termination = '\n'    # appended to every text reply
+	separator = ';'       # several commands in one write
+
+	def __init__(self, latency = 0.0, seed:int = None):
+		'''
+		:param latency: seconds spent on every command, or {header: seconds} with '' as the default,
+			e.g. {'': 1e-3, 'READ?': 20e-3}. Headers are matched in the form returned by parse()
+		:param seed: seed of the noise generator
+		'''
+		self.latency = latency if isinstance(latency, dict) else {'': latency}
+		self.rng = np.random.default_rng(seed)
+		self.settings = {}
+		self.errors = []    # commands the model did not understand
+
+	def delay(self, header):
+		return self.latency.get(header, self.latency.get('', 0.0))
+
+	def parse(self, command):
+		m = re.match(r'\s*:?([*A-Za-z0-9:]+)\s*(\?)?\s*(.*)$', command, re.S)
+		if m is None:
+			return '', command
+		return m.group(1).upper() + (m.group(2) or ''), m.group(3).strip()
+
+	def handle(self, command):
+		header, args = self.parse(command)
+		time.sleep(self.delay(header))
+		func = getattr(self, 'cmd_' + re.sub(r'\W', '_', header.replace('?', 'Q')), None)
+		if func is not None:
+			return func(args)
+		if header == '*IDN?':
+			return self.idn
+		if header.endswith('?'):
+			if header[:-1] in self.settings:
+				return self.settings[header[:-1]]
+			self.errors.append(command)
+			return None
+		if args:
+			self.settings[header] = args
+		elif header not in ('*RST', '*CLS', '*WAI', 'STAT:PRES'):
+			self.errors.append(command)
+		return None
+
+	def args(self, args, *types):
+		values = [a.strip().strip('"\'') for a in args.split(',')] if args else []
+		return [t(v) for t, v in zip(types, values)]
+
+
+#### SOURCE-MEASURE UNITS ####
+
+class SourceMeterSim(SimDevice):
+	'''
+	Common model of the Keithley SMUs: an ohmic DUT of resistance R, the source
+	output follows the compliance of the other quantity.
+	'''
+	def __init__(self, R:float = 1e3, noise:float = 1e-5, nplc_time:float = 1/50, **kwargs):
+		'''
+		:param R: DUT resistance in Ohm
+		:param noise: relative noise of every reading
+		:param nplc_time: seconds per NPLC, READ? takes nplc*nplc_time on top of the latency
+		'''
+		super().__init__(**kwargs)
+		self.R = R
+		self.noise = noise
+		self.nplc_time = nplc_time
+		self.reset()
+
+	def reset(self):
+		self.source = 'VOLT'
+		self.sense = 'CURR'
+		self.level = {'VOLT': 0.0, 'CURR': 0.0}
+		self.limit = {'VOLT': 21.0, 'CURR': 1.05e-4}    # compliance of the measured quantity
+		self.nplc = 1.0
+		self.output = False
+		self.t0 = time.monotonic()
+
+	def measure(self):
+		'''
+		:return: (volt, curr) at the DUT
+		'''
+		level = self.level[self.source] if self.output else 0.0
+		if self.source == 'CURR':
+			curr = level
+			volt = float(np.clip(curr*self.R, -self.limit['VOLT'], self.limit['VOLT']))
+			if abs(volt) < abs(curr*self.R):
+				curr = volt/self.R
+		else:
+			volt = level
+			curr = float(np.clip(volt/self.R, -self.limit['CURR'], self.limit['CURR']))
+			if abs(curr) < abs(volt/self.R):
+				volt = curr*self.R
+		scale = 1.0 + self.noise*self.rng.standard_normal(2)
+		return volt*scale[0], curr*scale[1]
+
+	def integrate(self):
+		time.sleep(self.nplc*self.nplc_time)
+
+	def cmd__RST(self, args):
+		self.reset()
+
+	def cmd_OUTP(self, args):
+		self.output = args.strip().upper() in ('ON', '1')
+
+	def cmd_OUTPQ(self, args):
+		return str(int(self.output))
+
+
+class Keithley2450Sim(SourceMeterSim):
+	'''
+	Keithley 2450 as driven by pymeasure and Keithley.Model2450, including the
+	source-list trigger model, trigger models built from blocks with source
+	configuration lists (pulsed sweeps) and the reading buffer. After *LANG TSP (immediate
+	here, a power cycle on the instrument) it takes TSP instead: loadscript and
+	run of the sweep scripts generated by Keithley.tspSweepScript, print and
+	printbuffer of defbuffer1.
+	'''
+	idn = 'KEITHLEY INSTRUMENTS,MODEL 2450,04000000,1.7.12b'
+	language = 'SCPI'
+
+	def reset(self):
+		super().reset()
+		self.source_list = {'CURR': [], 'VOLT': []}
+		self.buffer = []    # rows of (READ, SOUR, REL)
+		self.capacity = 100000
+		self.busy_until = 0.0
+		self.scripts = {}
+		self.loading = None    # [name, lines] between loadscript and endscript
+		self.sweep = None
+		self.blocks = {}       # trigger model: block number -> (block type, arguments)
+		self.config_lists = {}    # source configuration list -> [(source, level, limit)]
+
+	def parse(self, command):
+		m = re.match(r'\s*([^\s]+)\s*(.*)$', command, re.S)
+		return scpi_short(m.group(1)), m.group(2).strip()
+
+	def handle(self, command):
+		if self.language == 'TSP' and not command.strip().startswith('*'):
+			return self.tsp(command.strip())
+		header, args = self.parse(command)
+		if header.startswith('TRIG:BLOC:'):
+			time.sleep(self.delay(header))
+			number, _, rest = args.partition(',')
+			self.blocks[int(number)] = (header[len('TRIG:BLOC:'):], [a.strip().strip('"\'') for a in rest.split(',')] if rest else [])
+			return None
+		m = re.match(r'(SOUR|SENS):(CURR|VOLT)(?::(LEV|VLIM|ILIM|NPLC))?(\?)?$', header)
+		if m:
+			time.sleep(self.delay(header))
+			node, func, leaf, query = m.groups()
+			if node == 'SOUR' and leaf in ('VLIM', 'ILIM'):
+				key = 'VOLT' if leaf == 'VLIM' else 'CURR'
+				if query:
+					return f'{self.limit[key]:g}'
+				self.limit[key] = float(args)
+			elif node == 'SOUR':
+				if query:
+					return f'{self.level[func]:g}'
+				self.level[func] = float(args)
+			elif leaf == 'NPLC':
+				if query:
+					return f'{self.nplc:g}'
+				self.nplc = float(args)
+			return None
+		return super().handle(command)
+
+	def cmd_SOUR_FUNC(self, args):
+		self.source = args.strip('"\' ').upper()[:4]
+
+	def cmd_SOUR_FUNCQ(self, args):
+		return self.source
+
+	def cmd_SENS_FUNC(self, args):
+		self.sense = args.strip('"\' ').upper()[:4]
+
+	def cmd_SENS_FUNCQ(self, args):
+		return f'"{self.sense}:DC"'
+
+	def cmd_READQ(self, args):
+		self.integrate()
+		volt, curr = self.measure()
+		reading = volt if self.sense == 'VOLT' else curr
+		self.buffer.append((reading, self.level[self.source], time.monotonic()-self.t0))
+		return f'{reading:.6E}'
+
+	def cmd_SOUR_LIST_CURR(self, args):
+		self.source_list['CURR'] = [float(v) for v in args.split(',')]
+
+	def cmd_SOUR_LIST_VOLT(self, args):
+		self.source_list['VOLT'] = [float(v) for v in args.split(',')]
+
+	def cmd_SOUR_LIST_CURR_APP(self, args):
+		self.source_list['CURR'] += [float(v) for v in args.split(',')]
+
+	def cmd_SOUR_LIST_VOLT_APP(self, args):
+		self.source_list['VOLT'] += [float(v) for v in args.split(',')]
+
+	def cmd_SOUR_SWE_CURR_LIST(self, args):
+		self.sweep = ('CURR',) + tuple(self.args(args, int, float, int, str))
+		self.blocks = {}    # the sweep replaces the trigger model
+
+	def cmd_SOUR_SWE_VOLT_LIST(self, args):
+		self.sweep = ('VOLT',) + tuple(self.args(args, int, float, int, str))
+		self.blocks = {}
+
+	def cmd_TRIG_LOAD(self, args):
+		self.sweep = None
+		self.blocks = {}
+
+	def cmd_SOUR_CONF_LIST_CRE(self, args):
+		self.config_lists[args.strip('"\' ')] = []
+
+	def cmd_SOUR_CONF_LIST_DEL(self, args):
+		self.config_lists.pop(args.strip('"\' '), None)
+
+	def cmd_SOUR_CONF_LIST_CATQ(self, args):
+		return ','.join(f'"{name}"' for name in self.config_lists) or '""'
+
+	def cmd_SOUR_CONF_LIST_STOR(self, args):
+		self.config_lists[args.split(',')[0].strip('"\' ')].append((self.source, dict(self.level), dict(self.limit)))
+
+	def cmd_SYST_LFRQ(self, args):
+		return '50'
+
+	def run_trigger_model(self):
+		'''
+		Step through the trigger blocks, constant delays and measurements advance the instrument clock.
+		'''
+		t = time.monotonic()-self.t0
+		index = {}
+		counters = {}
+		block = 1
+		while block in self.blocks:
+			kind, args = self.blocks[block]
+			if kind == 'BUFF:CLE':
+				self.buffer = []
+			elif kind in ('CONF:REC', 'CONF:NEXT'):
+				name = args[0]
+				index[name] = (int(args[1]) if len(args) > 1 else 1) if kind == 'CONF:REC' else index.get(name, 0) + 1
+				self.source, level, limit = self.config_lists[name][(index[name]-1) % len(self.config_lists[name])]
+				self.level.update(level)
+				self.limit.update(limit)
+			elif kind == 'SOUR:STAT':
+				self.output = args[0].upper() in ('ON', '1')
+			elif kind == 'DEL:CONS':
+				t += float(args[0])
+			elif kind == 'MEAS':
+				t += self.nplc*self.nplc_time
+				volt, curr = self.measure()
+				self.buffer.append((volt if self.sense == 'VOLT' else curr, self.level[self.source], t))
+			elif kind == 'BRAN:COUN':
+				counters[block] = counters.get(block, 0) + 1
+				if counters[block] < int(args[0]):
+					block = int(args[1])
+					continue
+			block += 1
+		self.buffer = self.buffer[-self.capacity:]
+		self.busy_until = self.t0 + t
+
+	def cmd_INIT(self, args):
+		if self.blocks:
+			return self.run_trigger_model()
+		func, index, delay, count = self.sweep[:4]
+		self.source = func
+		self.output = True
+		start = time.monotonic()-self.t0
+		step = delay + self.nplc*self.nplc_time
+		for k, value in enumerate(self.source_list[func][index-1:]*count):
+			self.level[func] = value
+			volt, curr = self.measure()
+			self.buffer.append((volt if self.sense == 'VOLT' else curr, value, start + (k+1)*step))
+		self.buffer = self.buffer[-self.capacity:]
+		self.busy_until = time.monotonic() + (len(self.source_list[func])-index+1)*count*step
+
+	def cmd_ABOR(self, args):
+		self.busy_until = 0.0
+
+	def cmd_TRIG_STATQ(self, args):
+		state = 'RUNNING' if time.monotonic() < self.busy_until else 'IDLE'
+		return f'{state};{state};'
+
+	def cmd_TRAC_CLE(self, args):
+		self.buffer = []
+
+	def cmd_TRAC_POIN(self, args):
+		self.capacity = int(float(args.split(',')[0]))
+
+	def cmd_TRAC_POINQ(self, args):
+		return str(self.capacity)
+
+	def cmd_TRAC_ACTQ(self, args):
+		return str(len(self.buffer))
+
+	def cmd_TRAC_DATAQ(self, args):
+		fields = [a.strip().strip('"') for a in args.split(',')]
+		start, end, elements = int(fields[0]), int(fields[1]), [e.upper() for e in fields[3:]] or ['READ']
+		rel0 = self.buffer[0][2] if self.buffer else 0.0
+		columns = {'READ': 0, 'SOUR': 1}
+		values = []
+		for row in self.buffer[start-1:end]:
+			values += [row[2]-rel0 if e == 'REL' else row[columns[e]] for e in elements]
+		return ','.join(f'{v:.6E}' for v in values)
+
+	def cmd_SYST_BEEP(self, args):
+		pass
+
+	def cmd_SYST_ERRQ(self, args):
+		return '0,"No error;0;0 0"'
+
+	def cmd__LANG(self, args):
+		self.language = args.strip().upper()
+
+	def cmd__LANGQ(self, args):
+		return self.language
+
+	#### TSP ####
+
+	def tsp(self, line):
+		if self.loading is not None:
+			if line == 'endscript':
+				self.scripts[self.loading[0]] = '\n'.join(self.loading[1])
+				self.loading = None
+			else:
+				self.loading[1].append(line)
+			return None
+		m = re.match(r'loadscript\s+(\w+)$', line)
+		if m:
+			self.loading = [m.group(1), []]
+			return None
+		m = re.match(r'(\w+)\.run\(\)$', line)
+		if m and m.group(1) in self.scripts:
+			return self.run_script(self.scripts[m.group(1)])
+		time.sleep(max(self.busy_until - time.monotonic(), 0.0))    # commands wait for the running script
+		if line == 'print(defbuffer1.n)':
+			return str(len(self.buffer))
+		m = re.match(r'printbuffer\((\d+),\s*(\d+),\s*(.*)\)$', line)
+		if m:
+			start, end = int(m.group(1)), int(m.group(2))
+			columns = {'defbuffer1.readings': 0, 'defbuffer1.sourcevalues': 1, 'defbuffer1.relativetimestamps': 2}
+			fields = [columns[f.strip()] for f in m.group(3).split(',')]
+			rel0 = self.buffer[0][2] if self.buffer else 0.0
+			return ', '.join(f'{row[k]-rel0 if k == 2 else row[k]:.6e}' for row in self.buffer[start-1:end] for k in fields)
+		if line in ('waitcomplete()', 'abort()'):
+			return None
+		self.errors.append(line)
+		return None
+
+	def run_script(self, text):
+		'''
+		Run a sweep script of Keithley.tspSweepScript: step through levels, read into defbuffer1.
+		'''
+		func = 'CURR' if 'smu.source.func = smu.FUNC_DC_CURRENT' in text else 'VOLT'
+		levels = [float(v) for v in re.search(r'levels = \{(.*?)\}', text, re.S).group(1).replace('\n', '').split(',') if v.strip()]
+		m = re.search(r'smu\.source\.([vi])limit\.level = (\S+)', text)
+		if m:
+			self.limit['VOLT' if m.group(1) == 'v' else 'CURR'] = float(m.group(2))
+		m = re.search(r'smu\.measure\.nplc = (\S+)', text)
+		self.nplc = float(m.group(1)) if m else self.nplc
+		m = re.search(r'\bdelay\((\S+)\)', text)
+		delay = float(m.group(1)) if m else 0.0
+		self.source, self.sense = func, 'VOLT' if func == 'CURR' else 'CURR'
+		self.buffer = []
+		self.output = True
+		step = delay + self.nplc*self.nplc_time
+		start = time.monotonic()-self.t0
+		sense_limit = self.limit[self.sense]
+		for k, value in enumerate(levels):
+			self.level[func] = value
+			volt, curr = self.measure()
+			reading = volt if self.sense == 'VOLT' else curr
+			self.buffer.append((reading, value, start + (k+1)*step))
+			if ('tripped' in text) and abs(reading) >= 0.999*sense_limit:
+				break
+		self.level[func] = 0.0
+		self.output = False
+		self.busy_until = time.monotonic() + len(self.buffer)*step
+		return None
+
+
+class Keithley2400Sim(SourceMeterSim):
+	'''
+	Keithley 2400 as driven by Keithley.Model2400, READ? returns the five
+	default elements VOLT,CURR,RES,TIME,STAT for each of the TRIG:COUN points,
+	stepping through the source list in LIST mode, as ASCII or as a #0 REAL,32 block.
+	'''
+	idn = 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,1234567,C32   Oct  4 2010 14:20:11/A02  /S/K'
+	list_max = 100    # points of one source list
+
+	def reset(self):
+		super().reset()
+		self.mode = {'VOLT': 'FIX', 'CURR': 'FIX'}
+		self.source_list = {'VOLT': [], 'CURR': []}
+		self.trig_count = 1
+		self.source_delay = 0.0
+		self.data_format = 'ASC'
+		self.byte_order = 'NORM'
+
+	def parse(self, command):
+		m = re.match(r'\s*([^\s]+)\s*(.*)$', command, re.S)
+		return scpi_short(m.group(1)), m.group(2).strip()
+
+	def handle(self, command):
+		header, args = self.parse(command)
+		m = re.match(r'(SOUR|SENS):(CURR|VOLT)(?::(PROT:LEV|LEV))?(\?)?$', header)
+		if m:
+			time.sleep(self.delay(header))
+			node, func, leaf, query = m.groups()
+			target = self.limit if node == 'SENS' else self.level
+			if query:
+				return f'{target[func]:g}'
+			target[func] = float(args)
+			return None
+		return super().handle(command)
+
+	def cmd_SOUR_FUNC_MODE(self, args):
+		self.source = args.strip('"\' ').upper()[:4]
+
+	def cmd_SOUR_FUNC(self, args):
+		self.cmd_SOUR_FUNC_MODE(args)
+
+	def cmd_SENS_FUNC(self, args):
+		self.sense = args.strip('"\' ').upper()[:4]
+
+	def cmd_SYST_TIME_RES(self, args):
+		self.t0 = time.monotonic()
+
+	def cmd_SYST_BEEP(self, args):
+		pass
+
+	def cmd_SYST_KEY(self, args):
+		pass
+
+	def cmd_SOUR_CURR_MODE(self, args):
+		self.mode['CURR'] = args.strip().upper()[:4]
+
+	def cmd_SOUR_VOLT_MODE(self, args):
+		self.mode['VOLT'] = args.strip().upper()[:4]
+
+	def cmd_SOUR_LIST_CURR(self, args):
+		self.source_list['CURR'] = [float(v) for v in args.split(',')][:self.list_max]
+
+	def cmd_SOUR_LIST_VOLT(self, args):
+		self.source_list['VOLT'] = [float(v) for v in args.split(',')][:self.list_max]
+
+	def cmd_SOUR_DEL(self, args):
+		self.source_delay = float(args)
+
+	def cmd_TRIG_COUN(self, args):
+		self.trig_count = int(float(args))
+
+	def cmd_FORM_DATA(self, args):
+		self.data_format = 'REAL' if 'REAL' in args.upper() else 'ASC'
+
+	def cmd_FORM_BORD(self, args):
+		self.byte_order = args.strip().upper()[:4]
+
+	def cmd_READQ(self, args):
+		rows = []
+		for i in range(self.trig_count):
+			if self.mode[self.source] == 'LIST' and self.source_list[self.source]:
+				points = self.source_list[self.source]
+				self.level[self.source] = points[i % len(points)]
+			time.sleep(self.source_delay)
+			self.integrate()
+			volt, curr = self.measure()
+			resis = volt/curr if curr else 9.91e37
+			rows.append((volt, curr, resis, time.monotonic()-self.t0, 0.0))
+		if self.data_format == 'REAL':    # #0 indefinite block of float32, SWAP is little-endian
+			data = np.array(rows, dtype='<f4' if self.byte_order == 'SWAP' else '>f4')
+			return b'#0' + data.tobytes() + self.termination.encode()
+		return ','.join(f'{v:+.6E}' for row in rows for v in row)
+
+
+#### DIGITAL MULTIMETER and FUNCTION GENERATOR ####
+
+class Keysight34461ASim(SimDevice):
+	'''
+	Keysight 34461A DMM, READ? returns signal(t) plus noise after nplc line cycles.
+	'''
+	idn = 'Keysight Technologies,34461A,MY00000000,A.03.01-02.40-03.01-00.52-03-01'
+
+	def __init__(self, signal = 1e-3, noise:float = 1e-6, nplc_time:float = 1/50, **kwargs):
+		'''
+		:param signal: reading in V, float or callable(t) of the time since creation
+		'''
+		super().__init__(**kwargs)
+		self.signal = signal
+		self.noise = noise
+		self.nplc_time = nplc_time
+		self.t0 = time.monotonic()
+
+	def parse(self, command):
+		m = re.match(r'\s*([^\s]+)\s*(.*)$', command, re.S)
+		return scpi_short(m.group(1)), m.group(2).strip()
+
+	def cmd_READQ(self, args):
+		nplc = float(self.settings.get('SENS:VOLT:DC:NPLC', self.settings.get('SENS:VOLT:AC:NPLC', 10)))
+		time.sleep(nplc*self.nplc_time)
+		value = self.signal(time.monotonic()-self.t0) if callable(self.signal) else self.signal
+		return f'{value + self.noise*self.rng.standard_normal():+.15E}'
+
+
+class Keysight33500BSim(SimDevice):
+	'''
+	Keysight 33500B/32500B waveform generator, every setting is stored and can be queried back.
+	'''
+	idn = 'Agilent Technologies,33522B,MY00000000,4.00-1.19-2.00-58-00'
+
+	def parse(self, command):
+		m = re.match(r'\s*([^\s]+)\s*(.*)$', command, re.S)
+		return scpi_short(m.group(1)), m.group(2).strip()
+
+
+#### TEMPERATURE CONTROLLER ####
+
+class LakeShore335Sim(SimDevice):
+	'''
+	LakeShore 335, input A is controlled by output 1 and input B by output 2.
+	The temperature relaxes with time constant tau towards the (ramped) setpoint
+	while the heater range is on, and towards base otherwise.
+	'''
+	idn = 'LSCI,MODEL335,LSA0000/0000000,2.1'
+
+	def __init__(self, base:float = 2.0, tau:float = 30.0, noise:float = 1e-3, **kwargs):
+		super().__init__(**kwargs)
+		self.base = base
+		self.tau = tau
+		self.noise = noise
+		self.temp = {1: base, 2: base}
+		self.setp = {1: base, 2: base}
+		self.target = {1: base, 2: base}    # setpoint after ramping
+		self.heater_range = {1: 0, 2: 0}
+		self.ramp = {1: (0, 10.0), 2: (0, 10.0)}
+		self.last = time.monotonic()
+
+	def advance(self):
+		now = time.monotonic()
+		dt, self.last = now-self.last, now
+		for out in (1, 2):
+			on, rate = self.ramp[out]
+			if on and rate > 0:
+				step = rate/60*dt
+				self.target[out] += float(np.clip(self.setp[out]-self.target[out], -step, step))
+			else:
+				self.target[out] = self.setp[out]
+			goal = self.target[out] if self.heater_range[out] else self.base
+			self.temp[out] += (goal-self.temp[out])*(1-math.exp(-dt/self.tau))
+
+	def output(self, args, default:int = 1):
+		args = args.strip().upper()
+		return {'A': 1, 'B': 2, '1': 1, '2': 2}.get(args[:1], default)
+
+	def cmd_SETP(self, args):
+		out, value = self.args(args, int, float)
+		self.setp[out] = value
+
+	def cmd_SETPQ(self, args):
+		return f'+{self.setp[self.output(args)]:.3f}'
+
+	def cmd_RANGE(self, args):
+		out, value = self.args(args, int, int)
+		self.heater_range[out] = value
+
+	def cmd_RANGEQ(self, args):
+		return str(self.heater_range[self.output(args)])
+
+	def cmd_RAMP(self, args):
+		out, on, rate = self.args(args, int, int, float)
+		self.ramp[out] = (on, rate)
+
+	def cmd_RAMPQ(self, args):
+		on, rate = self.ramp[self.output(args)]
+		return f'{on},{rate:.1f}'
+
+	def cmd_RAMPSTQ(self, args):
+		self.advance()
+		out = self.output(args)
+		return str(int(abs(self.target[out]-self.setp[out]) > 1e-9))
+
+	def cmd_HTRQ(self, args):
+		self.advance()
+		out = self.output(args)
+		power = 100*(self.target[out]-self.temp[out])/max(self.target[out], 1.0) if self.heater_range[out] else 0.0
+		return f'+{float(np.clip(power, 0, 100)):.3f}'
+
+	def cmd_RDGSTQ(self, args):
+		return '000'
+
+	def cmd_KRDGQ(self, args):
+		self.advance()
+		return f'+{self.temp[self.output(args)] + self.noise*self.rng.standard_normal():.4f}'
+
+
+#### STANFORD RESEARCH ####
+
+class SR400Sim(SimDevice):
+	'''
+	SR400 photon counter. Counts of channel A/B are Poisson with the configured
+	rates during count periods of CP 2 ticks of 10 MHz, separated by the dwell
+	time. Period status bits are cleared when read, like the instrument does.
+	Status bits enabled by the SV mask raise the SRQ line of the session.
+	'''
+	termination = '\r\n'
+
+	def __init__(self, rate = (1e4, 1e3), **kwargs):
+		'''
+		:param rate: count rates (Hz) of the signals at INPUT1 and INPUT2
+		'''
+		super().__init__(**kwargs)
+		self.rate = rate
+		self.params = {('CM', 0): 0, ('CI', 0): 1, ('CI', 1): 2, ('CI', 2): 0, ('CP', 1): 1e3, ('CP', 2): 1e7,\
+					   ('DT', 0): 2e-3, ('NP', 0): 1000, ('NE', 0): 1, ('SD', 0): 0}
+		self.counts = np.zeros((0, 2), dtype=np.int64)
+		self.start = None    # time of CS, None when stopped
+		self.periods = 0     # periods completed when the counter was stopped
+		self.status_read = 0    # periods completed at the last read of the count-end bit
+		self.scan_read = False
+
+	def parse(self, command):
+		m = re.match(r'\s*([A-Za-z]{2})\s*(.*)$', command, re.S)
+		return (m.group(1).upper(), m.group(2).strip()) if m else ('', command)
+
+	def period_length(self):
+		return self.params[('CP', 2)]/1e7 + self.params[('DT', 0)]
+
+	def source_rate(self, counter):
+		source = self.params[('CI', counter)]
+		return {0: 1e7, 1: self.rate[0], 2: self.rate[1], 3: 1e3}[source]
+
+	def completed(self):
+		'''
+		Bring the count buffer up to date, return the number of completed periods.
+		'''
+		if self.start is not None:
+			total = int((time.monotonic()-self.start)/self.period_length())
+			if self.params[('NE', 0)] == 0:
+				total = min(total, int(self.params[('NP', 0)]))
+			new = total - len(self.counts)
+			if new > 0:
+				mean = np.array([self.source_rate(0), self.source_rate(1)])*self.params[('CP', 2)]/1e7
+				self.counts = np.vstack((self.counts, self.rng.poisson(mean, (new, 2))))
+			if (self.params[('NE', 0)] == 0) and (total >= self.params[('NP', 0)]):
+				self.periods, self.start = total, None
+		return len(self.counts)
+
+	def status_bits(self, done):
+		return {1: done > self.status_read, 2: (self.start is None) and (done >= self.params[('NP', 0)]) and (done > 0)}
+
+	def service_request(self):
+		'''
+		:return: True while a status bit enabled by the SV mask is set (the SRQ line)
+		'''
+		mask = int(self.params.get(('SV', 0), 0))
+		return any(value and (mask >> bit) & 1 for bit, value in self.status_bits(self.completed()).items())
+
+	def handle(self, command):
+		header, args = self.parse(command)
+		time.sleep(self.delay(header))
+		values = [a.strip() for a in args.split(',')] if args else []
+		done = self.completed()
+		if header == 'CS':
+			if self.start is None:
+				self.start = time.monotonic() - done*self.period_length()
+		elif header == 'CH':
+			self.start = None
+		elif header == 'CR':
+			self.start = None
+			self.counts = np.zeros((0, 2), dtype=np.int64)
+			self.status_read = 0
+			self.scan_read = False
+		elif header in ('QA', 'QB'):
+			channel = 0 if header == 'QA' else 1
+			if values:
+				index = int(values[0])
+				return str(int(self.counts[index-1, channel])) if 1 <= index <= done else '-1'
+			self.status_read = done
+			return str(int(self.counts[-1, channel])) if done else '0'
+		elif header in ('XA', 'XB'):
+			if self.start is None:
+				return '0'
+			elapsed = (time.monotonic()-self.start) % self.period_length()
+			window = min(elapsed, self.params[('CP', 2)]/1e7)
+			return str(int(self.source_rate(0 if header == 'XA' else 1)*window))
+		elif header == 'NN':
+			return str(done+1 if self.start is not None else done)    # the period in progress while counting
+		elif header in ('EA', 'EB', 'ET'):    # dump of all stored periods, one message
+			columns = {'EA': [0], 'EB': [1], 'ET': [0, 1]}[header]
+			return '\r\n'.join(str(int(v)) for v in self.counts[:, columns].ravel())
+		elif header == 'SS':
+			bits = self.status_bits(done)
+			if values:
+				bit = int(values[0])
+				if bit == 1:
+					self.status_read = done
+				return str(int(bits.get(bit, False)))
+			self.status_read = done
+			return str(sum(int(v) << k for k, v in bits.items()))
+		elif header == 'SI':
+			bits = {2: self.start is not None}
+			return str(int(bits.get(int(values[0]), False))) if values else str(sum(int(v) << k for k, v in bits.items()))
+		elif header == 'SC':
+			return '2'
+		elif header in ('MS', 'CK', 'CL', 'TS', 'TL', 'DS', 'DL'):
+			pass
+		elif header in ('CM', 'DT', 'NP', 'NE', 'SD', 'SV'):    # parameter without index
+			if not values:
+				return f'{self.params.get((header, 0), 0):g}'
+			self.params[(header, 0)] = float(values[0])
+		elif header in ('CI', 'CP', 'GM', 'GD', 'GY', 'GW', 'DM', 'GZ'):    # parameter with index
+			key = ('GD' if header == 'GZ' else header, int(values[0]))
+			if len(values) == 1:
+				return f'{self.params.get(key, 0):g}'
+			self.params[key] = float(values[1])
+		else:
+			self.errors.append(command)
+		return None
+
+
+class SR830Sim(SimDevice):
+	'''
+	SR830 lock-in amplifier. The input is a sine of amplitude `amplitude` and
+	phase `phase` (degrees) relative to the reference; storage fills the two
+	display buffers at the SRAT rate in real time, in 1 Shot or Loop mode.
+	'''
+	idn = 'Stanford_Research_Systems,SR830,s/n00000,ver1.07'
+	BUFFER_SIZE = 16383
+
+	def __init__(self, amplitude:float = 1e-3, phase:float = 30.0, noise:float = 1e-6, **kwargs):
+		super().__init__(**kwargs)
+		self.amplitude = amplitude
+		self.phase = phase
+		self.noise = noise
+		self.settings.update({'PHAS': '0', 'FMOD': '1', 'FREQ': '1000', 'SRLP': '0', 'HARM': '1', 'SLVL': '1.000',\
+							  'ISRC': '0', 'IGND': '0', 'ICPL': '0', 'ILIN': '0', 'SENS': '26', 'RMOD': '1',\
+							  'OFLT': '6', 'OFSL': '0', 'SYNC': '0', 'SRAT': '4', 'SEND': '1', 'TSTR': '0'})
+		self.display = {1: (0, 0), 2: (0, 0)}
+		self.cmd_REST('')
+
+	def outputs(self, num:int = 1):
+		'''
+		:return: (num, 11) array of the SNAP? parameters 1..11
+		'''
+		theta = np.radians(self.phase - float(self.settings['PHAS']))
+		x = self.amplitude*np.cos(theta) + self.noise*self.rng.standard_normal(num)
+		y = self.amplitude*np.sin(theta) + self.noise*self.rng.standard_normal(num)
+		r, t = np.hypot(x, y), np.degrees(np.arctan2(y, x))
+		aux = np.zeros(num)
+		freq = np.full(num, float(self.settings['FREQ']))
+		ch1 = r if self.display[1][0] == 1 else x
+		ch2 = t if self.display[2][0] == 1 else y
+		return np.column_stack((x, y, r, t, aux, aux, aux, aux, freq, ch1, ch2))
+
+	def advance(self):
+		rate = int(self.settings['SRAT'])
+		if self.start is None or rate == 14:
+			return
+		total = int((time.monotonic()-self.start)*0.0625*2**rate) + self.offset
+		new = total - self.produced
+		if new <= 0:
+			return
+		values = self.outputs(min(new, self.BUFFER_SIZE))[:, 9:11].T
+		self.store(values)
+		self.produced = total
+
+	def store(self, values):
+		loop = self.settings['SEND'] == '1'
+		space = self.BUFFER_SIZE - self.data.shape[1]
+		if not loop:
+			values = values[:, :max(space, 0)]
+		self.data = np.hstack((self.data, values))[:, -self.BUFFER_SIZE:]
+
+	def cmd_REST(self, args):
+		self.data = np.empty((2, 0))
+		self.start = None
+		self.produced = 0
+		self.offset = 0
+
+	def cmd_STRT(self, args):
+		if self.start is None:
+			self.start = time.monotonic()
+			self.offset = self.produced
+
+	def cmd_PAUS(self, args):
+		self.advance()
+		self.start = None
+
+	def cmd_TRIG(self, args):
+		if self.settings['SRAT'] == '14' and self.start is not None:
+			self.store(self.outputs(1)[:, 9:11].T)
+
+	def cmd_DDEF(self, args):
+		channel, display, ratio = self.args(args, int, int, int)
+		self.display[channel] = (display, ratio)
+
+	def cmd_OUTPQ(self, args):
+		return f'{self.outputs()[0, int(args)-1]:.6e}'
+
+	def cmd_SNAPQ(self, args):
+		row = self.outputs()[0]
+		return ','.join(f'{row[int(p)-1]:.6e}' for p in args.split(','))
+
+	def cmd_SPTSQ(self, args):
+		self.advance()
+		return str(self.data.shape[1])
+
+	def trace(self, args):
+		self.advance()
+		buffer, start, num = self.args(args, int, int, int)
+		return self.data[buffer-1, start:start+num]
+
+	def cmd_TRCAQ(self, args):
+		return ''.join(f'{v:.6e},' for v in self.trace(args))
+
+	def cmd_TRCBQ(self, args):
+		return self.trace(args).astype('<f4').tobytes()
+
+	def cmd_TRCLQ(self, args):
+		mantissa, exponent = np.frexp(self.trace(args))
+		raw = np.empty(2*len(mantissa), dtype='<i2')
+		raw[0::2] = np.round(mantissa*2**14)
+		raw[1::2] = np.where(mantissa == 0, 0, exponent + 110)
+		return raw.tobytes()
+
+	def cmd_ERRSQ(self, args):
+		return '0'
+
+	def cmd_LIASQ(self, args):
+		return '0'
+
+
+class SR542Sim(SimDevice):
+	'''
+	SR542 optical chopper on a serial port.
+	'''
+	idn = 'Stanford_Research_Systems,SR542,s/n00000,ver1.0'
+	termination = '\r\n'
+
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+		self.settings.update({'MULT': '1', 'DIVR': '1', 'DISP': '0', 'IFRQ': '100.000', 'MOTR': 'OFF'})
+
+	def cmd_MFRQQ(self, args):
+		running = self.settings['MOTR'].upper() == 'ON'
+		freq = float(self.settings['IFRQ'])*float(self.settings['MULT'])/float(self.settings['DIVR'])
+		return f'{freq if running else 0.0:.3f}'
+
+
+class SIM928Sim(object):
+	'''
+	SIM928 isolated voltage source module of the SR900 (SIM900) mainframe.
+	'''
+	def __init__(self):
+		self.volt = 0.0
+		self.on = False
+
+	def handle(self, command):
+		command = command.strip().upper()
+		if command == 'OPON':
+			self.on = True
+		elif command == 'OPOF':
+			self.on = False
+		elif command.startswith('VOLT?'):
+			return f'{self.volt:+.3f}'
+		elif command.startswith('VOLT'):
+			self.volt = float(command[4:])
+		return None
+
+
+class SIM970Sim(object):
+	'''
+	SIM970 quad voltmeter module, VOLT? n returns inputs[n-1].
+	'''
+	def __init__(self, inputs = (0.0, 0.0, 0.0, 0.0)):
+		self.inputs = list(inputs)
+
+	def handle(self, command):
+		command = command.strip().upper()
+		if command.startswith('VOLT?'):
+			return f'{self.inputs[int(command[5:] or 1)-1]:+.6E}'
+		return None
+
+
+class SR900Sim(SimDevice):
+	'''
+	SR900 (SIM900) mainframe on a serial port: SNDT forwards to the module in a
+	port, GETN?/RAWN? return the module reply as #3nnn<bytes>.
+	'''
+	idn = 'Stanford_Research_Systems,SIM900,s/n00000,ver3.6'
+	termination = '\r\n'
+
+	def __init__(self, modules:dict = None, **kwargs):
+		'''
+		:param modules: {port: module model}, defaults to a SIM928 in port 1 and a SIM970 in port 5
+		'''
+		super().__init__(**kwargs)
+		self.modules = {1: SIM928Sim(), 5: SIM970Sim()} if modules is None else modules
+		self.outbox = {port: '' for port in self.modules}
+
+	def cmd_SNDT(self, args):
+		port, message = args.split(',', 1)
+		port = int(port)
+		reply = self.modules[port].handle(message.strip().strip('"\''))
+		if reply is not None:
+			self.outbox[port] += reply + '\r\n'
+
+	def cmd_GETNQ(self, args):
+		port, num = self.args(args, int, int)
+		data, self.outbox[port] = self.outbox[port][:num], self.outbox[port][num:]
+		return f'#3{len(data):03d}{data}'
+
+	def cmd_RAWNQ(self, args):
+		return self.cmd_GETNQ(args)
+
+
+#### VISA / SERIAL SESSIONS ####
+
+class SimSession(object):
+	'''
+	Stand-in of a pyvisa message-based resource connected to a SimDevice.
+	'''
+	def __init__(self, resource_name, device):
+		self.resource_name = resource_name
+		self.device = device
+		self.timeout = 2000
+		self.replies = []
+		self.closed = False
+		self.read_termination = device.termination
+		self.lock = threading.Lock()
+
+	@property
+	def session(self):
+		if self.closed:
+			raise InvalidSession()
+		return id(self)
+
+	def write(self, message):
+		with self.lock:
+			replies = []
+			for command in message.split(self.device.separator):
+				if command.strip():
+					reply = self.device.handle(command)
+					if reply is not None:
+						replies.append(reply)
+			if replies and all(isinstance(r, str) for r in replies):
+				replies = [self.device.separator.join(replies)]    # one response message per program message
+			self.replies += replies
+		return len(message)
+
+	def read_raw(self):
+		with self.lock:
+			if not self.replies:
+				raise _timeout_error()
+			reply = self.replies.pop(0)
+		return reply if isinstance(reply, bytes) else (reply + self.device.termination).encode()
+
+	def read(self):
+		return self.read_raw().decode()
+
+	def query(self, message, delay = None):
+		self.write(message)
+		return self.read()
+
+	def query_binary_values(self, message, datatype = 'f', is_big_endian = False, container = list, header_fmt = 'ieee', expect_termination = True, data_points = None, **kwargs):
+		self.write(message)
+		raw = self.read_raw()
+		if header_fmt == 'ieee' and raw[:1] == b'#':    # #<digits><length> definite or #0 indefinite length block
+			digits = int(raw[1:2])
+			if digits:
+				raw = raw[2+digits:2+digits+int(raw[2:2+digits])]
+			else:
+				raw = raw[2:len(raw)-len(self.device.termination)] if expect_termination else raw[2:]
+		values = np.frombuffer(raw, dtype=('>' if is_big_endian else '<') + datatype)
+		return container(values)
+
+	def read_stb(self):
+		return 0x40 if getattr(self.device, 'service_request', lambda: False)() else 0
+
+	def wait_for_srq(self, timeout = 25000):
+		'''
+		Like pyvisa GPIBInstrument.wait_for_srq, the SRQ line is the service_request() of the device model.
+		'''
+		deadline = None if timeout is None else time.monotonic() + timeout/1e3
+		while not getattr(self.device, 'service_request', lambda: False)():
+			if (deadline is not None) and (time.monotonic() > deadline):
+				raise _timeout_error()
+			time.sleep(1e-3)
+
+	def clear(self):
+		self.replies = []
+
+	def close(self):
+		self.closed = True
+
+
+class SimSerial(object):
+	'''
+	Stand-in of a pyserial Serial port connected to a SimDevice (line based, CR LF).
+	'''
+	def __init__(self, port, device, timeout:float = None, **kwargs):
+		self.port = port
+		self.device = device
+		self.timeout = timeout
+		self.inbox = b''
+		self.outbox = b''
+		self.is_open = True
+
+	def write(self, data:bytes):
+		self.inbox += data
+		while b'\n' in self.inbox:
+			line, self.inbox = self.inbox.split(b'\n', 1)
+			line = line.decode().strip()
+			if line:
+				reply = self.device.handle(line)
+				if reply is not None:
+					self.outbox += reply if isinstance(reply, bytes) else (reply + self.device.termination).encode()
+		return len(data)
+
+	@property
+	def in_waiting(self):
+		return len(self.outbox)
+
+	def read(self, size:int = 1):
+		data, self.outbox = self.outbox[:size], self.outbox[size:]
+		return data
+
+	def read_until(self, expected = b'\n', size = None):
+		end = self.outbox.find(expected)
+		end = len(self.outbox) if end < 0 else end + len(expected)
+		if size is not None:
+			end = min(end, size)
+		return self.read(end)
+
+	def readline(self):
+		return self.read_until(b'\n')
+
+	def read_all(self):
+		return self.read(len(self.outbox))
+
+	def reset_input_buffer(self):
+		self.outbox = b''
+
+	def flushInput(self):
+		self.reset_input_buffer()
+
+	def close(self):
+		self.is_open = False
+
+
+def default_devices():
+	'''
+	:return: {address: device model} at the addresses used by the sweep scripts and demos
+	'''
+	return {'GPIB0::18::INSTR': Keithley2450Sim(),
+			'GPIB0::24::INSTR': Keithley2400Sim(),
+			'GPIB0::12::INSTR': LakeShore335Sim(),
+			'GPIB0::23::INSTR': SR400Sim(),
+			'GPIB0::8::INSTR': SR830Sim(),
+			'GPIB0::22::INSTR': Keysight34461ASim(),
+			'GPIB0::10::INSTR': Keysight33500BSim(),
+			'COM3': SR542Sim(),
+			'COM4': SR900Sim()}
+
+
+class SimResourceManager(object):
+	'''
+	Replacement of pyvisa.ResourceManager for InstrumentPool.use_backend.
+	'''
+	simulated = True
+
+	def __init__(self, devices:dict = None):
+		'''
+		:param devices: {address: device model}, defaults to default_devices(). Addresses not
+			listed can be added later with add()
+		'''
+		self.devices = default_devices() if devices is None else dict(devices)
+
+	def add(self, address, device):
+		self.devices[address] = device
+
+	def list_resources(self, query = '?*::INSTR'):
+		return tuple(name for name in self.devices if name.endswith('INSTR'))
+
+	def open_resource(self, resource_name, **kwargs):
+		if resource_name not in self.devices:
+			raise _timeout_error()
+		session = SimSession(resource_name, self.devices[resource_name])
+		for key, value in kwargs.items():
+			setattr(session, key, value)
+		return session
+
+	def open_serial(self, port, timeout:float = None, **kwargs):
+		if port not in self.devices:
+			raise OSError(f'could not open port {port}: no simulated device')
+		return SimSerial(port, self.devices[port], timeout = timeout)
+
+	def adapter(self, session):
+		'''
+		:return: pymeasure adapter talking to the simulated session, for pymeasure instruments (Keithley 2450)
+		'''
+		from pymeasure.adapters import Adapter
+
+		class SimAdapter(Adapter):
+			def __init__(self, connection):
+				super().__init__()
+				self.connection = connection
+
+			def _write(self, command, **kwargs):
+				self.connection.write(command)
+
+			def _read(self, **kwargs):
+				return self.connection.read()
+
+			def _read_bytes(self, count, break_on_termchar = False, **kwargs):
+				return self.connection.read_raw()
+
+			def _write_bytes(self, content, **kwargs):
+				self.connection.write(content.decode())
+
+		return SimAdapter(session)
+
+	def close(self):
+		pass
@@ -5,7 +5,9 @@ Du X.C., March 2023, Univ. of Electronic Science and Technology of China
 Installed PyVISA for GPIB communication.
 """
 
-import pyvisa
+import InstrumentPool
+import WriteBatch
+import StateCache
 import time
 import datetime
 from pymeasure.instruments.keithley import keithley2450
@@ -13,23 +15,77 @@ import numpy as np
 # from time import sleep
 # from matlplotlib import pyplot as plt 
 
+LIST_MAX = 100    # points of one Model2400 :SOUR:LIST
+TSP_SCRIPT = 'PySweep'    # name of the sweep script loaded into the 2450
+PULSE_LIST = 'PyPulse'    # source configuration list of the 2450 pulsed sweep
+
+def tspSweepScript(func, srcList, limit, delay = 0.0, nplc = 1.0, failAbort = False, name = TSP_SCRIPT, perLine = 16):
+	'''
+	:param func: source function, 'CURR' (measure voltage) or 'VOLT' (measure current)
+	:param srcList: source values, the script steps through them in order
+	:param limit: compliance of the measured quantity (vlimit when sourcing current, ilimit when sourcing voltage)
+	:param delay: wait between setting a level and measuring in seconds, 0 for none
+	:param nplc: integration time of every reading in power line cycles
+	:param failAbort: stop the sweep at the first point where the source hits its limit
+	:param perLine: source values per line of the levels table
+	:return: TSP lines from loadscript to endscript, every reading is stored in defbuffer1
+	'''
+	source, sense, limit_name = ('CURRENT', 'VOLTAGE', 'vlimit') if func == 'CURR' else ('VOLTAGE', 'CURRENT', 'ilimit')
+	values = [f'{v:.6e}' for v in srcList]
+	lines = [f'loadscript {name}',
+			 f'smu.source.func = smu.FUNC_DC_{source}',
+			 'smu.source.autorange = smu.ON',
+			 'smu.source.autodelay = smu.OFF',
+			 f'smu.source.{limit_name}.level = {limit:g}',
+			 f'smu.measure.func = smu.FUNC_DC_{sense}',
+			 'smu.measure.autorange = smu.ON',
+			 f'smu.measure.nplc = {nplc:g}',
+			 'defbuffer1.clear()',
+			 f'defbuffer1.capacity = {max(len(values), 10)}',
+			 'local levels = {']
+	lines += [','.join(values[i:i+perLine]) + ',' for i in range(0, len(values), perLine)]
+	lines += ['}',
+			  'smu.source.level = levels[1]',
+			  'smu.source.output = smu.ON',
+			  'for i = 1, table.getn(levels) do',
+			  'smu.source.level = levels[i]']
+	if delay > 0:
+		lines.append(f'delay({delay:g})')
+	lines.append('smu.measure.read(defbuffer1)')
+	if failAbort:
+		lines.append(f'if smu.source.{limit_name}.tripped == smu.ON then break end')
+	lines += ['end',
+			  'smu.source.level = 0',
+			  'smu.source.output = smu.OFF',
+			  'endscript']
+	return lines
+
 class Model2450(object):
 	def __init__(self, visa_name):
-		self.smu = keithley2450.Keithley2450(visa_name)
+		self.visa_name = visa_name
+		self.smu = keithley2450.Keithley2450(InstrumentPool.adapter(visa_name))
+		self.cache = InstrumentPool.state_cache(visa_name)
+		StateCache.attach(self.smu, self.cache)    # repeated settings, e.g. :SENS:FUNC before every :READ?, are not sent again
+		self.batcher = WriteBatch.WriteBatch(self.smu.write, root = True)
+		WriteBatch.attach(self.smu, self.batcher)
 		
 		print(visa_name+' ->')
-		print(self.smu.ask("*IDN?"))
 		
 	def close(self):
 		try:
 			self.smu.shutdown()
 		except Exception:
 			pass
+		InstrumentPool.release_session(self.visa_name)
+	
+	def idn(self):
+		return InstrumentPool.identify(self.visa_name)
 	
 	def reset(self):
 		self.smu.reset()
 	
 	def read(self):
+		self.batcher.flush()
 		return self.smu.read()
 	
 	def write(self, string):
@@ -37,6 +93,12 @@ class Model2450(object):
 		
 	def query(self, string):
 		return self.smu.ask(string)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
 	def on(self):
 		self.smu.enable_source()
@@ -58,19 +120,23 @@ class Model2450(object):
 			time.sleep(0.1)
 			self.write(":SYSTem:BEEPer 587, 0.2")
 	
+	@WriteBatch.batched
 	def initSourceCurr(self, compVolt, currRange = None):
 		self.smu.apply_current(current_range=currRange)
 		self.smu.compliance_voltage = compVolt
 		self.smu.source_current = 0.0
 			
+	@WriteBatch.batched
 	def initSourceVolt(self, compCurr, voltRange = None):
 		self.smu.apply_voltage(voltage_range=voltRange)
 		self.smu.compliance_current = compCurr
 		self.smu.source_voltage = 0.0
 	
+	@WriteBatch.batched
 	def initSenseVolt(self, senseRange = 21, nplc = 1, autoRange = True):
 		self.smu.measure_voltage(nplc=nplc, voltage=senseRange, auto_range=autoRange)
 		
+	@WriteBatch.batched
 	def initSenseCurr(self, senseRange = 1.05e-4, nplc = 1, autoRange = True):
 		self.smu.measure_current(nplc=nplc, current=senseRange, auto_range=autoRange)
 		
@@ -256,10 +322,11 @@ class Model2450(object):
 		return dataMat
 	
 	
-	def executeCurrBias(self, bias, num):
+	def executeCurrBias(self, bias, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Current Bias at {bias}A with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		self.smu.source_current = bias
 		start_time = time.time()
 		self.on()	
@@ -270,17 +337,18 @@ class Model2450(object):
 			t = time.time()-start_time
 			volt = self.getVoltData()
 			resis = volt/bias
-			dataMat.append([volt, bias, resis, t])
+			record([volt, bias, resis, t])
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'\r[{nowtime}] --> Current Bias Finished!')
-		return dataMat
+		return dataMat if writer is None else writer
 	
-	def executeVoltBias(self, bias, num):
+	def executeVoltBias(self, bias, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Voltage Bias at {bias}V with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		self.smu.source_voltage = bias
 		self.beeper(freq=4000,t=0.2,loop=1)
 		start_time = time.time()
@@ -289,17 +357,18 @@ class Model2450(object):
 			t = time.time()-start_time
 			curr = self.getCurrData()
 			resis = bias/curr
-			dataMat.append([bias, curr, resis, t])
+			record([bias, curr, resis, t])
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] --> Voltage Bias Finished!')
-		return dataMat
+		return dataMat if writer is None else writer
 	
-	def executeCurrBiasStep(self, start, stop, stepnum, num):
+	def executeCurrBiasStep(self, start, stop, stepnum, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Current Bias Step from {start}A to {stop}A with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		currList = [i/stepnum*(stop-start)+start for i in list(range(0, stepnum+1))]
 		self.smu.source_current = currList[0]
 		start_time = time.time()
@@ -316,17 +385,18 @@ class Model2450(object):
 					resis = volt/self.getCurrData()
 				else:
 					resis = volt/Ibias
-				dataMat.append([volt, Ibias, resis, t])
+				record([volt, Ibias, resis, t])
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'\r[{nowtime}] --> Current Bias Step Finished!')
-		return dataMat
+		return dataMat if writer is None else writer
 	
-	def executeVoltBiasStep(self, start, stop, stepnum, num):
+	def executeVoltBiasStep(self, start, stop, stepnum, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Current Bias Step from {start}V to {stop}V with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		voltList = [i/stepnum*(stop-start)+start for i in list(range(0, stepnum+1))]
 		self.smu.source_voltage = voltList[0]
 		self.beeper(freq=4000,t=0.2,loop=1)
@@ -338,40 +408,351 @@ class Model2450(object):
 				t = time.time()-start_time
 				curr = self.getCurrData()
 				resis = Vbias/curr
-				dataMat.append([Vbias, curr, resis, t])
+				record([Vbias, curr, resis, t])
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] --> Voltage Bias Step Finished!')
+		return dataMat if writer is None else writer
+
+	#### INSTRUMENT-SIDE (BUFFERED) SWEEP ####
+
+	def loadSourceList(self, func, values, chunk = 100):
+		'''
+		:param func: source function of the list, 'CURR' or 'VOLT'
+		:param values: source values uploaded as the instrument-side source list
+		:param chunk: values per write, the rest of the list is appended with :APP
+		'''
+		values = [f'{v:.6e}' for v in values]
+		self.write(f":SOUR:LIST:{func} " + ','.join(values[:chunk]))
+		for i in range(chunk, len(values), chunk):
+			self.write(f":SOUR:LIST:{func}:APP " + ','.join(values[i:i+chunk]))
+
+	def waitTrigger(self, poll = 0.05, timeout = None):
+		'''
+		Block until the trigger model leaves the RUNNING/WAITING/BUILDING states.
+		:param poll: interval between :TRIG:STAT? queries
+		:param timeout: abort the trigger model after timeout seconds, None for no limit
+		'''
+		start_time = time.time()
+		while self.query(":TRIG:STAT?").split(';')[0].strip() in ('RUNNING', 'WAITING', 'BUILDING', 'ABORTING'):
+			if (timeout is not None) and (time.time()-start_time > timeout):
+				self.write(":ABOR")
+				raise TimeoutError('Trigger model still running after %g s' %timeout)
+			time.sleep(poll)
+
+	def readBuffer(self, num, elements = 'READ,SOUR,REL', buffer = 'defbuffer1', start = 1, chunk = 1000):
+		'''
+		:param num: number of readings to fetch
+		:param elements: :TRAC:DATA? buffer elements, one column each
+		:param start: index of the first reading (the buffer index starts at 1)
+		:param chunk: readings per :TRAC:DATA? query, keeps every transfer under the VISA timeout
+		:return: (num, len(elements)) array
+		'''
+		ncol = len(elements.split(','))
+		data = np.empty((num, ncol))
+		for i in range(0, num, chunk):
+			n = min(chunk, num-i)
+			raw = self.query(f':TRAC:DATA? {start+i}, {start+i+n-1}, "{buffer}", {elements}')
+			data[i:i+n] = np.array(raw.split(','), dtype=float).reshape(n, ncol)
+		return data
+
+	def _executeBufferedSweep(self, func, srcList, delay, failAbort, timeout):
+		num = len(srcList)
+		self.write(":SENS:FUNC 'VOLT'" if func == 'CURR' else ":SENS:FUNC 'CURR'")
+		if int(float(self.query(':TRAC:POIN? "defbuffer1"'))) < num:
+			self.write(f':TRAC:POIN {num}, "defbuffer1"')
+		self.write(':TRAC:CLE "defbuffer1"')
+		self.loadSourceList(func, srcList)
+		self.write(f":SOUR:SWE:{func}:LIST 1, {delay}, 1, {'ON' if failAbort else 'OFF'}")
+		self.beeper(freq=4000,t=0.2,loop=1)
+		self.write(":INIT")
+		try:
+			self.waitTrigger(timeout = timeout)
+		finally:    # also after a timeout or an error, the sweep may have stopped anywhere in the list
+			self.cache.invalidate()    # the trigger model changed the source level behind the cache
+			self.off()
+		num = int(float(self.query(':TRAC:ACT? "defbuffer1"')))
+		reading, source, t = self.readBuffer(num, 'READ,SOUR,REL').T
+		volt, curr = (reading, source) if func == 'CURR' else (source, reading)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			resis = volt/curr
+		self.beeper(freq=4000,t=0.2,loop=2)
+		return np.column_stack((volt, curr, resis, t))    #[Volt, Curr, Resis, Time]
+
+	def executeBufferedCurrSweep(self, currList, rev = False, delay = 0.0, failAbort = False, timeout = None):
+		'''
+		Upload the whole current list as an instrument-side sweep, run it from the
+		trigger model and pull the reading buffer back in bulk.
+		:param currList: source currents, e.g. a sweeplist plan
+		:param rev: append the reversed list for a round-trip sweep
+		:param delay: source delay before each measurement in seconds
+		:param failAbort: abort the sweep when the source hits compliance
+		:param timeout: abort the sweep after timeout seconds, None for no limit
+		:return: (n, 4) array of [Volt, Curr, Resis, Time], Time is the instrument timestamp relative to the first reading
+		'''
+		currList = list(currList)
+		if rev == True:
+			currList.extend(currList[::-1])
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute Buffered Current Sweep with {len(currList)} points...')
+		dataMat = self._executeBufferedSweep('CURR', currList, delay, failAbort, timeout)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> Buffered Current Sweep Finished!')
 		return dataMat
-		
-		
-			
+
+	def executeBufferedVoltSweep(self, voltList, rev = False, delay = 0.0, failAbort = False, timeout = None):
+		'''
+		Voltage-source counterpart of executeBufferedCurrSweep.
+		:return: (n, 4) array of [Volt, Curr, Resis, Time]
+		'''
+		voltList = list(voltList)
+		if rev == True:
+			voltList.extend(voltList[::-1])
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute Buffered Voltage Sweep with {len(voltList)} points...')
+		dataMat = self._executeBufferedSweep('VOLT', voltList, delay, failAbort, timeout)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> Buffered Voltage Sweep Finished!')
+		return dataMat
+
+	#### INSTRUMENT-SIDE (PULSED) SWEEP ####
+
+	def _executePulsedSweep(self, func, srcList, limit, width, period, base, measDelay, nplc, senseRange, timeout):
+		num = len(srcList)
+		sense = 'VOLT' if func == 'CURR' else 'CURR'
+		aperture = nplc/float(self.query(":SYST:LFR?"))
+		if measDelay is None:
+			measDelay = max(width-aperture, 0.0)    # integrate at the end of the pulse, after the DUT has settled
+		if measDelay + aperture > width:
+			raise ValueError('Pulse width %g s is shorter than measure delay plus integration time %g s' %(width, measDelay+aperture))
+		if period < width:
+			raise ValueError('Pulse period %g s is shorter than the pulse width %g s' %(period, width))
+		with self.batch():
+			self.write(f":SENS:FUNC '{sense}'")
+			self.write(f":SENS:{sense}:RANG {senseRange if senseRange else limit}")    # fixed range, no autoranging inside a pulse
+			self.write(f":SENS:{sense}:NPLC {nplc}")
+			self.write(f":SENS:{sense}:AZER OFF")    # no reference readings between the pulses
+			self.write(f":SOUR:FUNC {func}")
+			self.write(f":SOUR:{func}:RANG {max(np.abs(srcList).max(), abs(base))}")    # one range for base and pulse levels
+			self.write(f":SOUR:{func}:{'VLIM' if func == 'CURR' else 'ILIM'} {limit}")
+			self.write(f":SOUR:{func}:DEL 0")    # the trigger model does the timing
+			if int(float(self.query(':TRAC:POIN? "defbuffer1"'))) < num:
+				self.write(f':TRAC:POIN {num}, "defbuffer1"')
+			if f'"{PULSE_LIST}"' in self.query(":SOUR:CONF:LIST:CAT?"):
+				self.write(f':SOUR:CONF:LIST:DEL "{PULSE_LIST}"')
+			self.write(f':SOUR:CONF:LIST:CRE "{PULSE_LIST}"')
+			for level in [base] + [v for value in srcList for v in (value, base)]:    # base, pulse 1, base, pulse 2, ..., base
+				self.write(f":SOUR:{func} {level:.6e}")
+				self.write(f':SOUR:CONF:LIST:STOR "{PULSE_LIST}"')
+			self.write(':TRIG:LOAD "Empty"')
+			self.write(':TRIG:BLOC:BUFF:CLE 1, "defbuffer1"')
+			self.write(f':TRIG:BLOC:CONF:REC 2, "{PULSE_LIST}", 1')    # base level
+			self.write(':TRIG:BLOC:SOUR:STAT 3, ON')
+			self.write(f':TRIG:BLOC:DEL:CONS 4, {period-width:.6e}')    # base part of the period
+			self.write(f':TRIG:BLOC:CONF:NEXT 5, "{PULSE_LIST}"')    # pulse level
+			self.write(f':TRIG:BLOC:DEL:CONS 6, {measDelay:.6e}')
+			self.write(':TRIG:BLOC:MEAS 7, "defbuffer1"')
+			self.write(f':TRIG:BLOC:DEL:CONS 8, {width-measDelay-aperture:.6e}')
+			self.write(f':TRIG:BLOC:CONF:NEXT 9, "{PULSE_LIST}"')    # back to base
+			self.write(f':TRIG:BLOC:BRAN:COUN 10, {num}, 4')
+			self.write(':TRIG:BLOC:SOUR:STAT 11, OFF')
+		self.write(":INIT")
+		if timeout is None:
+			timeout = 10 + 2*num*period
+		try:
+			self.waitTrigger(timeout = timeout)
+		finally:    # an aborted trigger model may leave the output on at the pulse level
+			self.cache.invalidate()    # the configuration list changed the source level behind the cache
+			self.off()
+		num = int(float(self.query(':TRAC:ACT? "defbuffer1"')))
+		reading, source, t = self.readBuffer(num, 'READ,SOUR,REL', chunk = max(num, 1)).T
+		volt, curr = (reading, source) if func == 'CURR' else (source, reading)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			resis = volt/curr
+		return np.column_stack((volt, curr, resis, t))    #[Volt, Curr, Resis, Time]
+
+	def executePulsedCurrSweep(self, currList, compVolt, width = 1e-3, period = 0.1, base = 0.0, measDelay = None,\
+							   nplc = 0.01, senseRange = None, rev = False, timeout = None):
+		'''
+		Pulsed I-V: every current of the list is applied as one pulse from the base level,
+		the voltage is measured inside the pulse. Levels and timing are set up once as a
+		source configuration list and a trigger model, the readings come back in one
+		transfer from the buffer. The duty cycle width/period sets the heat load on the DUT.
+		:param currList: pulse currents, e.g. a sweeplist plan
+		:param compVolt: voltage limit, also the fixed measure range unless senseRange is given
+		:param width: pulse width in seconds
+		:param period: pulse period in seconds
+		:param base: current between the pulses
+		:param measDelay: seconds from the pulse edge to the start of the measurement, None to measure at the end of the pulse
+		:param nplc: integration time in power line cycles, must fit into the pulse
+		:param senseRange: fixed voltage measure range, None for compVolt
+		:param rev: append the reversed list for a round-trip sweep
+		:param timeout: abort the sweep after timeout seconds, None to estimate from the list
+		:return: (n, 4) array of [Volt, Curr, Resis, Time], Curr is the pulse level, Time relative to the first reading
+		'''
+		currList = list(currList)
+		if rev == True:
+			currList.extend(currList[::-1])
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute Pulsed Current Sweep with {len(currList)} points...')
+		dataMat = self._executePulsedSweep('CURR', currList, compVolt, width, period, base, measDelay, nplc, senseRange, timeout)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> Pulsed Current Sweep Finished!')
+		return dataMat
+
+	def executePulsedVoltSweep(self, voltList, compCurr, width = 1e-3, period = 0.1, base = 0.0, measDelay = None,\
+							   nplc = 0.01, senseRange = None, rev = False, timeout = None):
+		'''
+		Voltage-source counterpart of executePulsedCurrSweep.
+		:return: (n, 4) array of [Volt, Curr, Resis, Time]
+		'''
+		voltList = list(voltList)
+		if rev == True:
+			voltList.extend(voltList[::-1])
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute Pulsed Voltage Sweep with {len(voltList)} points...')
+		dataMat = self._executePulsedSweep('VOLT', voltList, compCurr, width, period, base, measDelay, nplc, senseRange, timeout)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> Pulsed Voltage Sweep Finished!')
+		return dataMat
+
+	#### INSTRUMENT-SIDE (TSP) SWEEP ####
+
+	def tspWrite(self, line):
+		self.smu.adapter.write(line)    # straight to the adapter, TSP lines are not SCPI settings for the cache or the batch
+
+	def tspQuery(self, line):
+		self.smu.adapter.write(line)
+		return self.smu.adapter.read()
+
+	def checkTsp(self):
+		'''
+		TSP scripts need the TSP command set, which the 2450 only changes at power-up.
+		'''
+		if self.tspQuery("*LANG?").strip() != 'TSP':
+			raise RuntimeError('The 2450 runs the SCPI command set: send "*LANG TSP" and power-cycle it to run TSP sweeps')
+
+	def loadScript(self, lines):
+		'''
+		:param lines: TSP lines from loadscript to endscript, e.g. tspSweepScript(...)
+		'''
+		for line in lines:
+			self.tspWrite(line)
+
+	def readTspBuffer(self, num, chunk = 1000):
+		'''
+		:param num: number of readings to fetch from defbuffer1
+		:param chunk: readings per printbuffer, keeps every transfer under the VISA timeout
+		:return: (num, 3) array of [reading, source value, relative timestamp]
+		'''
+		data = np.empty((num, 3))
+		for i in range(0, num, chunk):
+			n = min(chunk, num-i)
+			raw = self.tspQuery(f'printbuffer({i+1}, {i+n}, defbuffer1.readings, defbuffer1.sourcevalues, defbuffer1.relativetimestamps)')
+			data[i:i+n] = np.array(raw.split(','), dtype=float).reshape(n, 3)
+		return data
+
+	def _executeTspSweep(self, func, srcList, limit, delay, nplc, failAbort, timeout):
+		self.checkTsp()
+		self.loadScript(tspSweepScript(func, srcList, limit, delay, nplc, failAbort))
+		if timeout is None:
+			timeout = 10 + 2*len(srcList)*(delay + nplc/50 + 1e-3)    # 50 Hz line cycles plus overhead, doubled
+		connection = self.smu.adapter.connection
+		old_timeout = connection.timeout
+		connection.timeout = 1000*timeout    # the 2450 answers no query before the script has finished
+		try:
+			self.tspWrite(f'{TSP_SCRIPT}.run()')
+			num = int(float(self.tspQuery('print(defbuffer1.n)')))
+		finally:
+			connection.timeout = old_timeout
+		reading, source, t = self.readTspBuffer(num).T
+		volt, curr = (reading, source) if func == 'CURR' else (source, reading)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			resis = volt/curr
+		return np.column_stack((volt, curr, resis, t))    #[Volt, Curr, Resis, Time]
+
+	def executeTspCurrSweep(self, currList, compVolt, rev = False, delay = 0.0, nplc = 1.0, failAbort = False, timeout = None):
+		'''
+		Generate a TSP sweep script from the current list, run it on the 2450 and fetch
+		defbuffer1 in bulk. The points are timed by the instrument, without Python or bus
+		jitter, down to the integration time (nplc = 0.01 is 167 us at 60 Hz).
+		The 2450 must be in the TSP command set (checkTsp), the SCPI methods and pymeasure
+		properties do not work in that mode.
+		:param currList: source currents, e.g. a sweeplist plan
+		:param compVolt: voltage limit
+		:param rev: append the reversed list for a round-trip sweep
+		:param delay: wait between setting a current and measuring in seconds
+		:param nplc: integration time in power line cycles
+		:param failAbort: stop the sweep when the voltage limit trips
+		:param timeout: seconds to wait for the script, None to estimate from the list
+		:return: (n, 4) array of [Volt, Curr, Resis, Time], Time relative to the first reading
+		'''
+		currList = list(currList)
+		if rev == True:
+			currList.extend(currList[::-1])
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute TSP Current Sweep with {len(currList)} points...')
+		dataMat = self._executeTspSweep('CURR', currList, compVolt, delay, nplc, failAbort, timeout)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> TSP Current Sweep Finished!')
+		return dataMat
+
+	def executeTspVoltSweep(self, voltList, compCurr, rev = False, delay = 0.0, nplc = 1.0, failAbort = False, timeout = None):
+		'''
+		Voltage-source counterpart of executeTspCurrSweep.
+		:return: (n, 4) array of [Volt, Curr, Resis, Time]
+		'''
+		voltList = list(voltList)
+		if rev == True:
+			voltList.extend(voltList[::-1])
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute TSP Voltage Sweep with {len(voltList)} points...')
+		dataMat = self._executeTspSweep('VOLT', voltList, compCurr, delay, nplc, failAbort, timeout)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> TSP Voltage Sweep Finished!')
+		return dataMat
+
+
+
 class Model2400(object):
 	def __init__(self, visa_name, timeout:int = 5000):
-		rm = pyvisa.ResourceManager()
-		self.pyvisa = rm.open_resource(visa_name)
-		self.pyvisa.timeout = 500 # Wait for instrument return value, default is infinite wait
+		self.visa_name = visa_name
+		self.pyvisa = InstrumentPool.open_session(visa_name, timeout = 500) # Wait for instrument return value, default is infinite wait
+		self.batcher = WriteBatch.WriteBatch(lambda message: self.pyvisa.write(message), root = True)
+		self.cache = InstrumentPool.state_cache(visa_name)
+		self.cache.invalidate()
+		self.setDataFormat(False)    # a pooled session may have been left in REAL,32 by an earlier driver
 		print(visa_name+' ->')
-		print(self.pyvisa.query("*IDN?"))
 		
 	def close(self):
-		try:
-			self.pyvisa.close()
-		except Exception:
-			pass
+		InstrumentPool.release_session(self.visa_name)
+	
+	def idn(self):
+		return InstrumentPool.identify(self.visa_name)
 	
 	def reset(self):
 		self.write("*RST")
 	
 	def read(self):
+		self.batcher.flush()
 		return self.pyvisa.read()
 	
 	def write(self, string):
-		self.pyvisa.write(string)
+		string = self.cache.filter(string)    # settings already in place are not sent again
+		if string and not self.batcher.write(string):    # queued inside a batch() block
+			self.pyvisa.write(string)
 		
 	def query(self, str):
+		if self.batcher.write(str, query = True):    # the pending writes go out with the query
+			return self.pyvisa.read()
 		return self.pyvisa.query(str)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
 	def on(self):
 		self.write(":OUTP ON")
@@ -396,6 +777,7 @@ class Model2400(object):
 			time.sleep(0.1)
 			self.write(":SYSTem:BEEPer 587, 0.2")
 	
+	@WriteBatch.batched
 	def initSourceCurr(self, autorange = True, fixed = True):
 		self.write(":SOUR:FUNC:MODE CURR")
 		if fixed:
@@ -404,6 +786,7 @@ class Model2400(object):
 			self.write(":SOURce:CURRent:RANGe:AUTO 1")
 		self.write(":SOUR:CURR 0.0")
 			
+	@WriteBatch.batched
 	def initSourceVolt(self, autorange = True, fixed = True):
 		self.write(":SOUR:FUNC:MODE VOLT")
 		if fixed:
@@ -412,12 +795,14 @@ class Model2400(object):
 			self.write(":SOURce:VOLTage:RANGe:AUTO 1")
 		self.write(":SOUR:VOLT 0.0")
 	
+	@WriteBatch.batched
 	def initSenseVolt(self, voltComp, autorange = True):
 		self.write(":SENS:FUNC \"VOLT\"")
 		self.write(":SENS:VOLT:PROT:LEV " + str(voltComp))
 		if autorange:
 			self.write(":SENS:VOLT:RANGE:AUTO 1")
 			
+	@WriteBatch.batched
 	def initSenseCurr(self, currComp, autorange = True):
 		self.write(":SENS:FUNC \"CURR\"")
 		self.write(":SENS:CURR:PROT:LEV " + str(currComp))
@@ -430,16 +815,45 @@ class Model2400(object):
 	def setSourceVolt(self, curr):
 		self.write(":SOUR:VOLT " + str(curr))
 		
+	def setDataFormat(self, binary = True):
+		'''
+		:param binary: True to return readings as little-endian 32-bit floats (:FORM:DATA REAL,32 with
+			:FORM:BORD SWAP), False for ASCII. REAL,32 keeps about 7 significant digits.
+		'''
+		if binary:
+			self.write(":FORM:DATA REAL,32")
+			self.write(":FORM:BORD SWAP")
+		else:
+			self.write(":FORM:DATA ASC")
+		self.binary = binary
+
+	def getDataBlock(self):
+		'''
+		:return: (n, 5) array of [Volt, Curr, Resis, Time, Status] with the n = :TRIG:COUN readings of one :READ?
+		'''
+		if self.binary:
+			self.batcher.flush()
+			values = self.pyvisa.query_binary_values(":READ?", datatype='f', is_big_endian=False, container=np.array)
+		else:
+			values = np.array(self.query(":READ?").split(','), dtype=float)
+		return values.reshape(-1, 5)
+
 	def getData(self):
-		raw = self.query(":READ?")
-		answer = [float(c) for c in raw.split(',')]
+		if self.binary:
+			answer = self.getDataBlock()[0].tolist()
+		else:
+			raw = self.query(":READ?")
+			answer = [float(c) for c in raw.split(',')]
 		answer[4] = int(answer[4])    # change STATUS to int format
 		return answer    #[Volt, Curr, Resis, Time, Status]
 	
 	def systemTimeReset(self):
 		self.write(":SYSTem:TIME:RESet")
 		
-	def executeCurrSweep(self, top, num, loop = False ,polar = True):
+	def executeCurrSweep(self, top, num, loop = False ,polar = True, listmode = False):
+		'''
+		:param listmode: run the sweep from the instrument source list (executeListCurrSweep), returns an (n, 5) array
+		'''
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Current Sweep from 0 to {top}A with {num} points...')
 		dataMat = []
@@ -447,6 +861,8 @@ class Model2400(object):
 		currList.extend(currList[::-1])
 		if loop == True:
 			currList.extend([-i for i in currList])
+		if listmode:
+			return self.executeListCurrSweep(currList)
 		self.on()
 		for I in currList:
 			self.setSourceCurr(I)
@@ -457,7 +873,10 @@ class Model2400(object):
 		print(f'[{nowtime}] --> Current Sweep Finished!')
 		return dataMat
 	
-	def executeVoltSweep(self, top, num, loop = False ,polar = True):
+	def executeVoltSweep(self, top, num, loop = False ,polar = True, listmode = False):
+		'''
+		:param listmode: run the sweep from the instrument source list (executeListVoltSweep), returns an (n, 5) array
+		'''
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Voltage Sweep from 0 to {top}V with {num} points...')
 		dataMat = []
@@ -465,6 +884,8 @@ class Model2400(object):
 		voltList.extend(voltList[::-1])
 		if loop == True:
 			voltList.extend([-i for i in voltList])
+		if listmode:
+			return self.executeListVoltSweep(voltList)
 		self.on()
 		for V in voltList:
 			self.setSourceVolt(V)
@@ -475,67 +896,71 @@ class Model2400(object):
 		print(f'[{nowtime}] --> Voltage Sweep Finished!')
 		return dataMat
 	
-	def executeCurrBias(self, bias, num):
+	def executeCurrBias(self, bias, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Current Bias at {bias}A with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		self.setSourceCurr(bias)
 		self.on()		
 		for i in range(num):
-			dataMat.append(self.getData())
+			record(self.getData())
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] --> Current Bias Finished!')
-		return dataMat
+		return dataMat if writer is None else writer
 	
-	def executeVoltBias(self, bias, num):
+	def executeVoltBias(self, bias, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Voltage Bias at {bias}V with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		self.setSourceVolt(bias)
 		self.on()
 		for i in range(num):
-			dataMat.append(self.getData())
+			record(self.getData())
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] --> Voltage Bias Finished!')
-		return dataMat
+		return dataMat if writer is None else writer
 	
-	def executeCurrBiasStep(self, start, stop, stepnum, num):
+	def executeCurrBiasStep(self, start, stop, stepnum, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Current Bias Step from {start}A to {stop}A with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		currList = [i/stepnum*(stop-start)+start for i in list(range(0, stepnum+1))]
 		self.setSourceCurr(currList[0])
 		self.on()
 		for Ibias in currList:
 			self.setSourceCurr(Ibias)
 			for i in range(num):
-				dataMat.append(self.getData())
+				record(self.getData())
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] --> Current Bias Step Finished!')
-		return dataMat
+		return dataMat if writer is None else writer
 	
-	def executeVoltBiasStep(self, start, stop, stepnum, num):
+	def executeVoltBiasStep(self, start, stop, stepnum, num, writer = None):
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] Execute Current Bias Step from {start}V to {stop}V with {num} points...')
 		dataMat = []
+		record = dataMat.append if writer is None else writer.append    # rows go straight to disk with a DataWriter
 		voltList = [i/stepnum*(stop-start)+start for i in list(range(0, stepnum+1))]
 		self.setSourceVolt(voltList[0])
 		self.on()
 		for Vbias in voltList:
 			self.setSourceVolt(Vbias)
 			for i in range(num):
-				dataMat.append(self.getData())
+				record(self.getData())
 		self.off()
 		self.beeper(freq=4000,t=0.2,loop=2)
 		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
 		print(f'[{nowtime}] --> Voltage Bias Step Finished!')
-		return dataMat	
+		return dataMat if writer is None else writer	
 
 			
 
@@ -550,4 +975,64 @@ class Model2400(object):
 
 
 
-	
\ No newline at end of file
+	
+
+	#### INSTRUMENT-SIDE (LIST) SWEEP ####
+
+	def _executeListSweep(self, func, srcList, delay, pointTime, writer):
+		srcList = list(srcList)
+		data = np.empty((len(srcList), 5))
+		timeout = self.pyvisa.timeout
+		self.write(f":SOUR:{func}:MODE LIST")
+		self.write(f":SOUR:DEL {delay}")
+		self.on()
+		try:
+			for i in range(0, len(srcList), LIST_MAX):
+				chunk = srcList[i:i+LIST_MAX]
+				self.write(f":SOUR:LIST:{func} " + ','.join(f'{v:.6e}' for v in chunk))
+				self.write(f":TRIG:COUN {len(chunk)}")
+				self.pyvisa.timeout = max(timeout, 1000*(1 + len(chunk)*(delay+pointTime)))    # one :READ? takes the whole list
+				data[i:i+len(chunk)] = self.getDataBlock()
+				if writer is not None:
+					writer.extend(data[i:i+len(chunk)])
+		finally:
+			self.pyvisa.timeout = timeout
+			self.off()
+			self.write(":TRIG:COUN 1")
+			self.write(f":SOUR:{func}:MODE FIX")
+		self.beeper(freq=4000,t=0.2,loop=2)
+		return data if writer is None else writer
+
+	def executeListCurrSweep(self, currList, delay = 0.0, binary = True, pointTime = 0.05, writer = None):
+		'''
+		Load the currents into the 2400 source list and take LIST_MAX points per :READ?, the
+		instrument steps through the list on its own so there is no bus turnaround per point.
+		:param currList: source currents, e.g. a sweeplist plan
+		:param delay: source delay before each measurement in seconds
+		:param binary: transfer the readings as REAL,32 (setDataFormat), False keeps ASCII
+		:param pointTime: expected time per point on top of delay (integration, autorange) in seconds, sets the read timeout
+		:param writer: DataWriter receiving the rows of every list as they arrive
+		:return: (n, 5) array of [Volt, Curr, Resis, Time, Status], or writer
+		'''
+		currList = list(currList)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute List Current Sweep with {len(currList)} points...')
+		self.setDataFormat(binary)
+		dataMat = self._executeListSweep('CURR', currList, delay, pointTime, writer)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> List Current Sweep Finished!')
+		return dataMat
+
+	def executeListVoltSweep(self, voltList, delay = 0.0, binary = True, pointTime = 0.05, writer = None):
+		'''
+		Voltage-source counterpart of executeListCurrSweep.
+		:return: (n, 5) array of [Volt, Curr, Resis, Time, Status], or writer
+		'''
+		voltList = list(voltList)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute List Voltage Sweep with {len(voltList)} points...')
+		self.setDataFormat(binary)
+		dataMat = self._executeListSweep('VOLT', voltList, delay, pointTime, writer)
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] --> List Voltage Sweep Finished!')
+		return dataMat
\ No newline at end of file
@@ -5,7 +5,8 @@ Du X.C., March 2023, Univ. of Electronic Science and Technology of China
 Installed PyVISA for GPIB communication.
 """
 
-import pyvisa
+import InstrumentPool
+import WriteBatch
 import time
 import datetime
 # from pymeasure.instruments.keithley import keithley2450
@@ -15,27 +16,37 @@ import numpy as np
 
 class K34461A(object):
 	def __init__(self, visa_name, timeout:int = 5000):
-		rm = pyvisa.ResourceManager()
-		self.pyvisa = rm.open_resource(visa_name)
-		self.pyvisa.timeout = 5000 # Wait for instrument return value, default is infinite wait
+		self.visa_name = visa_name
+		self.pyvisa = InstrumentPool.open_session(visa_name, timeout = 5000) # Wait for instrument return value, default is infinite wait
+		self.batcher = WriteBatch.WriteBatch(lambda message: self.pyvisa.write(message), root = True)
 		
 		print(visa_name+' ->')
-		print(self.pyvisa.query('*IDN?'))
 
 	def close(self):
-		try:
-			self.pyvisa.close()
-		except Exception:
-			pass
+		InstrumentPool.release_session(self.visa_name)
+	
+	def idn(self):
+		return InstrumentPool.identify(self.visa_name)
 	def read(self):
+		self.batcher.flush()
 		return self.pyvisa.read()
 
 	def write(self, string):
-		self.pyvisa.write(string)
+		if not self.batcher.write(string):    # queued inside a batch() block
+			self.pyvisa.write(string)
 
 	def query(self, str):
+		if self.batcher.write(str, query = True):    # the pending writes go out with the query
+			return self.pyvisa.read()
 		return self.pyvisa.query(str)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
+	@WriteBatch.batched
 	def read_volt(self, dc:bool = True, vrange = 0.1, nplc = 1.0):
 		if dc:
 			self.write(f'CONFigure:VOLTage:DC {vrange},DEF')
@@ -47,27 +58,37 @@ class K34461A(object):
 	
 class K32500B(object):
 	def __init__(self, visa_name, timeout:int = 5000):
-		rm = pyvisa.ResourceManager()
-		self.pyvisa = rm.open_resource(visa_name)
-		self.pyvisa.timeout = 5000 # Wait for instrument return value, default is infinite wait
+		self.visa_name = visa_name
+		self.pyvisa = InstrumentPool.open_session(visa_name, timeout = 5000) # Wait for instrument return value, default is infinite wait
+		self.batcher = WriteBatch.WriteBatch(lambda message: self.pyvisa.write(message), root = True)
 		
 		print(visa_name+' ->')
-		print(self.pyvisa.query('*IDN?'))
 		
 	def close(self):
-		try:
-			self.pyvisa.close()
-		except Exception:
-			pass
+		InstrumentPool.release_session(self.visa_name)
+	
+	def idn(self):
+		return InstrumentPool.identify(self.visa_name)
 	def read(self):
+		self.batcher.flush()
 		return self.pyvisa.read()
 
 	def write(self, string):
-		self.pyvisa.write(string)
+		if not self.batcher.write(string):    # queued inside a batch() block
+			self.pyvisa.write(string)
 
 	def query(self, str):
+		if self.batcher.write(str, query = True):    # the pending writes go out with the query
+			return self.pyvisa.read()
 		return self.pyvisa.query(str)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
+	@WriteBatch.batched
 	def set_waveform_square(self, freq:float=1e3,high:float=1.0,low:float=-1.0,duty:float=0.5):
 		'''
 		Parameters
@@ -87,6 +108,7 @@ class K32500B(object):
 		self.write(f'VOLT:HIGH {high}')
 		self.write(f'VOLT:LOW {low}')
 		
+	@WriteBatch.batched
 	def set_waveform_pulse(self, freq:float=20e3,volt:float=0.1,offset:float=0.05,width:float=2e-6,lead:float = 8.4e-9,trail:float = 8.4e-9):
 		
 		self.write(f'FUNC PULS')
@@ -99,6 +121,7 @@ class K32500B(object):
 		self.write(f'FUNCtion:PULSe:TRANsition:TRAiling {trail}')
 		
 		
+	@WriteBatch.batched
 	def set_waveform_ramp(self, freq:float=10e3,volt:float=0.1,offset:float=0.05,sym:float=0.5):
 		'''
 		Parameters
@@ -118,6 +141,7 @@ class K32500B(object):
 		self.write(f'VOLTage {volt}')
 		self.write(f'VOLTage:OFFSet {offset}')
 		
+	@WriteBatch.batched
 	def set_FM_carrier(self,freq:float=10.0,dev:float=5.0,func:str='RAMP',source:bool=True):
 		'''
 		Parameters
@@ -3,7 +3,8 @@
 
 
 
-import pyvisa
+import InstrumentPool
+import WriteBatch
 
 
 
@@ -14,19 +15,34 @@ import pyvisa
 
 class Model335 (object):
 	def __init__(self, visa_name, timeout:int = 5000):
-		rm = pyvisa.ResourceManager()
-		self.pyvisa = rm.open_resource(visa_name)
-		self.pyvisa.timeout = 5000 # Wait for instrument return value, default is infinite wait
+		self.visa_name = visa_name
+		self.pyvisa = InstrumentPool.open_session(visa_name, timeout = 5000) # Wait for instrument return value, default is infinite wait
+		self.batcher = WriteBatch.WriteBatch(lambda message: self.pyvisa.write(message))
 	
+	def close(self):
+		InstrumentPool.release_session(self.visa_name)
+	
+	def idn(self):
+		return InstrumentPool.identify(self.visa_name)
 	
 	def read(self):
+		self.batcher.flush()
 		return self.pyvisa.read()
 
 	def write(self, string):
-		self.pyvisa.write(string)
+		if not self.batcher.write(string):    # queued inside a batch() block
+			self.pyvisa.write(string)
 
 	def query(self, str):
+		if self.batcher.write(str, query = True):    # the pending writes go out with the query
+			return self.pyvisa.read()
 		return self.pyvisa.query(str)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
 	def set_temperature (self, output, temp):
 		'''
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Real-time x-y plot running in its own process.
+The sweep script only appends points to an in-memory queue, a sender thread
+forwards them in batches to a plotting process which updates the line data in
+place and redraws with blitting at a capped frame rate, so plotting never
+blocks (or slows down) the acquisition loop however long the sweep gets.
+The plotting process is started with subprocess instead of multiprocessing so
+the sweep scripts, which have no __main__ guard, are not re-executed in it.
+"""
+
+import sys
+import json
+import time
+import queue
+import pickle
+import threading
+import subprocess
+import numpy as np
+
+class LivePlot(object):
+	def __init__(self, xlabel:str = '', ylabel:str = '', title:str = '', fps:float = 20.0, fmt:str = '*-'):
+		'''
+		:param xlabel, ylabel, title: axes labels and figure title
+		:param fps: maximum redraw rate of the plot window, also the batching rate of the sender
+		:param fmt: matplotlib format string of the curve
+		'''
+		self.fps = fps
+		self.queue = queue.Queue()    # unbounded, add() never waits
+		config = json.dumps({'xlabel': xlabel, 'ylabel': ylabel, 'title': title, 'fps': fps, 'fmt': fmt})
+		self.process = subprocess.Popen([sys.executable, __file__, config], stdin=subprocess.PIPE)
+		self.sender = threading.Thread(target=self._send, daemon=True)
+		self.sender.start()
+
+	def add(self, x, y):
+		'''
+		Queue one point for plotting, returns immediately.
+		'''
+		self.queue.put((x, y))
+
+	def _send(self):
+		stream = self.process.stdin
+		period = 1.0/self.fps
+		finished = False
+		while not finished:
+			points = [self.queue.get()]    # block until there is something to send
+			time.sleep(period)    # let a frame worth of points accumulate
+			while True:
+				try:
+					points.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+			finished = points[-1] is None
+			batch = np.array([p for p in points if p is not None], dtype=float).reshape(-1, 2)
+			try:
+				if batch.size:
+					pickle.dump(batch, stream, protocol=pickle.HIGHEST_PROTOCOL)
+					stream.flush()
+				if finished:
+					stream.close()
+			except OSError:    # plot window process is gone, drop the points
+				finished = True
+
+	def close(self, hold:bool = True):
+		'''
+		Flush the queued points and stop feeding the plot.
+		:param hold: keep the live window open until the user closes it, otherwise close it now
+		'''
+		self.queue.put(None)
+		self.sender.join()
+		if not hold:
+			self.process.terminate()
+			self.process.wait()
+
+
+def _serve(config):
+	'''
+	Plotting process: read point batches from stdin, blit at most config['fps'] frames per second.
+	'''
+	import matplotlib.pyplot as plt
+
+	batches = queue.Queue()
+	def read():
+		while True:
+			try:
+				batches.put(pickle.load(sys.stdin.buffer))
+			except (EOFError, OSError, pickle.UnpicklingError):
+				batches.put(None)
+				return
+	threading.Thread(target=read, daemon=True).start()
+
+	fig, ax = plt.subplots()
+	ax.set_xlabel(config['xlabel'])
+	ax.set_ylabel(config['ylabel'])
+	if config['title']:
+		fig.suptitle(config['title'])
+	line, = ax.plot([], [], config['fmt'], zorder = 1, animated = True)
+	head, = ax.plot([], [], '.', c = 'red', ms = 14, zorder = 2, animated = True)
+	data = np.empty((1024, 2))
+	num = 0
+	state = {'background': None}
+
+	def grab(event):    # (re)capture the static background after every full draw, e.g. resizing
+		state['background'] = fig.canvas.copy_from_bbox(fig.bbox)
+		ax.draw_artist(line)
+		ax.draw_artist(head)
+	fig.canvas.mpl_connect('draw_event', grab)
+
+	def rescale():    # widen the limits by 10% beyond the data so rescaling stays rare
+		lo, hi = data[:num].min(axis=0), data[:num].max(axis=0)
+		pad = np.where(hi > lo, 0.1*(hi-lo), np.maximum(np.abs(hi)*0.1, 1e-12))
+		ax.set_xlim(lo[0]-pad[0], hi[0]+pad[0])
+		ax.set_ylim(lo[1]-pad[1], hi[1]+pad[1])
+
+	plt.show(block = False)
+	fig.canvas.draw()
+	period = 1.0/config['fps']
+	finished = False
+	while not finished:
+		next_frame = time.monotonic() + period
+		new = []
+		try:
+			new.append(batches.get(timeout = period))
+			while True:
+				new.append(batches.get_nowait())
+		except queue.Empty:
+			pass
+		finished = (len(new) > 0) and (new[-1] is None)
+		new = [b for b in new if b is not None]
+		if new:
+			batch = np.concatenate(new)
+			if num + len(batch) > len(data):
+				data = np.resize(data, (max(2*len(data), num+len(batch)), 2))
+			data[num:num+len(batch)] = batch
+			num += len(batch)
+		if not plt.fignum_exists(fig.number):
+			continue    # window closed by the user, keep draining stdin until the sweep ends
+		if new:
+			line.set_data(data[:num, 0], data[:num, 1])
+			head.set_data(data[num-1:num, 0], data[num-1:num, 1])
+			(x0, x1), (y0, y1) = ax.get_xlim(), ax.get_ylim()
+			lo, hi = batch.min(axis=0), batch.max(axis=0)
+			if (num == len(batch)) or lo[0] < x0 or hi[0] > x1 or lo[1] < y0 or hi[1] > y1:
+				rescale()
+				fig.canvas.draw()    # full redraw, grab() refreshes the background
+			elif state['background'] is not None:
+				fig.canvas.restore_region(state['background'])
+				ax.draw_artist(line)
+				ax.draw_artist(head)
+				fig.canvas.blit(fig.bbox)
+		fig.canvas.flush_events()
+		rest = next_frame - time.monotonic()
+		if rest > 0:
+			fig.canvas.start_event_loop(rest)
+	if plt.fignum_exists(fig.number):
+		line.set_animated(False)
+		head.set_animated(False)
+		fig.canvas.draw_idle()
+		plt.show()    # keep the final curve on screen until the window is closed
+
+
+if __name__ == '__main__':
+	_serve(json.loads(sys.argv[1]))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel sweeps on several instruments.
+A MultiSweep runs one job per instrument, each in the worker thread of that
+instrument (AsyncInstrument.executor_for), so independent SMUs sweep at the
+same time and a chip of six devices takes about the time of its slowest device
+instead of the sum. The sessions of the jobs share InstrumentPool.bus_lock:
+transfers never overlap on one GPIB board, while the instruments integrate,
+settle and run their sweeps in parallel. The gain is largest with the
+instrument-side sweeps (buffered, TSP, pulsed, list), which use the bus only
+for setup, status polls and the readout.
+Every job keeps its own result with the host time it started and finished,
+merge() stacks the results on one time axis, mixed 2450/2400 results on their
+shared [Volt, Curr, Resis, Time] columns, extra() keeps the columns beyond them.
+"""
+
+import time
+import datetime
+import functools
+import concurrent.futures
+import numpy as np
+import InstrumentPool
+import AsyncInstrument
+
+def _session(driver):
+	'''
+	:return: the VISA session a driver talks through, None if it has none (serial drivers)
+	'''
+	if hasattr(driver, 'pyvisa'):
+		return driver.pyvisa
+	adapter = getattr(getattr(driver, 'smu', None), 'adapter', None)    # pymeasure drivers (Model2450)
+	return getattr(adapter, 'connection', None)
+
+class Job(object):
+	'''
+	One sweep of a MultiSweep: method(*args, **kwargs) on driver.
+	'''
+	def __init__(self, name, driver, method, args, kwargs):
+		self.name = name
+		self.driver = driver
+		self.method = method
+		self.args = args
+		self.kwargs = kwargs
+		self.result = None
+		self.error = None
+		self.started = None     # host time.time() at the start of the job
+		self.finished = None    # host time.time() at the end of the job
+
+	def __call__(self):
+		func = getattr(self.driver, self.method) if isinstance(self.method, str) else functools.partial(self.method, self.driver)
+		self.started = time.time()
+		try:
+			self.result = func(*self.args, **self.kwargs)
+		except BaseException as err:
+			self.error = err
+		finally:
+			self.finished = time.time()
+		return self.result
+
+
+class MultiSweep(object):
+	'''
+	Run independent sweeps on several instruments in parallel:
+		multi = MultiSweep.MultiSweep()
+		multi.add('D1', smu1, 'executeBufferedCurrSweep', plan)
+		multi.add('D2', smu2, 'executeBufferedCurrSweep', plan)
+		results = multi.run()    # {'D1': dataMat, 'D2': dataMat}
+	'''
+	def __init__(self):
+		self.jobs = []
+
+	def add(self, name, driver, method, *args, **kwargs):
+		'''
+		:param name: label of the result, e.g. the device name
+		:param driver: driver the job runs on, jobs added for the same instrument run one after the other
+		:param method: name of a driver method, e.g. 'executeBufferedCurrSweep', or a function called as method(driver, *args, **kwargs)
+		:param args, kwargs: arguments of the call
+		:return: self
+		'''
+		if any(job.name == name for job in self.jobs):
+			raise ValueError(f'Job {name} already added')
+		self.jobs.append(Job(name, driver, method, args, kwargs))
+		return self
+
+	def run(self, timeout:float = None) -> dict:
+		'''
+		Start every job in the worker thread of its instrument and wait for all of them.
+		A failed job does not stop the others, the first error is raised once all have ended.
+		:param timeout: raise TimeoutError if the jobs have not ended after timeout seconds, None for no limit
+		:return: {name: result of the job}
+		'''
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		print(f'[{nowtime}] Execute {len(self.jobs)} sweeps on {len({id(job.driver) for job in self.jobs})} instruments in parallel...')
+		futures = []
+		for job in self.jobs:
+			job.result, job.error = None, None
+			session, visa_name = _session(job.driver), getattr(job.driver, 'visa_name', None)
+			if (session is not None) and (visa_name is not None):
+				InstrumentPool.share_bus(session, visa_name)
+			futures.append(AsyncInstrument.executor_for(job.driver).submit(job))
+		done, pending = concurrent.futures.wait(futures, timeout = timeout)
+		if pending:
+			raise TimeoutError('%d sweeps still running after %g s' %(len(pending), timeout))
+		for job in self.jobs:
+			if job.error is not None:
+				raise RuntimeError(f'Sweep {job.name} failed') from job.error
+		nowtime = datetime.datetime.now().strftime('%H:%M:%S')
+		wall = max(job.finished for job in self.jobs) - min(job.started for job in self.jobs)
+		print(f'[{nowtime}] --> Parallel Sweeps Finished in {wall:.2f} s (sum of the sweeps {self.busy():.2f} s)!')
+		return {job.name: job.result for job in self.jobs}
+
+	def busy(self) -> float:
+		'''
+		:return: summed duration of the jobs, the wall time they would take one after the other
+		'''
+		return sum(job.finished - job.started for job in self.jobs if job.finished is not None)
+
+	def merge(self, shared:int = 4, time_column:int = 3) -> np.ndarray:
+		'''
+		Stack the results of the jobs on their shared columns, e.g. the [Volt, Curr, Resis, Time] of the
+		2450 sweeps (n, 4) and of the 2400 list sweeps (n, 5), whose Status column is left to extra().
+		:param shared: leading columns stacked, a narrower result is padded with nan
+		:param time_column: column of the instrument timestamps, relative to the start of each sweep, None if there is none
+		:return: rows of [Job, <shared columns>, HostTime], Job is the index in the order of add(), HostTime
+			the instrument timestamp shifted by the start of its job on the host, seconds after the first job started
+		'''
+		t0 = min(job.started for job in self.jobs)
+		blocks = []
+		for index, job in enumerate(self.jobs):
+			data = self._result(job)
+			if (time_column is None) or (time_column >= data.shape[1]) or (len(data) == 0):
+				host = np.full(len(data), job.started - t0)
+			else:
+				host = data[:, time_column] - data[0, time_column] + (job.started - t0)
+			columns = np.full((len(data), shared), np.nan)
+			columns[:, :min(shared, data.shape[1])] = data[:, :shared]
+			blocks.append(np.column_stack((np.full(len(data), index), columns, host)))
+		return np.vstack(blocks)
+
+	def extra(self, shared:int = 4) -> dict:
+		'''
+		:return: {name: columns of the result beyond the shared ones} of the jobs that have any, in the row order of merge()
+		'''
+		return {job.name: self._result(job)[:, shared:] for job in self.jobs if self._result(job).shape[1] > shared}
+
+	def _result(self, job) -> np.ndarray:
+		return np.atleast_2d(np.asarray(job.result, dtype=float))
@@ -8,9 +8,11 @@ DevName = 'xxx-x-x' # will be inserted into filename of saved plot
 Keithley_GPIB_Addr = 18  # Keithley 2400 SourceMeter GPIB address is 16
 Model335_GPIB_Addr = 12  # LakeShore Model335 Cryogenic Temperature Controller
 SR400_GPIB_Addr = 23  # Keithley 2400 SourceMeter GPIB address is 16
+Repeats = 1  # number of gate delay scans accumulated
 
 
 import SRS400
+import GateScan
 import time
 import seaborn as sns
 
@@ -39,34 +41,24 @@ SR400.set_disc_level(channel = 'trigger', level = 0.0, slope = False)  # set tri
 ###   DISPLAY SETTING   ###
 SR400.display_mode(conti = False)  # set as hold display mode
 
-buffer_len = SR400.scan_periods()
-
-start_time_stamp = time.time()
-SR400.count_restart()  # same as double click STOP and then single click START
+hist = GateScan.DelayHistogram.from_counter(SR400, gate = 'A')  # counts keyed by gate delay, accumulated over the scans
 SR400.lcd_message('Pulse Delay Scanning...')  # reset(double click STOP) will erase the custom message
 
-while(not SR400.check_scan_finish()):
-	pass
-	time.sleep(0.1)
-	time_stamp = time.time()-start_time_stamp
-	loop = int(SR400.scan_position())
-	if loop>=2:
-		count = SR400.read_buffer_count(channel = 'ch1', bit = loop-1)
-	else:
-		count = -1
-	print(f'\r[@{time_stamp:.2f} s] Recent period: {loop}/{buffer_len}   Last count = {count}', end = " ")
+progress = lambda n, h: print(f'\r[@{time.time()-start_time_stamp:.2f} s] Scan {n}/{Repeats}   Counts = {h.counts.sum()}', end = " ")
+start_time_stamp = time.time()
+GateScan.acquire(SR400, hist, repeats = Repeats, channel = 'ch1', callback = progress)
 
 SR400.count_stop()
 print('\n Scan Finished!')
+hist.save('GateScan_' + DevName)  # merge with later runs: GateScan.DelayHistogram.load(...).merge(hist)
 
-count = []
-for i in range(buffer_len-1):
-	count.append(SR400.read_buffer_count(channel = 'ch1', bit = i+1))
+count = hist.mean()  # counts per scan of every delay, hist.sigma() is the Poisson error
 
 SR400.close()  # Suspends port before program ends
 
-x = range(0,100*(buffer_len-1),100) 
-fig1 = sns.jointplot(x = "Delay (ns)", count = "Count")
+x = hist.delay*1e9
+fig1 = sns.jointplot(x = x, y = count)
+fig1.set_axis_labels("Delay (ns)", "Count")
 fig1.show()
 
 fig2 = sns.distplot(count, bins = 10)
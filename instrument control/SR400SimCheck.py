@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Checks of the SR400 drivers (SRS400.sr400 and StanfordResearch.SR400) against
+the simulated counter of InstrumentSim, no GPIB bus needed.
+A count or scan end left over from the previous period must not end the wait
+for the period started by count_restart().
+"""
+
+import time
+import InstrumentPool
+import InstrumentSim
+import SRS400
+import StanfordResearch
+
+SR400_Addr = 'GPIB0::23::INSTR'
+Preset = 0.2    # count period, unit: s
+
+InstrumentPool.use_backend(InstrumentSim.SimResourceManager())
+
+###   STALE COUNT END   ###
+for driver in (SRS400.sr400, StanfordResearch.SR400):
+	counter = driver(SR400_Addr)
+	counter.set_count_preset('T', Preset)
+	counter.count_restart()
+	time.sleep(2.5*Preset)    # the previous period ends before the restart
+	counter.status()          # and its count end is latched in the driver
+	counter.count_restart()
+	start_time = time.monotonic()
+	finished = counter.wait_count_finish(timeout = 5)
+	elapsed = time.monotonic() - start_time
+	print(f'{driver.__module__}.{driver.__name__}: wait_count_finish after count_restart took {elapsed:.3f} s')
+	assert finished and elapsed > 0.8*Preset, 'count end of the previous period ended the wait'
+
+InstrumentPool.use_backend(None)
+print('SR400 checks passed')
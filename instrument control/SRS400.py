@@ -5,32 +5,80 @@ Du X.C., March 2023, Univ. of Electronic Science and Technology of China
 Installed PyVISA for GPIB communication.
 """
 
+import time
 import pyvisa
-# import munpy as np
+import numpy as np
+import InstrumentPool
+import WriteBatch
 # from time import sleep
 # from matlplotlib import pyplot as plt 
 
+SRQ_SLICE = 1.0 # longest wait on the SRQ line before the status bit is checked again
+
+class SR400Status(object):
+	'''
+	Decoded SR400 status: the status byte (SS) and the secondary status byte (SI).
+	Flags read as attributes, e.g. status.count_finish, status.gate_err.
+	'''
+	__slots__ = ('status', 'secondary')
+	EVENTS = 0xBF    # SS bits cleared by reading them, all but SRQ
+	BITS = {'para_change': (0, 0), 'count_finish': (0, 1), 'scan_finish': (0, 2), 'overrun': (0, 3),\
+			'gate_err': (0, 4), 'recall_err': (0, 5), 'SRQ': (0, 6), 'command_err': (0, 7),\
+			'triggered': (1, 0), 'inhibited': (1, 1), 'counting': (1, 2)}
+
+	def __init__(self, status:int = 0, secondary:int = 0):
+		self.status = status
+		self.secondary = secondary
+
+	def __getattr__(self, name):
+		if name not in SR400Status.BITS:
+			raise AttributeError(name)
+		byte, bit = SR400Status.BITS[name]
+		return bool(((self.secondary if byte else self.status) >> bit) & 1)
+
+	@property
+	def error(self) -> bool:
+		'''
+		True if any of overrun, gate, recall or command error is set
+		'''
+		return bool(self.status & 0xB8)
+
+	def __repr__(self):
+		return 'SR400Status(' + ', '.join(name for name in SR400Status.BITS if getattr(self, name)) + ')'
+
+
 class sr400(object):
 	def __init__(self, visa_name, timeout:int = 5000):
-		rm = pyvisa.ResourceManager()
-		self.pyvisa = rm.open_resource(visa_name)
-		self.pyvisa.timeout = 5000 # Wait for instrument return value, default is infinite wait
+		self.visa_name = visa_name
+		self.pyvisa = InstrumentPool.open_session(visa_name, timeout = 5000) # Wait for instrument return value, default is infinite wait
+		self.batcher = WriteBatch.WriteBatch(lambda message: self.pyvisa.write(message))
+		self.cache = InstrumentPool.state_cache(visa_name)
+		self.cache.invalidate()
+		self.events = 0    # SS event bits read by status() and not yet reported by a check_*
 	
 	def close(self):
-		try:
-			self.pyvisa.close()
-		except Exception:
-			pass
+		InstrumentPool.release_session(self.visa_name)
 		
 	
 	def read(self):
+		self.batcher.flush()
 		return self.pyvisa.read()
 
 	def write(self, string):
-		self.pyvisa.write(string)
+		string = self.cache.filter(string)    # settings already in place are not sent again
+		if string and not self.batcher.write(string):    # queued inside a batch() block
+			self.pyvisa.write(string)
 
 	def query(self, str):
+		if self.batcher.write(str, query = True):    # the pending writes go out with the query
+			return self.pyvisa.read()
 		return self.pyvisa.query(str)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
 	def sim_button(self, botton = 'STOP'):
 		keydict = {'DOWN': 0, 'RIGHT': 1, 'LEVEL': 2, 'SETUP': 3,\
@@ -64,8 +112,30 @@ class sr400(object):
 			count = int(self.query('QB ' + str(bit)))
 		return count
 
+	def status(self, secondary:bool = True) -> SR400Status:
+		'''
+		Snapshot of the status in one SS query (and one SI query with secondary), instead of one
+		query per bit. Reading SS clears its event bits on the instrument, they stay pending in
+		the driver until the matching check_* reports them, so no check misses an event.
+		:param secondary: also read the secondary status (triggered, inhibited, counting)
+		:return: SR400Status of the pending events and the current state
+		'''
+		status = int(self.query('SS'))
+		if status & 1:
+			self.cache.invalidate()    # settings changed from the front panel
+		self.events |= status & SR400Status.EVENTS
+		return SR400Status(self.events | status, int(self.query('SI')) if secondary else 0)
+
+	def _take(self, bit:int) -> bool:
+		'''
+		:return: the event of status bit, from a fresh snapshot, and mark it as reported
+		'''
+		value = bool((self.status(secondary = False).status >> bit) & 1)
+		self.events &= ~(1 << bit)
+		return value
+
 	def check_ready(self):
-		return bool(int(self.query('SS 1')))
+		return self._take(1)
 	
 	def check_para_change(self):
 		'''
@@ -73,16 +143,16 @@ class sr400(object):
 		bit is set, it indicates that the front panel knob has 
 		been rotated and a setting has been altered
 		'''
-		return bool(int(self.query('SS 0')))
+		return self._take(0)
 	
 	def check_count_finish(self):
-		return bool(int(self.query('SS 1')))
+		return self._take(1)
 
 	def check_scan_finish(self):
-		return bool(int(self.query('SS 2')))
+		return self._take(2)
 	
 	def check_overrun(self):
-		return bool(int(self.query('SS 3')))
+		return self._take(3)
 	
 	def check_gate_err(self):
 		'''
@@ -90,7 +160,7 @@ class sr400(object):
 		missed. This can occur if a gate delay or width 
 		exceeds the trigger period minus 1 µs
 		'''
-		return bool(int(self.query('SS 4')))
+		return self._take(4)
 
 	def check_recall_err(self):
 		'''
@@ -98,32 +168,139 @@ class sr400(object):
 		 setting detects an error in the recalled data. If an 
 		 error is found, the instrument setup is not altered.
 		'''
-		return bool(int(self.query('SS 5')))
+		return self._take(5)
 
 	def check_SRQ(self):
-		return bool(int(self.query('SS 6')))
+		return self.status(secondary = False).SRQ
 	
 	def check_triggered(self):
-		return bool(int(self.query('SI 0')))
+		return SR400Status(0, int(self.query('SI'))).triggered
 	
 	def check_inhibited(self):
-		return bool(int(self.query('SI 1')))
+		return SR400Status(0, int(self.query('SI'))).inhibited
 	
 	def check_counting(self):
-		return bool(int(self.query('SI 2')))
+		return SR400Status(0, int(self.query('SI'))).counting
 	
 	def check_command_err(self):
 		'''
 		This bit is set when an illegal command is received.
 		'''
-		return bool(int(self.query('SS 7')))
+		return self._take(7)
+
+	#### SERVICE REQUEST ####
+
+	def _wait_status(self, bit:int, poll:float, timeout:float, srq:bool) -> bool:
+		'''
+		Wait until bit of the status byte is set, and report it as taken like check_* does.
+		With srq the SR400 requests service when the bit sets (SV mask) and the wait sleeps on the
+		GPIB SRQ event, without any bus traffic. Sessions without SRQ events (simulated, serial) poll SS.
+		:return: True once the bit is set, False after timeout seconds
+		'''
+		start_time = time.time()
+		srq = srq and hasattr(self.pyvisa, 'wait_for_srq')
+		if srq:
+			self.write('SV ' + str(1 << bit))
+		while not self._take(bit):
+			left = None if timeout is None else timeout-(time.time()-start_time)
+			if (left is not None) and (left <= 0):
+				return False
+			if srq:
+				try:    # in slices: a request raised just before the wait is caught by the next SS check
+					self.pyvisa.wait_for_srq(int(1000*(SRQ_SLICE if left is None else min(SRQ_SLICE, left))))
+				except pyvisa.errors.VisaIOError as err:
+					if err.error_code != pyvisa.constants.StatusCode.error_timeout:
+						srq = False    # interface without SRQ events, poll from now on
+			else:
+				time.sleep(poll if left is None else min(poll, left))
+		return True
+
+	def wait_count_finish(self, timeout:float = None, poll:float = 0.02, srq:bool = True) -> bool:
+		'''
+		Block until the current count period has ended (status bit 1).
+		:param timeout: give up after timeout seconds, None for no limit
+		:param poll: SS polling interval when no service request can be used
+		:param srq: False to poll SS instead of waiting for the service request
+		:return: True when the period ended, False on timeout
+		'''
+		return self._wait_status(1, poll, timeout, srq)
+
+	def wait_scan_finish(self, timeout:float = None, poll:float = 0.1, srq:bool = True) -> bool:
+		'''
+		Block until the N-period scan has ended (status bit 2).
+		:param timeout: give up after timeout seconds, None for no limit
+		:param poll: SS polling interval when no service request can be used
+		:param srq: False to poll SS instead of waiting for the service request
+		:return: True when the scan ended, False on timeout
+		'''
+		return self._wait_status(2, poll, timeout, srq)
+
+	#### BULK READOUT ####
+
+	def _read_values(self, num:int) -> np.ndarray:
+		'''
+		Read num integers sent by one dump command, however the instrument splits them into messages.
+		'''
+		self.batcher.flush()
+		termination = self.pyvisa.read_termination
+		self.pyvisa.read_termination = None    # end on EOI only, the CR LF between the values does not end a read
+		values = []
+		try:
+			while len(values) < num:
+				values += self.pyvisa.read_raw().split()
+		finally:
+			self.pyvisa.read_termination = termination
+		return np.array([int(v) for v in values[:num]], dtype=np.int64)
+
+	def read_buffer_all(self, channel = 'ch1', num:int = None) -> np.ndarray:
+		'''
+		All stored periods of a scan with one dump command (EA, EB, or ET for both
+		counters) instead of one QA j/QB j query per period.
+		:param channel: 'ch1', 'ch2' or 'both'
+		:param num: number of stored periods, None for the scan length (NP)
+		:return: int64 array of num counts, (num, 2) array of [A, B] for 'both'
+		'''
+		if num is None:
+			num = self.scan_periods()
+		command = {'ch1': 'EA', 'ch2': 'EB', 'both': 'ET'}[channel]
+		self.write(command)
+		if channel == 'both':
+			return self._read_values(2*num).reshape(num, 2)
+		return self._read_values(num)
+
+	def stream_buffer(self, channel = 'ch1', timeout:float = None, srq:bool = True):
+		'''
+		Generator over a running scan: after every count period yields the periods completed since
+		the last yield, read while the next period counts, and ends with the scan.
+			for first, counts in SR400.stream_buffer('ch1'): ...
+		:param channel: 'ch1', 'ch2' or 'both'
+		:param timeout: stop waiting for the next period after timeout seconds
+		:param srq: False to poll SS instead of waiting for the service request
+		:return: yields (index of the first period, int64 array of counts, (n, 2) for 'both')
+		'''
+		total = self.scan_periods()
+		queries = {'ch1': ('QA',), 'ch2': ('QB',), 'both': ('QA', 'QB')}[channel]
+		done = 0
+		while done < total:
+			if not self.wait_count_finish(timeout = timeout, srq = srq):
+				raise TimeoutError('No SR400 count period ended within %g s' %timeout)
+			finished = self.check_scan_finish()
+			ready = total if finished else min(int(self.scan_position())-1, total)    # NN is the period in progress
+			if ready > done:
+				counts = np.array([[int(self.query(f'{q} {j}')) for q in queries] for j in range(done+1, ready+1)], dtype=np.int64)
+				yield done+1, (counts if channel == 'both' else counts[:, 0])
+				done = ready
+			elif finished:
+				break
 
 	def count_restart(self):
-		self.write('CR') # CR command resets the counters
+		self.count_reset()
 		self.write('CS') # CS command same as START key
 
 	def count_reset(self):
 		self.write('CR') # CR command resets the counters
+		self.status(secondary = False)    # read out a count or scan end of the previous period, latched in SS or pending
+		self.events &= ~0b110             # in the driver, so wait_count_finish/wait_scan_finish wait for the new one
 
 	def count_stop(self):
 		self.write('CH') # same effect as pressing the STOP key
@@ -249,6 +426,7 @@ number of periods during a scan is allowed, defaults to 0
 		else:
 			self.write('DM '+ str(channel) + (',0' if fixed else ',1'))
 
+	@WriteBatch.batched
 	def set_disc_level(self, channel = 'ch1', level = 0.0, slope:bool = True):
 		"""
 		:param channel: target channel, allowed string 'ch1', 'ch2', 'trigger'
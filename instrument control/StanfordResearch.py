@@ -7,13 +7,20 @@ Installed PyVISA for GPIB communication.
 
 import serial
 import pyvisa
+import functools
+import InstrumentPool
+import WriteBatch
 import datetime
 import time
+import numpy as np
+
+GPIB_BYTES_PER_SEC = 50e3 # conservative GPIB throughput used to size bulk transfers
+SRQ_SLICE = 1.0 # longest wait on the SRQ line before the status bit is checked again
 
 class SR900 (object):
 	def __init__(self, com_name, timeout:float = 0.5):
 		
-		self.ser = serial.Serial(port = com_name,
+		self.ser = InstrumentPool.open_serial(com_name,
 							baudrate = 115200,
 							bytesize = serial.EIGHTBITS,
 							parity = serial.PARITY_NONE,
@@ -87,7 +94,7 @@ class SR900 (object):
 class SR542 (object):
 	def __init__(self, com_name, timeout:float = 0.5):
 		
-		self.ser = serial.Serial(port = com_name,
+		self.ser = InstrumentPool.open_serial(com_name,
 							baudrate = 115200,
 							bytesize = serial.EIGHTBITS,
 							parity = serial.PARITY_NONE,
@@ -162,30 +169,72 @@ class SR542 (object):
 			print("Illegal internal frequency value")
 	
 
+class SR400Status(object):
+	'''
+	Decoded SR400 status: the status byte (SS) and the secondary status byte (SI).
+	Flags read as attributes, e.g. status.count_finish, status.gate_err.
+	'''
+	__slots__ = ('status', 'secondary')
+	EVENTS = 0xBF    # SS bits cleared by reading them, all but SRQ
+	BITS = {'para_change': (0, 0), 'count_finish': (0, 1), 'scan_finish': (0, 2), 'overrun': (0, 3),\
+			'gate_err': (0, 4), 'recall_err': (0, 5), 'SRQ': (0, 6), 'command_err': (0, 7),\
+			'triggered': (1, 0), 'inhibited': (1, 1), 'counting': (1, 2)}
+
+	def __init__(self, status:int = 0, secondary:int = 0):
+		self.status = status
+		self.secondary = secondary
+
+	def __getattr__(self, name):
+		if name not in SR400Status.BITS:
+			raise AttributeError(name)
+		byte, bit = SR400Status.BITS[name]
+		return bool(((self.secondary if byte else self.status) >> bit) & 1)
+
+	@property
+	def error(self) -> bool:
+		'''
+		True if any of overrun, gate, recall or command error is set
+		'''
+		return bool(self.status & 0xB8)
+
+	def __repr__(self):
+		return 'SR400Status(' + ', '.join(name for name in SR400Status.BITS if getattr(self, name)) + ')'
+
+
 class SR400(object):
 	def __init__(self, visa_name, timeout:int = 5000):
-		rm = pyvisa.ResourceManager()
-		
-		self.pyvisa = rm.open_resource(visa_name)
-		self.pyvisa.timeout = 5000 # Wait for instrument return value, default is infinite wait
+		self.visa_name = visa_name
+		self.pyvisa = InstrumentPool.open_session(visa_name, timeout = 5000) # Wait for instrument return value, default is infinite wait
+		self.batcher = WriteBatch.WriteBatch(lambda message: self.pyvisa.write(message))
+		self.cache = InstrumentPool.state_cache(visa_name)
+		self.cache.invalidate()
+		self.events = 0    # SS event bits read by status() and not yet reported by a check_*
 		print(visa_name+' ->')
 		print('Stanford Research,SR400,Photon Counter')
 	
 	def close(self):
-		try:
-			self.pyvisa.close()
-		except Exception:
-			pass
+		InstrumentPool.release_session(self.visa_name)
 		
 	
 	def read(self):
+		self.batcher.flush()
 		return self.pyvisa.read()
 
 	def write(self, string):
-		self.pyvisa.write(string)
+		string = self.cache.filter(string)    # settings already in place are not sent again
+		if string and not self.batcher.write(string):    # queued inside a batch() block
+			self.pyvisa.write(string)
 
 	def query(self, str):
+		if self.batcher.write(str, query = True):    # the pending writes go out with the query
+			return self.pyvisa.read()
 		return self.pyvisa.query(str)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
 	def sim_button(self, botton = 'STOP'):
 		keydict = {'DOWN': 0, 'RIGHT': 1, 'LEVEL': 2, 'SETUP': 3,\
@@ -219,8 +268,30 @@ class SR400(object):
 			count = int(self.query('QB ' + str(bit)))
 		return count
 
+	def status(self, secondary:bool = True) -> SR400Status:
+		'''
+		Snapshot of the status in one SS query (and one SI query with secondary), instead of one
+		query per bit. Reading SS clears its event bits on the instrument, they stay pending in
+		the driver until the matching check_* reports them, so no check misses an event.
+		:param secondary: also read the secondary status (triggered, inhibited, counting)
+		:return: SR400Status of the pending events and the current state
+		'''
+		status = int(self.query('SS'))
+		if status & 1:
+			self.cache.invalidate()    # settings changed from the front panel
+		self.events |= status & SR400Status.EVENTS
+		return SR400Status(self.events | status, int(self.query('SI')) if secondary else 0)
+
+	def _take(self, bit:int) -> bool:
+		'''
+		:return: the event of status bit, from a fresh snapshot, and mark it as reported
+		'''
+		value = bool((self.status(secondary = False).status >> bit) & 1)
+		self.events &= ~(1 << bit)
+		return value
+
 	def check_ready(self):
-		return bool(int(self.query('SS 1')))
+		return self._take(1)
 	
 	def check_para_change(self):
 		'''
@@ -228,16 +299,16 @@ class SR400(object):
 		bit is set, it indicates that the front panel knob has 
 		been rotated and a setting has been altered
 		'''
-		return bool(int(self.query('SS 0')))
+		return self._take(0)
 	
 	def check_count_finish(self):
-		return bool(int(self.query('SS 1')))
+		return self._take(1)
 
 	def check_scan_finish(self):
-		return bool(int(self.query('SS 2')))
+		return self._take(2)
 	
 	def check_overrun(self):
-		return bool(int(self.query('SS 3')))
+		return self._take(3)
 	
 	def check_gate_err(self):
 		'''
@@ -245,7 +316,7 @@ class SR400(object):
 		missed. This can occur if a gate delay or width 
 		exceeds the trigger period minus 1 µs
 		'''
-		return bool(int(self.query('SS 4')))
+		return self._take(4)
 
 	def check_recall_err(self):
 		'''
@@ -253,32 +324,139 @@ class SR400(object):
 		 setting detects an error in the recalled data. If an 
 		 error is found, the instrument setup is not altered.
 		'''
-		return bool(int(self.query('SS 5')))
+		return self._take(5)
 
 	def check_SRQ(self):
-		return bool(int(self.query('SS 6')))
+		return self.status(secondary = False).SRQ
 	
 	def check_triggered(self):
-		return bool(int(self.query('SI 0')))
+		return SR400Status(0, int(self.query('SI'))).triggered
 	
 	def check_inhibited(self):
-		return bool(int(self.query('SI 1')))
+		return SR400Status(0, int(self.query('SI'))).inhibited
 	
 	def check_counting(self):
-		return bool(int(self.query('SI 2')))
+		return SR400Status(0, int(self.query('SI'))).counting
 	
 	def check_command_err(self):
 		'''
 		This bit is set when an illegal command is received.
 		'''
-		return bool(int(self.query('SS 7')))
+		return self._take(7)
+
+	#### SERVICE REQUEST ####
+
+	def _wait_status(self, bit:int, poll:float, timeout:float, srq:bool) -> bool:
+		'''
+		Wait until bit of the status byte is set, and report it as taken like check_* does.
+		With srq the SR400 requests service when the bit sets (SV mask) and the wait sleeps on the
+		GPIB SRQ event, without any bus traffic. Sessions without SRQ events (simulated, serial) poll SS.
+		:return: True once the bit is set, False after timeout seconds
+		'''
+		start_time = time.time()
+		srq = srq and hasattr(self.pyvisa, 'wait_for_srq')
+		if srq:
+			self.write('SV ' + str(1 << bit))
+		while not self._take(bit):
+			left = None if timeout is None else timeout-(time.time()-start_time)
+			if (left is not None) and (left <= 0):
+				return False
+			if srq:
+				try:    # in slices: a request raised just before the wait is caught by the next SS check
+					self.pyvisa.wait_for_srq(int(1000*(SRQ_SLICE if left is None else min(SRQ_SLICE, left))))
+				except pyvisa.errors.VisaIOError as err:
+					if err.error_code != pyvisa.constants.StatusCode.error_timeout:
+						srq = False    # interface without SRQ events, poll from now on
+			else:
+				time.sleep(poll if left is None else min(poll, left))
+		return True
+
+	def wait_count_finish(self, timeout:float = None, poll:float = 0.02, srq:bool = True) -> bool:
+		'''
+		Block until the current count period has ended (status bit 1).
+		:param timeout: give up after timeout seconds, None for no limit
+		:param poll: SS polling interval when no service request can be used
+		:param srq: False to poll SS instead of waiting for the service request
+		:return: True when the period ended, False on timeout
+		'''
+		return self._wait_status(1, poll, timeout, srq)
+
+	def wait_scan_finish(self, timeout:float = None, poll:float = 0.1, srq:bool = True) -> bool:
+		'''
+		Block until the N-period scan has ended (status bit 2).
+		:param timeout: give up after timeout seconds, None for no limit
+		:param poll: SS polling interval when no service request can be used
+		:param srq: False to poll SS instead of waiting for the service request
+		:return: True when the scan ended, False on timeout
+		'''
+		return self._wait_status(2, poll, timeout, srq)
+
+	#### BULK READOUT ####
+
+	def _read_values(self, num:int) -> np.ndarray:
+		'''
+		Read num integers sent by one dump command, however the instrument splits them into messages.
+		'''
+		self.batcher.flush()
+		termination = self.pyvisa.read_termination
+		self.pyvisa.read_termination = None    # end on EOI only, the CR LF between the values does not end a read
+		values = []
+		try:
+			while len(values) < num:
+				values += self.pyvisa.read_raw().split()
+		finally:
+			self.pyvisa.read_termination = termination
+		return np.array([int(v) for v in values[:num]], dtype=np.int64)
+
+	def read_buffer_all(self, channel = 'ch1', num:int = None) -> np.ndarray:
+		'''
+		All stored periods of a scan with one dump command (EA, EB, or ET for both
+		counters) instead of one QA j/QB j query per period.
+		:param channel: 'ch1', 'ch2' or 'both'
+		:param num: number of stored periods, None for the scan length (NP)
+		:return: int64 array of num counts, (num, 2) array of [A, B] for 'both'
+		'''
+		if num is None:
+			num = self.scan_periods()
+		command = {'ch1': 'EA', 'ch2': 'EB', 'both': 'ET'}[channel]
+		self.write(command)
+		if channel == 'both':
+			return self._read_values(2*num).reshape(num, 2)
+		return self._read_values(num)
+
+	def stream_buffer(self, channel = 'ch1', timeout:float = None, srq:bool = True):
+		'''
+		Generator over a running scan: after every count period yields the periods completed since
+		the last yield, read while the next period counts, and ends with the scan.
+			for first, counts in SR400.stream_buffer('ch1'): ...
+		:param channel: 'ch1', 'ch2' or 'both'
+		:param timeout: stop waiting for the next period after timeout seconds
+		:param srq: False to poll SS instead of waiting for the service request
+		:return: yields (index of the first period, int64 array of counts, (n, 2) for 'both')
+		'''
+		total = self.scan_periods()
+		queries = {'ch1': ('QA',), 'ch2': ('QB',), 'both': ('QA', 'QB')}[channel]
+		done = 0
+		while done < total:
+			if not self.wait_count_finish(timeout = timeout, srq = srq):
+				raise TimeoutError('No SR400 count period ended within %g s' %timeout)
+			finished = self.check_scan_finish()
+			ready = total if finished else min(int(self.scan_position())-1, total)    # NN is the period in progress
+			if ready > done:
+				counts = np.array([[int(self.query(f'{q} {j}')) for q in queries] for j in range(done+1, ready+1)], dtype=np.int64)
+				yield done+1, (counts if channel == 'both' else counts[:, 0])
+				done = ready
+			elif finished:
+				break
 
 	def count_restart(self):
-		self.write('CR') # CR command resets the counters
+		self.count_reset()
 		self.write('CS') # CS command same as START key
 
 	def count_reset(self):
 		self.write('CR') # CR command resets the counters
+		self.status(secondary = False)    # read out a count or scan end of the previous period, latched in SS or pending
+		self.events &= ~0b110             # in the driver, so wait_count_finish/wait_scan_finish wait for the new one
 
 	def count_stop(self):
 		self.write('CH') # same effect as pressing the STOP key
@@ -404,6 +582,7 @@ number of periods during a scan is allowed, defaults to 0
 		else:
 			self.write('DM '+ str(channel) + (',0' if fixed else ',1'))
 
+	@WriteBatch.batched
 	def set_disc_level(self, channel = 'ch1', level = 0.0, slope:bool = True):
 		"""
 		:param channel: target channel, allowed string 'ch1', 'ch2', 'trigger'
@@ -456,31 +635,62 @@ number of periods during a scan is allowed, defaults to 0
 				print('Illegal port mapping!')
 					
 
+def _settles(method):
+	'''
+	Decorator of the SR830 setters that disturb the outputs: a set (not a query) restarts the settle time.
+	'''
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		result = method(self, *args, **kwargs)
+		if result is None:    # setters return nothing, queries the value
+			self.mark_change()
+		return result
+	return wrapper
+
 class SR830(object):
+	BUFFER_SIZE = 16383 # bins per display buffer
+	SNAP_FIELDS = {1: 'X', 2: 'Y', 3: 'R', 4: 'theta', 5: 'aux1', 6: 'aux2', 7: 'aux3',\
+				   8: 'aux4', 9: 'freq', 10: 'ch1', 11: 'ch2'}
+	TIME_CONSTANTS = tuple(m*10.0**e for e in range(-5, 5) for m in (1, 3)) # seconds of OFLT index 0 (10 us) to 19 (30 ks)
+	SETTLE_TAUS = {0: 5, 1: 7, 2: 9, 3: 10} # time constants to settle within 1% for OFSL 6, 12, 18, 24 dB/oct
+	
 	def __init__(self, visa_name, timeout:int = 5000):
-		rm = pyvisa.ResourceManager()
-		self.pyvisa = rm.open_resource(visa_name)
-		self.pyvisa.timeout = 500 # Wait for instrument return value, default is infinite wait
+		self.visa_name = visa_name
+		self.pyvisa = InstrumentPool.open_session(visa_name, timeout = 500) # Wait for instrument return value, default is infinite wait
+		self.batcher = WriteBatch.WriteBatch(lambda message: self.pyvisa.write(message))
+		self.time_const = None # OFLT and OFSL index last set or read, None until known
+		self.slope = None
+		self.settle_until = 0.0 # time.monotonic() when the outputs have settled after the last change
 		print(visa_name+' ->')
-		print(self.pyvisa.query('*IDN?'))
 	
 	def close(self):
-		try:
-			self.pyvisa.close()
-		except Exception:
-			pass
+		InstrumentPool.release_session(self.visa_name)
+	
+	def idn(self):
+		return InstrumentPool.identify(self.visa_name)
 		
 	def read(self):
+		self.batcher.flush()
 		return self.pyvisa.read()
 
 	def write(self, string):
-		self.pyvisa.write(string)
+		if not self.batcher.write(string):    # queued inside a batch() block
+			self.pyvisa.write(string)
 
 	def query(self, str):
+		if self.batcher.write(str, query = True):    # the pending writes go out with the query
+			return self.pyvisa.read()
 		return self.pyvisa.query(str)
+
+	def batch(self):
+		'''
+		with driver.batch(): collect the writes and send them as one transfer, flushed by the first query
+		'''
+		return self.batcher
 	
 	#### REFERENCE and PHASE COMMANDS ####
 	
+	@_settles
 	def set_ref_phase(self, phase:float=0.0, query:bool = False):
 		'''
 		:param phase: The PHAS command sets or queries the reference phase shift. The parameter x is the phase (real number of degrees). The PHAS x command will set the phase shift to x. The value of x will be rounded to 0.01°. The phase may be programmed from -360.00 £ x £ 729.99 and will be wrapped around at ±180°. For example, the PHAS 541.0 command will set the phase to -179.00° (541-360=181=-179). The PHAS? queries the
@@ -491,6 +701,7 @@ phase shift.
 		else:
 			self.write(f'PHAS {phase:.4f}')
 	
+	@_settles
 	def set_ref_mode(self, inter:bool=True, query:bool = False):
 		'''
 		:param inter: The FMOD command sets or queries the reference source. The parameter i selects internal (i=1) or external (i=0).
@@ -500,6 +711,7 @@ phase shift.
 		else:
 			self.write(f'FMOD {int(inter)}')
 	
+	@_settles
 	def set_ref_freq(self, freq:float=1000.0, query:bool = False):
 		'''
 		:param freq: The FREQ f command sets the frequency of the internal oscillator. This command is allowed only if the reference source is internal. The parameter f is a frequency (real number of Hz). The value of f will be rounded to 5 digits or 0.0001 Hz, whichever is greater. The value of f is limited to 0.001 £ f £ 102000. If the harmonic number is greater than 1, then the frequency is limited to nxf £ 102 kHz where n is the harmonic number.
@@ -518,6 +730,7 @@ phase shift.
 		else:
 			self.write(f'SRLP {mode}')
 			
+	@_settles
 	def set_ref_harmonic(self, harmonic:int=1, query:bool = False):
 		'''
 		:param harmonic: The HARM command sets or queries the detection harmonic. This parameter is an integer from 1 to 19999. The HARM i command will set the lock-in to detect at the ith harmonic of the reference frequency, defaults to 1
@@ -527,6 +740,7 @@ phase shift.
 		else:
 			self.write(f'HARM {harmonic}')
 			
+	@_settles
 	def set_ref_outputlevel(self, level:float=1.0, query:bool = False):
 		'''
 		:param level: The SLVL command sets or queries the amplitude of the sine output. The parameter x is a voltage (real number of Volts)., defaults to 1.0
@@ -538,6 +752,7 @@ phase shift.
 			
 	#### INPUT and FILTER COMMANDS ####
 	
+	@_settles
 	def set_input_config(self, config:int=0, query:bool=False):
 		'''
 		:param config: The ISRC command sets or queries the input configuration. The parameter i selects A (i=0), A-B (i=1), I (1 MW) (i=2) or I (100 MW) (i=3).
@@ -547,6 +762,7 @@ phase shift.
 		else:
 			self.write(f'ISRC {config}')
 			
+	@_settles
 	def set_input_grounding(self, grounding:bool=False, query:bool=False):
 		'''
 		:param grounding: The IGND command sets or queries the input shield grounding. The parameter i selects Float (i=0) or Ground (i=1).
@@ -556,6 +772,7 @@ phase shift.
 		else:
 			self.write(f'IGND {int(grounding)}')
 			
+	@_settles
 	def set_input_coupling(self, DC:bool=True, query:bool=False):
 		'''
 		:param DC: The ICPL command sets or queries the input coupling. The parameter i selects AC (i=0) or DC (i=1).
@@ -565,6 +782,7 @@ phase shift.
 		else:
 			self.write(f'ICPL {int(DC)}')
 	
+	@_settles
 	def set_input_notchfilter(self, state:int=0, query:bool=False):
 		'''
 		:param state: The ILIN command sets or queries the input line notch filter status. The parameter i selects Out or no filters (i=0), Line notch in (i=1), 2xLine notch in (i=2) or Both notch filters in (i=3).
@@ -576,6 +794,7 @@ phase shift.
 	
 	#### GAIN and TIME CONSTANT COMMANDS ####
 	
+	@_settles
 	def set_sens_sensitivity(self, sensitivity:int=26, query:bool=False):
 		'''
 		
@@ -600,6 +819,7 @@ phase shift.
 		else:
 			self.write(f'SENS {sensitivity}')
 		
+	@_settles
 	def set_sens_reserve(self, mode:int=1, query:bool=False):
 		'''
 		:param sensitivity: The RMOD command sets or queries the reserve mode. The parameter i selects High Reserve (i=0), Normal (i=1) or Low Noise (minimum) (i=2). See the description of the [Reserve] key for the actual reserves for each sensitivity.
@@ -609,6 +829,7 @@ phase shift.
 		else:
 			self.write(f'RMOD {mode}')
 
+	@_settles
 	def set_sens_timeconstant(self, time_const:int=6, query:bool=False):
 		'''
 		:param time_const: 
@@ -624,19 +845,25 @@ phase shift.
 			9 300 ms          19 30 ks
 		'''
 		if query:
-			return int(self.query('OFLT?'))
+			self.time_const = int(self.query('OFLT?'))
+			return self.time_const
 		else:
+			self.time_const = time_const
 			self.write(f'OFLT {time_const}')
 		
+	@_settles
 	def set_sens_lpfslope(self, slope:int=0, query:bool=False):
 		'''
 		:param slope: The OFSL command sets or queries the low pass filter slope. The parameter i selects 6 dB/oct (i=0), 12 dB/oct (i=1), 18 dB/oct (i=2) or 24 dB/oct (i=3).
 		'''
 		if query:
-			return int(self.query('OFSL?'))
+			self.slope = int(self.query('OFSL?'))
+			return self.slope
 		else:
+			self.slope = slope
 			self.write(f'OFSL {slope}')
 			
+	@_settles
 	def set_sens_synchronous(self, status:bool=True, query:bool=False):
 		'''
 		:param status: The SYNC command sets or queries the synchronous filter status. The parameter i selects Off (i=0) or synchronous filtering below 200 Hz (i=1). Synchronous filtering is turned on only if the detection frequency (reference x harmonic number) is less than 200 Hz.
@@ -646,6 +873,41 @@ phase shift.
 		else:
 			self.write(f'SYNC {int(status)}')
 			
+	#### SETTLE SCHEDULING ####
+
+	def settle_time(self) -> float:
+		'''
+		:return: seconds the outputs need to settle after a change: 5, 7, 9 or 10 time constants
+			for 6, 12, 18 or 24 dB/oct. The time constant and slope are queried once if not set yet
+		'''
+		if self.time_const is None:
+			self.set_sens_timeconstant(query = True)
+		if self.slope is None:
+			self.set_sens_lpfslope(query = True)
+		return self.SETTLE_TAUS[self.slope]*self.TIME_CONSTANTS[self.time_const]
+
+	def mark_change(self):
+		'''
+		Restart the settle time, called by the setters that disturb the outputs and by sweep
+		loops after changing the signal itself, e.g. the bias of the device.
+		'''
+		self.settle_until = max(self.settle_until, time.monotonic() + self.settle_time())
+
+	def settle_remaining(self) -> float:
+		'''
+		:return: seconds until the outputs have settled, 0 if they have
+		'''
+		return max(self.settle_until - time.monotonic(), 0.0)
+
+	def wait_settled(self):
+		'''
+		Sleep only for the rest of the settle time. Set the next point, mark_change(), do the
+		I/O of the other instruments, then wait_settled() before reading: the wait overlaps that I/O.
+		'''
+		remaining = self.settle_remaining()
+		if remaining > 0:
+			time.sleep(remaining)
+
 	#### DISPLAY and OUTPUT COMMANDS ####
 	
 	def set_disp_display(self, channel:int=1, display:int=0, ratio:int=0):
@@ -691,7 +953,7 @@ phase shift.
 		:param loopmode: The SEND command sets or queries the end of buffer mode. The parameter i selects 1 Shot (i=0) or Loop (i=1). If Loop mode is used, make sure to pause data storage before reading the data to avoid confusion about which point is the most recent.
 		'''
 		if query:
-			return bool(self.query('SEND ?'))
+			return bool(int(self.query('SEND ?')))
 		else:
 			self.write(f'SEND {int(loopmode)}')
 	
@@ -739,19 +1001,31 @@ phase shift.
 	def read_T(self):
 		return float(self.query('OUTP ? 4'))
 	
+	def snap(self, *params):
+		'''
+		:param params: 2 to 6 SNAP? parameters, all recorded at the same instant
+			1 X             5 Aux In 1      9 Reference Frequency
+			2 Y             6 Aux In 2     10 CH1 display
+			3 R             7 Aux In 3     11 CH2 display
+			4 θ             8 Aux In 4
+		:return: numpy record with one float field per parameter, named as in SNAP_FIELDS (θ is 'theta', .T is the transpose of a record)
+		'''
+		if not 2 <= len(params) <= 6:
+			raise ValueError('SNAP? takes 2 to 6 parameters')
+		values = self.query('SNAP ? ' + ','.join(str(p) for p in params)).split(',')
+		dtype = np.dtype([(self.SNAP_FIELDS[p], float) for p in params])
+		return np.rec.fromrecords([tuple(float(v) for v in values)], dtype=dtype)[0]
+	
 	def read_all(self):
-		data = []
-		data.append(self.read_X())
-		data.append(self.read_Y())
-		data.append(self.read_R())
-		data.append(self.read_T())
-		return data
+		data = self.snap(1, 2, 3, 4)
+		return [float(data.X), float(data.Y), float(data.R), float(data.theta)]    #[X, Y, R, θ]
 	
 	def read_aux(self):
-		return [float(i) for i in self.query('SNAP ? 5,6,7,8').split(',')]
+		return list(self.snap(5, 6, 7, 8).item())    #[Aux In 1-4]
 	
 	def read_freqref(self):
-		return float(self.query('SNAP ? 9,10,11'))
+		data = self.snap(9, 10, 11)
+		return [float(data.freq), float(data.ch1), float(data.ch2)]    #[Ref freq, CH1, CH2]
 	
 	def read_buffer_depth(self):
 		'''
@@ -769,6 +1043,94 @@ changing.
 		buffer_data = [float(i) for i in buffer_str.split(',')[0:-1]]
 		return buffer_data
 	
+	def read_buffer_binary(self, buffer:int=1, start:int=0, num:int=None, chunk:int=None, out=None, fmt:str='TRCB'):
+		'''
+		:param buffer: display buffer (i=1, 2)
+		:param start: first bin to read
+		:param num: number of bins, None for everything stored after start (SPTS?)
+		:param chunk: bins per transfer, None to size it from the VISA timeout
+		:param out: optional preallocated float array of at least num points, filled in place
+		:param fmt: 'TRCB' for IEEE float (4 bytes/bin) or 'TRCL' for the non-normalized mantissa/exponent format (4 bytes/bin, value = m*2^(exp-124))
+		:return: numpy array of the buffered points in the units of the trace
+		If data storage is set to Loop mode, pause storage before reading.
+		'''
+		if num is None:
+			num = self.read_buffer_depth() - start
+		if out is None:
+			out = np.empty(num)
+		if chunk is None:
+			chunk = max(64, int(self.pyvisa.timeout*1e-3 * GPIB_BYTES_PER_SEC/2 / 4))
+		self.batcher.flush()
+		for i in range(0, num, chunk):
+			n = min(chunk, num-i)
+			if fmt == 'TRCB':
+				out[i:i+n] = self.pyvisa.query_binary_values(f'TRCB ? {buffer},{start+i},{n}', datatype='f', is_big_endian=False,\
+											header_fmt='empty', expect_termination=False, data_points=n, container=np.array)
+			elif fmt == 'TRCL':
+				raw = self.pyvisa.query_binary_values(f'TRCL ? {buffer},{start+i},{n}', datatype='h', is_big_endian=False,\
+											header_fmt='empty', expect_termination=False, data_points=2*n, container=np.array)
+				out[i:i+n] = np.ldexp(raw[0::2].astype(float), raw[1::2].astype(int)-124)
+			else:
+				raise ValueError("fmt must be 'TRCB' or 'TRCL'")
+		return out[:num]
+	
+	def read_buffer_all(self, buffers=(1, 2), chunk:int=None, fmt:str='TRCB'):
+		'''
+		:param buffers: display buffers to drain, both by default
+		:return: (len(buffers), N) array holding every stored point of each buffer
+		Both displays always hold the same number of points, so SPTS? is queried once.
+		'''
+		num = self.read_buffer_depth()
+		data = np.empty((len(buffers), num))
+		for row, buffer in zip(data, buffers):
+			self.read_buffer_binary(buffer, 0, num, chunk=chunk, out=row, fmt=fmt)
+		return data
+	
+	def iter_buffer(self, buffers=(1, 2), poll:float=0.5, num:int=None, stop=None, fmt:str='TRCB'):
+		'''
+		Generator draining the data buffers while storage is running.
+		:param buffers: display buffers to read, both by default
+		:param poll: interval between SPTS? queries in seconds
+		:param num: end after num bins have been yielded, None for no limit
+		:param stop: optional callable, once it returns True the bins stored so far are yielded and the generator ends
+		:return: yields (len(buffers), k) arrays holding only the bins stored since the previous yield
+		In 1 Shot mode the generator ends when the buffer is full. In Loop mode 
+		(set_buffer_endmode) the storage is paused, drained, reset and restarted 
+		shortly before the buffer wraps around, so bins are never read twice and 
+		their indices never shift under the reader.
+		'''
+		loopmode = self.set_buffer_endmode(query=True)
+		rate = self.set_buffer_rate(query=True)
+		if rate == 14:    # triggered storage, no way to tell the fill rate
+			margin = self.BUFFER_SIZE//2
+		else:
+			margin = min(self.BUFFER_SIZE//2, int(4*poll*0.0625*2**rate)+16)
+		last = 0
+		total = 0
+		while True:
+			done = (stop is not None) and stop()
+			depth = self.read_buffer_depth()
+			wrap = loopmode and (depth >= self.BUFFER_SIZE-margin)
+			if wrap:
+				self.set_buffer_pause()
+				depth = self.read_buffer_depth()
+			if num is not None:
+				depth = min(depth, last+num-total)
+			if depth > last:
+				data = np.empty((len(buffers), depth-last))
+				for row, buffer in zip(data, buffers):
+					self.read_buffer_binary(buffer, last, depth-last, out=row, fmt=fmt)
+				total += depth-last
+				last = depth
+				yield data
+			if wrap:
+				self.set_buffer_reset()
+				self.set_buffer_start()
+				last = 0
+			if done or ((num is not None) and (total >= num)) or ((not loopmode) and (depth >= self.BUFFER_SIZE)):
+				return
+			time.sleep(poll)
+	
 	#### STATUS REPORTING COMMANDS ####
 	
 	def read_reg_errorstatus(self):
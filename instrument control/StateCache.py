@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Shadow copy of instrument settings.
+A StateCache remembers the value last written to every setting of one
+instrument and drops the commands of a write that would set a setting to the
+value it already holds, so configuration calls inside the per-point loop
+(measure_voltage(nplc=...) or :SENS:FUNC before every :READ?) only reach the
+bus when something changes. Queries, commands without arguments and action
+commands are always sent. *RST, *RCL, key presses and a front-panel change
+(SR400 check_para_change) clear the copy. A range and its autorange are linked, writing
+one forgets the other, and the optional :LEV node is ignored.
+InstrumentPool.state_cache() keeps one StateCache per VISA address, shared by
+every driver of that address.
+"""
+
+import threading
+
+INVALIDATE = ('*RST', '*RCL', 'SYST:PRES', 'SYST:KEY', 'CK', 'CL')    # reset or front-panel access: instrument state unknown
+ACTIONS = ('SYST:BEEP', 'TRAC:CLE', 'TRIG:LOAD', 'TRIG:BLOC', 'SOUR:SWE', 'SOUR:LIST:CURR', 'SOUR:LIST:VOLT',\
+		   'SOUR:CONF:LIST', 'INIT', 'ABOR', 'MS')    # commands with an effect beyond a setting (list uploads and :APP), sent every time
+OPTIONAL = ('LEV', 'IMM')    # optional nodes, :SOUR:VOLT and :SOUR:VOLT:LEV are one setting
+INDEXED = ('CI', 'CP', 'DL', 'DM', 'DS', 'DY', 'GD', 'GM', 'GW', 'GY', 'PL', 'PM', 'PY')    # SR400, first argument selects the channel
+
+def _short(header):
+	nodes = []
+	for node in header.strip().strip(':').upper().split(':'):
+		if len(node) > 4 and node[0] != '*':
+			node = node[:3] if node[3] in 'AEIOU' else node[:4]
+		nodes.append(node)
+	return ':'.join(nodes)
+
+def _setting(key):
+	'''
+	:return: the cache key of a short header, without the optional nodes
+	'''
+	return ':'.join(node for node in key.split(':') if node not in OPTIONAL)
+
+def _linked(key):
+	'''
+	:return: the settings a write of key changes on the instrument as well: a fixed range turns
+		autorange off, autorange picks the range
+	'''
+	if key.endswith(':RANG'):
+		return (key + ':AUTO',)
+	if key.endswith(':RANG:AUTO'):
+		return (key[:-len(':AUTO')],)
+	return ()
+
+def _value(arg):
+	arg = arg.strip().strip('\'"').upper()
+	try:
+		return repr(float(arg))
+	except ValueError:
+		return arg
+
+def _match(key, headers):
+	return any(key == h or key.startswith(h + ':') for h in headers)
+
+class StateCache(object):
+	def __init__(self, separator:str = ';'):
+		'''
+		:param separator: separates the commands of one program message
+		'''
+		self.separator = separator
+		self.values = {}    # setting -> normalised arguments last written
+		self.sent = 0       # commands passed on
+		self.skipped = 0    # commands dropped as redundant
+		self.lock = threading.Lock()
+
+	def invalidate(self, setting:str = None):
+		'''
+		Forget the settings, e.g. after a reset or when the front panel was used.
+		:param setting: forget only this command header, e.g. ':SENS:FUNC', None for all
+		'''
+		with self.lock:
+			if setting is None:
+				self.values.clear()
+			else:
+				self.values.pop(_setting(_short(setting)), None)
+
+	def filter(self, message:str) -> str:
+		'''
+		:return: message without the commands that would not change the instrument state, '' if nothing is left
+		'''
+		kept = []
+		with self.lock:
+			for command in message.split(self.separator):
+				if not command.strip():
+					continue
+				header, _, args = command.strip().partition(' ')
+				key = _short(header)
+				if _match(key, INVALIDATE):
+					self.values.clear()
+				elif args.strip() and ('?' not in header) and not _match(key, ACTIONS):
+					args = args.split(',')
+					key = _setting(key)
+					if key in INDEXED:
+						key, args = f'{key} {args[0].strip()}', args[1:]
+					values = [_value(a) for a in args]
+					if self.values.get(key) == values:
+						self.skipped += 1
+						continue
+					self.values[key] = values
+					for linked in _linked(key):
+						self.values.pop(linked, None)
+				kept.append(command)
+				self.sent += 1
+		return self.separator.join(kept)
+
+
+def attach(instrument, cache:StateCache):
+	'''
+	Route the writes of a pymeasure instrument through cache.
+	The cache starts empty, the instrument may have been used from the front panel since the last run.
+	:return: instrument
+	'''
+	write = instrument.write
+	def cached_write(command, **kwargs):
+		command = cache.filter(command)
+		if command:
+			write(command, **kwargs)
+	cache.invalidate()
+	instrument.write = cached_write
+	instrument.state_cache = cache
+	return instrument
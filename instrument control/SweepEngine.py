@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Sweep plan generator and measurement loop shared by the sweep scripts.
+sweeplist/sweepplan build the multi-cycle hysteresis plan (sweepplan lazily, in
+closed form), AdaptivePlan places the points where the curve changes, SweepEngine runs
+set -> settle -> read -> check -> sink for every point of a plan and collects
+the readings in preallocated NumPy columns.
+"""
+
+import time
+import warnings
+import itertools
+import numpy as np
+
+_sentinel = object()
+
+class SweepPlan(object):
+	'''
+	Lazy sweep plan: the sweep is kept as index ranges over the (at most Npoint+2)
+	distinct set values, so multi-cycle plans are never materialised unless asked
+	for. len(plan) is known up front, iter(plan) yields the set values one by one
+	and plan.array() builds the full NumPy array.
+	'''
+	def __init__(self, values, head, loop, nloop, tail, keepfirst = None, keeplast = None):
+		self.values = values      # distinct set values in sweep direction
+		self.head = head          # index ranges before the repeated loop
+		self.loop = loop          # index ranges of one repeated loop
+		self.nloop = nloop        # number of loop repetitions
+		self.tail = tail          # index ranges after the repeated loop
+		self.keepfirst = keepfirst    # value kept only at its first occurrence (inserted start)
+		self.keeplast = keeplast      # value kept only at its last occurrence (inserted stop)
+		if (keepfirst is not None) and (keeplast == keepfirst):
+			self.keeplast = None      # start == stop: the single remaining visit is the first one
+		self._dropped = sum(max(self._count(v)-1, 0) for v in (self.keepfirst, self.keeplast) if v is not None)
+
+	def _ranges(self):
+		return itertools.chain(self.head, itertools.chain.from_iterable(itertools.repeat(self.loop, self.nloop)), self.tail)
+
+	def _count(self, value):
+		hits = np.flatnonzero(self.values == value).tolist()
+		count = lambda ranges: sum(1 for r in ranges for i in hits if i in r)
+		return count(self.head) + self.nloop*count(self.loop) + count(self.tail)
+
+	def __len__(self):
+		size = lambda ranges: sum(len(r) for r in ranges)
+		return size(self.head) + self.nloop*size(self.loop) + size(self.tail) - self._dropped
+
+	def __iter__(self):
+		first_seen = False
+		last_left = self._count(self.keeplast) if self.keeplast is not None else 0
+		for r in self._ranges():
+			for i in r:
+				v = self.values[i]
+				if (self.keepfirst is not None) and (v == self.keepfirst):
+					if first_seen:
+						continue
+					first_seen = True
+				if (self.keeplast is not None) and (v == self.keeplast):
+					last_left -= 1
+					if last_left > 0:
+						continue
+				yield v
+
+	def array(self):
+		take = lambda ranges: self.values[np.concatenate([np.arange(r.start, r.stop, r.step) for r in ranges] + [np.empty(0, int)])]
+		loop = take(self.loop)
+		parts = [take(self.head)] + [loop]*min(self.nloop, 2) + [take(self.tail)]
+		# every loop copy between the first and the last one is identical, the inserted
+		# start/stop can only survive in the outer parts, so the copies are filtered once and tiled
+		middle = loop
+		for value, parts_order in ((self.keepfirst, 1), (self.keeplast, -1)):
+			if value is None:
+				continue
+			middle = middle[middle != value]
+			seen = False
+			for k in range(len(parts))[::parts_order]:
+				hits = np.flatnonzero(parts[k] == value)
+				if seen:
+					parts[k] = np.delete(parts[k], hits)
+				elif hits.size:
+					parts[k] = np.delete(parts[k], hits[1:] if parts_order == 1 else hits[:-1])
+					seen = True
+		if self.nloop > 2:
+			parts.insert(2, np.tile(middle, self.nloop-2))
+		return np.concatenate(parts)
+
+	def __array__(self, dtype = None, copy = None):
+		return self.array() if dtype is None else self.array().astype(dtype)
+
+
+def sweepplan(bottom, top, start = _sentinel, stop = _sentinel, polarity = True, Ncycle:int = 1, Npoint:int = 100, RemoveNLP = True, tol:float = 1e-9):
+	'''
+	Lazy, closed-form version of sweeplist, same arguments and same sequence.
+	:param bottom, top: limits of the linear sweep space with Npoint points
+	:param start, stop: first and last set value, defaults to the natural ends of the Ncycle triangle
+	:param polarity: True to sweep up first, False to sweep down first
+	:param Ncycle: number of half cycles between bottom and top
+	:param RemoveNLP: drop the repeated visits of start/stop when they are not points of the linear space
+	:param tol: start/stop within tol*step of a linear-space point are snapped onto it instead of being inserted
+	:return: SweepPlan
+	'''
+	if polarity:
+		start = bottom if start is _sentinel else start   # initialization variable start and stop
+		stop = (Ncycle%2)*top+((Ncycle+1)%2)*bottom if stop is _sentinel else stop
+		if (Ncycle == 1) & (stop <= start):   # Check whether there is an illegal termination value
+			stop = top
+			warnings.warn("Meaningless variable 'stop', correct to top!")
+	else:   # Check for negative polarity
+		start = top if start is _sentinel else start
+		stop = (Ncycle%2)*bottom+((Ncycle+1)%2)*top if stop is _sentinel else stop
+		if (Ncycle == 1) & (stop >= start):
+			stop = bottom
+			warnings.warn("Meaningless variable 'stop', correct to bottom!")
+	if Ncycle < 1:
+		raise ValueError('Ncycle must be at least 1')
+
+	linespace = np.linspace(bottom, top, num=Npoint)   # generate sweep linear space
+	atol = tol*(abs(top-bottom)/max(Npoint-1, 1) or 1.0)
+	ss = np.array([start, stop], dtype=float)
+	near = np.abs(ss[:, None] - linespace[None, :]) <= atol
+	mask = near.any(axis=1)     # start/stop already (within tol) in the linear space
+	ss[mask] = linespace[near[mask].argmax(axis=1)]    # snap them onto the grid point
+	values = np.sort(np.append(linespace, ss[~mask]))
+	if not polarity:
+		values = np.flipud(values)    # For negative sweep, flip the linespace
+	loc = np.append(np.flatnonzero(values == ss[0]), np.flatnonzero(values == ss[1])) # same start-stop lookup as the legacy list
+	a, b, M = int(loc[0]), int(loc[1]), len(values)
+
+	# index ranges of the legacy loops over values
+	first_loop = [range(a, b+1)]                          # start to stop
+	seconde_loop = [range(b+1, M), range(M-2, b-1, -1)]   # stop to stop at anti-polarity sweep
+	third_loop = [range(b-1, -1, -1), range(1, b+1)]      # stop to stop at polarity sweep
+	if Ncycle == 1:
+		head, nloop, tail = first_loop, 0, []
+	else:
+		if (polarity & (stop <= start))|(not polarity & (stop >= start)):
+			head = [range(a, M), range(M-2, b-1, -1)]
+		else:
+			head = first_loop + seconde_loop
+		nloop = (Ncycle-2)//2
+		tail = third_loop if Ncycle%2 == 1 else []
+	return SweepPlan(values, head, third_loop + seconde_loop, nloop, tail,
+					 keepfirst = ss[0] if (RemoveNLP and not mask[0]) else None,
+					 keeplast = ss[1] if (RemoveNLP and not mask[1]) else None)
+
+def sweeplist(bottom, top, start = _sentinel, stop = _sentinel, polarity = True, Ncycle:int = 1, Npoint:int = 100, RemoveNLP = True, tol:float = 1e-9):
+	'''
+	:return: the sweep plan of sweepplan(...) as a NumPy array
+	'''
+	return sweepplan(bottom, top, start, stop, polarity, Ncycle, Npoint, RemoveNLP, tol).array()
+
+
+class AdaptivePlan(object):
+	'''
+	Adaptive sweep plan for SweepEngine.run: a coarse linear pass from bottom to top,
+	then passes over the midpoints of the intervals where a response column jumps by
+	more than threshold of its range or bends (change of slope) by as much, until no
+	interval does, the intervals reach min_step or budget points are taken. Every pass
+	is swept in the direction of polarity, the points of a pass in ascending order.
+	run() reports each reading back through feedback(row).
+	Refinement revisits set values already passed, so a hysteretic curve should be
+	swept with a fixed plan (sweepplan) of the branch of interest instead.
+	'''
+	def __init__(self, bottom, top, columns, coarse:int = 21, budget:int = 200, threshold:float = 0.1, min_step:float = None, polarity = True):
+		'''
+		:param bottom, top: limits of the sweep
+		:param columns: response columns judged for refinement, e.g. ('Voltage',) for dV/dI or ('Current', 'Count')
+		:param coarse: points of the first, linear pass
+		:param budget: maximum number of points of the whole sweep
+		:param threshold: change (or change of slope) within one interval, as a fraction of the column range, that asks for a midpoint
+		:param min_step: intervals narrower than 2*min_step are not split, default 1/64 of the coarse step
+		:param polarity: True to sweep every pass up, False down
+		'''
+		self.bottom, self.top = min(bottom, top), max(bottom, top)
+		self.columns = (columns,) if isinstance(columns, str) else tuple(columns)
+		self.coarse = coarse
+		self.budget = budget
+		self.threshold = threshold
+		self.min_step = (self.top-self.bottom)/max(coarse-1, 1)/64 if min_step is None else min_step
+		self.polarity = polarity
+		self.setname = None
+		self.points = {}    # set value -> tuple of the response columns
+		self.passes = 0
+
+	def feedback(self, row):
+		if self.setname is None:
+			self.setname = next(name for name in row if name not in self.columns and name != 'Time')
+		self.points[row[self.setname]] = tuple(row[name] for name in self.columns)
+
+	def scores(self):
+		'''
+		:return: (x, score) with the sorted set values and the score of every interval between them
+		'''
+		x = np.array(sorted(self.points))
+		y = np.array([self.points[v] for v in x], dtype=float).reshape(len(x), len(self.columns))
+		if len(x) < 2:
+			return x, np.zeros(0)
+		span = np.ptp(y, axis=0)
+		span[span == 0] = np.inf
+		h = np.diff(x)
+		dy = np.diff(y, axis=0)
+		score = np.abs(dy)/span    # jump within the interval
+		if len(x) > 2:    # change of slope at the inner points, charged to both neighbouring intervals
+			bend = np.abs(np.diff(dy/h[:, None], axis=0))*((h[:-1]+h[1:])/2)[:, None]/span
+			score[:-1] = np.maximum(score[:-1], bend)
+			score[1:] = np.maximum(score[1:], bend)
+		return x, score.max(axis=1)
+
+	def refine(self):
+		'''
+		:return: midpoints of the next pass in sweep order, at most the remaining budget
+		'''
+		x, score = self.scores()
+		room = self.budget - len(self.points)
+		split = np.flatnonzero((score > self.threshold) & (np.diff(x) >= 2*self.min_step))
+		if room <= 0 or split.size == 0:
+			return np.empty(0)
+		split = split[np.argsort(-score[split], kind='stable')][:room]    # the strongest features first
+		mid = np.sort((x[split] + x[split+1])/2)
+		return mid if self.polarity else mid[::-1]
+
+	def __iter__(self):
+		coarse = np.linspace(self.bottom, self.top, min(self.coarse, self.budget))
+		todo = coarse if self.polarity else coarse[::-1]
+		while len(todo):
+			self.passes += 1
+			for value in todo:
+				yield value
+			todo = self.refine()
+
+
+def compliance_limit(column, limit):
+	'''
+	:return: compliance hook stopping the sweep once |row[column]| reaches limit
+	'''
+	return lambda row: abs(row[column]) >= abs(limit)
+
+
+class SweepEngine(object):
+	def __init__(self, source, sensors:dict, sink = None, settle = 0.0, compliance = None, setname:str = 'set', writer = None):
+		'''
+		:param source: callable(value) applying one set point, e.g. lambda V: keithley.ramp_to_voltage(V, steps=2, pause=20e-3)
+		:param sensors: {column: callable() -> float} read in order after settling. A tuple of
+			column names maps a callable returning several values, e.g. {('Vpp', 'Vp'): read_osci}
+		:param sink: optional callable(data) called after every point with the columns filled so
+			far (views, data[column][-1] is the newest reading), e.g. printing or live plotting
+		:param settle: settle time in seconds after each set, or callable(value) -> seconds
+		:param compliance: optional callable(row) -> bool, the sweep stops after the point where it returns True
+		:param setname: column name of the set values
+		:param writer: optional DataWriter.DataWriter with self.columns, every row is appended to it
+			so the readings survive a crash or Ctrl-C, it is flushed (not closed) at the end of run
+		'''
+		self.source = source
+		self.sensors = [(names if isinstance(names, tuple) else (names,), func) for names, func in sensors.items()]
+		self.sink = sink
+		self.settle = settle
+		self.compliance = compliance
+		self.setname = setname
+		self.writer = writer
+		self.columns = [setname] + [name for names, func in self.sensors for name in names] + ['Time']
+
+	def run(self, plan, t0:float = None):
+		'''
+		:param plan: iterable of set values, e.g. sweeplist(...). Lazy iterables are accepted,
+			the columns then grow geometrically instead of being sized up front. A plan with a
+			feedback(row) method (AdaptivePlan) gets every row right after it was read
+		:param t0: reference timestamp of the Time column, defaults to the start of the run
+		:return: {column: NumPy array} with the set values, every sensor column and Time
+		'''
+		t0 = time.time() if t0 is None else t0
+		size = len(plan) if hasattr(plan, '__len__') else 1024
+		data = {name: np.empty(size) for name in self.columns}
+		num = 0
+		for value in plan:
+			if num == size:
+				size *= 2
+				for name in self.columns:
+					data[name] = np.resize(data[name], size)
+			self.source(value)
+			settle = self.settle(value) if callable(self.settle) else self.settle
+			if settle > 0:
+				time.sleep(settle)
+			row = {self.setname: value}
+			for names, func in self.sensors:
+				reading = func()
+				row.update(zip(names, reading if len(names) > 1 else (reading,)))
+			row['Time'] = time.time() - t0
+			for name in self.columns:
+				data[name][num] = row[name]
+			num += 1
+			if self.writer is not None:
+				self.writer.append([row[name] for name in self.columns])
+			if hasattr(plan, 'feedback'):    # adaptive plans choose the next points from the readings
+				plan.feedback(row)
+			if self.sink is not None:
+				self.sink({name: column[:num] for name, column in data.items()})
+			if (self.compliance is not None) and self.compliance(row):
+				warnings.warn(f'Compliance reached at {self.setname} = {value:g}, sweep stopped.')
+				break
+		if self.writer is not None:
+			self.writer.flush()
+		return {name: column[:num].copy() for name, column in data.items()}
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of SweepEngine.sweeplist/sweepplan against the original per-script
+sweeplist (kept below verbatim as sweeplist_legacy).
+Checks that both produce identical sequences, then times high-resolution
+multi-cycle plans.
+"""
+
+import time
+import warnings
+import itertools
+import numpy as np
+import SweepEngine
+
+def sweeplist_legacy(bottom, top, start = SweepEngine._sentinel, stop = SweepEngine._sentinel, polarity = True, Ncycle:int = 1, Npoint:int = 100, RemoveNLP = True):
+
+	if polarity:
+		start = bottom if start == SweepEngine._sentinel else start   # initialization variable start and stop
+		stop = (Ncycle%2)*top+((Ncycle+1)%2)*bottom if stop == SweepEngine._sentinel else stop
+		if (Ncycle == 1) & (stop <= start):   # Check whether there is an illegal termination value
+			stop = top
+			warnings.warn("Meaningless variable 'stop', correct to top!")
+	else:   # Check for negative polarity
+		start = top if start == SweepEngine._sentinel else start
+		stop = (Ncycle%2)*bottom+((Ncycle+1)%2)*top if stop == SweepEngine._sentinel else stop
+		if (Ncycle == 1) & (stop >= start):
+			stop = bottom
+			warnings.warn("Meaningless variable 'stop', correct to bottom!")
+
+	linespace = np.linspace(bottom, top, num=Npoint)   # generate sweep linear space
+	ss = np.array([start, stop])
+	mask = np.isin(ss, linespace)     # Determine whether a linear space has a start and end value
+	linespace = np.sort(np.append(linespace,ss[~mask]))  # Append an sort values that do not appear
+	if not polarity:
+		linespace = np.flipud(linespace)    # For negative sweep, flip the linespace
+	loc = np.append(np.where(linespace == start), np.where(linespace == stop)) # Look for the start-stop position
+	first_loop = linespace[loc[0]:loc[1]+1]     # the first_loop is from start to stop
+	seconde_loop = np.append(linespace[loc[1]+1:], np.flipud(linespace[loc[1]:-1])) # the seconde_loop is from stop to stop at anti-polarity sweep
+	third_loop = np.append(np.flipud(linespace[:loc[1]]), linespace[1:loc[1]+1]) # the third_loop is from stop to stop at polarity sweep
+	add_loop = np.append(third_loop, seconde_loop)  # add_loop is for multi-cycle sweep
+	if Ncycle == 1:
+		slist = first_loop
+	elif Ncycle >= 2:
+		if (polarity & (stop <= start))|(not polarity & (stop >= start)):
+			first_loop = linespace[loc[0]:]
+			seconde_loop =  np.flipud(linespace[loc[1]:-1])
+			start_loop = np.append(first_loop, seconde_loop)
+		else:
+			start_loop = np.append(first_loop, seconde_loop)
+		slist = np.append(start_loop, np.tile(add_loop, int(np.floor((Ncycle-2)/2))))
+		if Ncycle%2 == 1:
+			slist = np.append(slist, third_loop)
+	if RemoveNLP:
+		if not mask[0]:
+			loc_start = np.argwhere(slist==ss[0])
+			slist = np.delete(slist, loc_start[1:])
+		if not mask[1]:
+			loc_stop = np.argwhere(slist==ss[1])
+			slist = np.delete(slist, loc_stop[:-1])
+	return slist
+
+
+
+def best_of(func, repeat = 3):
+	best = float('inf')
+	for i in range(repeat):
+		t = time.perf_counter()
+		func()
+		best = min(best, time.perf_counter()-t)
+	return best
+
+###   EQUIVALENCE   ###
+warnings.simplefilter('ignore')
+S = SweepEngine._sentinel
+script_cases = [(0.0, 155.0e-3, 0.0, 0.0, True, 1, 50),     # Vsweep_Count_v0 pre-ramp
+				(155.0e-3, 170.0e-3, 0.0, 0.0, True, 1, 200),  # Vsweep_Count_v0
+				(1.0e-3, 0.3, 0.0, 0.0, True, 1, 200),         # Keithley2450_Vsweep_v1
+				(0.0, 8e-3, 0, 0, True, 2, 200),               # Keithley2450_Isweep_v2
+				(0.0, 0.9e-3, 0, 0, True, 1, 100)]             # Keithley2450_VppIsweep
+grid_cases = itertools.product([(-1.0, 1.0), (0.0, 1.0), (0.2, 3.0)], [S, 0.0, 0.5, 2.0, -0.3],\
+							   [S, 0.0, 1.0, -1.0, 0.37], [True, False], [1, 2, 3, 4, 7], [2, 11, 50])
+checked = 0
+for case in script_cases + [(b, t, st, sp, pol, nc, npnt) for (b, t), st, sp, pol, nc, npnt in grid_cases]:
+	bottom, top, start, stop, polar, ncycle, npoint = case
+	for RemoveNLP in (True, False):
+		ref = sweeplist_legacy(bottom, top, start, stop, polarity = polar, Ncycle = ncycle, Npoint = npoint, RemoveNLP = RemoveNLP)
+		plan = SweepEngine.sweepplan(bottom, top, start, stop, polarity = polar, Ncycle = ncycle, Npoint = npoint, RemoveNLP = RemoveNLP, tol = 0.0)
+		assert np.array_equal(ref, plan.array()), case
+		assert np.array_equal(ref, np.fromiter(plan, float, len(plan))), case
+		if case in script_cases:
+			assert np.array_equal(ref, SweepEngine.sweeplist(bottom, top, start, stop, polarity = polar, Ncycle = ncycle, Npoint = npoint, RemoveNLP = RemoveNLP)), case
+		checked += 1
+print(f'{checked} parameter combinations identical to the legacy sweeplist')
+
+###   TIMING   ###
+for npoint, ncycle in [(200, 2), (10000, 10), (100000, 20), (100000, 200)]:
+	args = (-1.0, 1.0, 0.05, 0.05)
+	kw = dict(polarity = True, Ncycle = ncycle, Npoint = npoint)
+	t_legacy = best_of(lambda: sweeplist_legacy(*args, **kw))
+	t_array = best_of(lambda: SweepEngine.sweeplist(*args, **kw))
+	t_lazy = best_of(lambda: len(SweepEngine.sweepplan(*args, **kw)))
+	print(f'Npoint = {npoint:>6d}, Ncycle = {ncycle:>3d}: legacy {t_legacy*1e3:9.2f} ms | array {t_array*1e3:8.2f} ms ({t_legacy/t_array:5.1f}x)'\
+		  f' | lazy plan + len {t_lazy*1e3:6.2f} ms ({t_legacy/t_lazy:7.1f}x)')
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Write coalescing for the GPIB drivers.
+Inside a `with driver.batch():` block the commands written by the driver are
+collected and sent as one ';'-joined program message, so a setup method costs
+one GPIB addressing cycle instead of one per command. A query flushes the
+pending writes in the same transfer, a block that ends flushes the rest.
+SCPI resolves a header after ';' under the subsystem of the command before it
+(CONF:VOLT:DC 0.1;SENS:VOLT:DC:NPLC 1 is -113 Undefined header), so the SCPI
+drivers batch with root=True, which starts every command at the root with ':'.
+The @batched decorator runs a whole driver method as one batch.
+"""
+
+import functools
+
+MAX_LENGTH = 250    # characters per program message, below the 256 byte input buffer of the SRS instruments
+
+class WriteBatch(object):
+	def __init__(self, send, separator:str = ';', max_length:int = MAX_LENGTH, root:bool = False):
+		'''
+		:param send: function writing one program message to the instrument, e.g. session.write
+		:param separator: joins the commands of a message
+		:param max_length: longest message sent, a longer batch goes out in several messages
+		:param root: SCPI instruments, prefix ':' to the commands not starting with ':' or '*' (common commands),
+			False for the SRS and LakeShore instruments without command tree
+		'''
+		self.send = send
+		self.separator = separator
+		self.root = root
+		self.max_length = max_length
+		self.depth = 0
+		self.pending = []
+		self.length = 0
+
+	def __enter__(self):
+		self.depth += 1
+		return self
+
+	def __exit__(self, *exc):
+		self.depth -= 1
+		if self.depth == 0:
+			self.flush()    # also on an error, like the separate writes the commands before it are sent
+
+	def write(self, command:str, query:bool = False) -> bool:
+		'''
+		:param query: command expects a reply (SR400 queries carry no '?'), the batch is flushed with it
+		:return: True when the command was taken by the batch, False outside a batch block (send it yourself)
+		'''
+		if self.depth == 0:
+			return False
+		command = command.strip().rstrip(self.separator)
+		if self.root and command[:1] not in (':', '*'):
+			command = ':' + command
+		if self.pending and self.length + len(self.separator) + len(command) > self.max_length:
+			self.flush()
+		self.pending.append(command)
+		self.length += len(command) + len(self.separator)
+		if query or ('?' in command):
+			self.flush()
+		return True
+
+	def flush(self):
+		'''
+		Send the pending commands as one message.
+		'''
+		if self.pending:
+			message = self.separator.join(self.pending)
+			self.pending = []
+			self.length = 0
+			self.send(message)
+
+
+def batched(method):
+	'''
+	Decorator running a driver method inside self.batch().
+	'''
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.batch():
+			return method(self, *args, **kwargs)
+	return wrapper
+
+def attach(instrument, batch:WriteBatch):
+	'''
+	Route the writes of a pymeasure instrument through batch, ask() sends its query together with the pending writes.
+	:return: instrument
+	'''
+	write = instrument.write
+	def batched_write(command, **kwargs):
+		if not batch.write(command):
+			write(command, **kwargs)
+	instrument.write = batched_write
+	return instrument